@@ -6,13 +6,25 @@ import zipfile
 from datetime import datetime as dt
 
 import orjson
-import requests
 from celery import Celery
 
 from src.app import RawData, S3FileTransfer
-from src.config import allow_bind_zip_filter, config
+from src.cache import ExportCache, InFlightExports
+from src.country_extracts import CountryExtracts
+from src.config import (
+    allow_bind_zip_filter,
+    config,
+    country_extracts,
+    country_extracts_interval,
+    export_path,
+)
 from src.config import logger as logging
-from src.config import use_s3_to_upload
+from src.config import (
+    stream_s3_upload,
+    use_export_cache,
+    use_request_coalescing,
+    use_s3_to_upload,
+)
 from src.query_builder.builder import format_file_name_str
 from src.validation.models import RawDataOutputType
 
@@ -27,10 +39,22 @@ celery.conf.result_backend = config.get(
 celery.conf.task_serializer = "pickle"
 celery.conf.result_serializer = "pickle"
 celery.conf.accept_content = ["application/json", "application/x-python-serialize"]
+# removing files is kept away from export queue so that it never waits behind exports
+celery.conf.task_routes = {"cleanup_export": {"queue": "cleanup"}}
+# exports estimated to take longer than large_export_seconds are sent here
+LARGE_EXPORTS_QUEUE = "large_exports"
+if country_extracts:
+    # checked often , extracts are rebuilt only when there is new import
+    celery.conf.beat_schedule = {
+        "build_country_extracts": {
+            "task": "build_country_extracts",
+            "schedule": country_extracts_interval,
+        }
+    }
 
 
 @celery.task(bind=True, name="process_raw_data")
-def process_raw_data(self, params):
+def process_raw_data(self, params, request_key=None, estimate=None, grid_lookup=None):
     try:
         start_time = dt.now()
         bind_zip = params.bind_zip if allow_bind_zip_filter else True
@@ -48,67 +72,139 @@ def process_raw_data(self, params):
         )
 
         logging.info("Request %s received", exportname)
+        # taken before extraction so that changes imported while it runs are part of next delta export
+        last_updated = RawData().check_status()
 
-        geom_area, working_dir = RawData(params).extract_current_data(exportname)
         inside_file_size = 0
+        upload_stream = None
         if bind_zip:
             logging.debug("Zip Binding Started !")
-            # saving file in temp directory instead of memory so that zipping file will not eat memory
-            upload_file_path = os.path.join(working_dir, os.pardir, f"{exportname}.zip")
-
-            zf = zipfile.ZipFile(upload_file_path, "w", zipfile.ZIP_DEFLATED)
-            for file_path in pathlib.Path(working_dir).iterdir():
-                zf.write(file_path, arcname=file_path.name)
-                inside_file_size += os.path.getsize(file_path)
+            if use_s3_to_upload and stream_s3_upload:
+                # zip goes to s3 part by part while it is written , nothing is kept on disk
+                file_transfer_obj = S3FileTransfer()
+                upload_stream = file_transfer_obj.open_upload_stream(exportname)
+                zf = zipfile.ZipFile(upload_stream, "w", zipfile.ZIP_DEFLATED)
+            else:
+                # saving file in temp directory instead of memory so that zipping file will not eat memory
+                upload_file_path = os.path.join(export_path, f"{exportname}.zip")
+                zf = zipfile.ZipFile(upload_file_path, "w", zipfile.ZIP_DEFLATED)
+            try:
+                # streamable formats are compressed into zip while they are extracted
+                raw_data = RawData(params)
+                geom_area, working_dir = raw_data.extract_current_data(
+                    exportname, zip_file=zf, grid_lookup=grid_lookup
+                )
+                # rest of formats needs seekable file so they are written to disk first
+                for file_path in pathlib.Path(working_dir).iterdir():
+                    zf.write(file_path, arcname=file_path.name)
+                    os.remove(file_path)
+                # size of exported files is taken from the bytes streamed to zip
+                inside_file_size = sum(info.file_size for info in zf.infolist())
 
-            # Compressing geojson file
-            zf.writestr(
-                "clipping_boundary.geojson", orjson.dumps(dict(params.geometry))
-            )
+                # Compressing geojson file
+                zf.writestr(
+                    "clipping_boundary.geojson", orjson.dumps(dict(params.geometry))
+                )
 
-            zf.close()
+                zf.close()
+            except Exception:
+                try:
+                    zf.close()
+                except Exception:
+                    pass  # zip is discarded , error of export is raised below
+                if upload_stream:
+                    upload_stream.abort()
+                elif os.path.exists(upload_file_path):
+                    os.remove(upload_file_path)
+                raise
             logging.debug("Zip Binding Done !")
         else:
+            raw_data = RawData(params)
+            geom_area, working_dir = raw_data.extract_current_data(
+                exportname, grid_lookup=grid_lookup
+            )
             for file_path in pathlib.Path(working_dir).iterdir():
                 upload_file_path = file_path
                 inside_file_size += os.path.getsize(file_path)
                 break  # only take one file inside dir , if contains many it should be inside zip
         # check if download url will be generated from s3 or not from config
-        if use_s3_to_upload:
-            file_transfer_obj = S3FileTransfer()
-            download_url = file_transfer_obj.upload(
-                upload_file_path,
-                exportname,
-                file_suffix="zip" if bind_zip else params.output_type.lower(),
+        if upload_stream:
+            upload_stream.close()  # completes the multipart upload
+            file_transfer_obj.verify_upload(
+                upload_stream.key, upload_stream.size, etag=upload_stream.etag
             )
+            download_url = file_transfer_obj.get_object_url(upload_stream.key)
+            zip_file_size = upload_stream.size
         else:
-            # give the static file download url back to user served from fastapi static export path
-            download_url = str(upload_file_path)
+            if use_s3_to_upload:
+                file_transfer_obj = S3FileTransfer()
+                download_url = file_transfer_obj.upload(
+                    upload_file_path,
+                    exportname,
+                    file_suffix="zip" if bind_zip else params.output_type.lower(),
+                )
+            else:
+                # give the static file download url back to user served from fastapi static export path
+                download_url = str(upload_file_path)
 
-        # getting file size of zip , units are in bytes converted to mb in response
-        zip_file_size = os.path.getsize(upload_file_path)
-        # watches the status code of the link provided and deletes the file if it is 200
+            # getting file size of zip , units are in bytes converted to mb in response
+            zip_file_size = os.path.getsize(upload_file_path)
         if use_s3_to_upload:
-            watch_s3_upload(download_url, upload_file_path)
-        if use_s3_to_upload or bind_zip:
-            # remove working dir from the machine , if its inside zip / uploaded we no longer need it
+            # upload is already verified , local files are removed by cleanup queue
+            cleanup_export.delay(
+                [str(upload_file_path), working_dir]
+                if not upload_stream
+                else [working_dir],
+                time.time(),
+            )
+        elif bind_zip:
+            # remove working dir from the machine , if its inside zip we no longer need it
             remove_file(working_dir)
         response_time = dt.now() - start_time
         response_time_str = str(response_time)
         logging.info(
             f"Done Export : {exportname} of {round(inside_file_size/1000000)} MB / {geom_area} sqkm in {response_time_str}"
         )
-        return {
+        result = {
             "download_url": download_url,
             "file_name": params.file_name,
             "process_time": response_time_str,
             "query_area": f"{round(geom_area,2)} Sq Km",
             "binded_file_size": f"{round(inside_file_size/1000000,2)} MB",
             "zip_file_size_bytes": zip_file_size,
+            "last_updated": last_updated,
         }
+        if raw_data.fragment_cache_stats:
+            result["fragment_cache"] = raw_data.fragment_cache_stats
+        if estimate:
+            result["estimate"] = estimate
+        if request_key and use_export_cache:
+            try:
+                ExportCache(
+                    s_3=file_transfer_obj.s_3 if use_s3_to_upload else None
+                ).set(
+                    request_key,
+                    self.request.id,
+                    result,
+                    artifact=(
+                        f"{exportname}.{'zip' if bind_zip else params.output_type.lower()}"
+                        if use_s3_to_upload
+                        else str(upload_file_path if bind_zip else working_dir)
+                    ),
+                    size=zip_file_size,
+                    storage="s3" if use_s3_to_upload else "disk",
+                )
+            except Exception as ex:
+                # export is done even if it can't be cached
+                logging.error("Couldn't cache export %s : %s", exportname, ex)
+        return result
 
     except Exception as ex:
         raise ex
+    finally:
+        if request_key and use_request_coalescing:
+            # next identical request starts its own export or gets it from cache
+            InFlightExports().release(request_key, self.request.id)
 
 
 def remove_file(path: str) -> None:
@@ -119,30 +215,45 @@ def remove_file(path: str) -> None:
         logging.error("Error: %s - %s.", ex.filename, ex.strerror)
 
 
-def watch_s3_upload(url: str, path: str) -> None:
-    """Watches upload of s3 either it is completed or not and removes the temp file after completion
+@celery.task(name="cleanup_export")
+def cleanup_export(paths, queued_at):
+    """Removes local files of export after they are uploaded , Runs on cleanup queue so that export workers doesn't wait for it
 
     Args:
-        url (_type_): url generated by the script where data will be available
-        path (_type_): path where temp file is located at
+        paths: files or directories to remove
+        queued_at: time when cleanup was queued , used to measure cleanup latency
     """
-    start_time = time.time()
-    remove_temp_file = True
-    check_call = requests.head(url).status_code
-    if check_call != 200:
-        logging.debug("Upload is not done yet waiting ...")
-        while check_call != 200:  # check until status is not green
-            check_call = requests.head(url).status_code
-            if time.time() - start_time > 300:
-                logging.error(
-                    "Upload time took more than 5 min , Killing watch : %s , URL : %s",
-                    path,
-                    url,
-                )
-                remove_temp_file = False  # don't remove the file if upload fails
-                break
-            time.sleep(3)  # check each 3 second
-    # once it is verfied file is uploaded finally remove the file
-    if remove_temp_file:
-        logging.debug("File is uploaded at %s , flushing out from %s", url, path)
-        os.unlink(path)
+    for path in paths:
+        if os.path.isdir(path):
+            remove_file(path)
+        elif os.path.exists(path):
+            os.unlink(path)
+    logging.info(
+        "Cleaned up %s , %s sec after it was queued",
+        paths,
+        round(time.time() - queued_at, 2),
+    )
+
+
+@celery.task(name="build_country_extracts")
+def build_country_extracts():
+    """Builds extracts of countries listed in country_extracts config , Scheduled with celery beat and only builds countries whose extract is older than latest import"""
+    import_date = RawData().check_status()
+    registry = CountryExtracts()
+    for country_id in country_extracts:
+        entry = registry.get(country_id)
+        if entry and entry["import_date"] == import_date:
+            continue
+        if not registry.lock(country_id):
+            logging.debug("Extract of country %s is being built", country_id)
+            continue
+        directory = registry.directory(country_id, import_date)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            files = RawData.build_country_extract(country_id, directory)
+            registry.set(country_id, import_date, directory, files)
+        except Exception as ex:
+            logging.error("Couldn't build extract of country %s : %s", country_id, ex)
+            remove_file(directory)
+        finally:
+            registry.unlock(country_id)
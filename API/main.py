@@ -32,6 +32,7 @@ from src.config import use_connection_pooling, use_s3_to_upload
 from src.db_session import database_instance
 
 from .raw_data import router as raw_data_router
+from .raw_data import status_cache
 from .tasks import router as tasks_router
 
 # only use sentry if it is specified in config blocks
@@ -109,6 +110,7 @@ async def on_startup():
     try:
         if use_connection_pooling:
             database_instance.connect()
+        status_cache.start()  # keeps database status in memory for /status/
     except Exception as e:
         logging.error(e)
         raise e
@@ -117,6 +119,7 @@ async def on_startup():
 @app.on_event("shutdown")
 def on_shutdown():
     """Closing all the threads connection from pooling before shuting down the api"""
+    status_cache.stop()
     if use_connection_pooling:
         logging.debug("Shutting down connection pool")
         database_instance.close_all_connection_pool()
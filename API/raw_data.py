@@ -20,17 +20,26 @@
 """[Router Responsible for Raw data API ]
 """
 import os
-import shutil
-import time
+from uuid import uuid4
 
-import requests
 from fastapi import APIRouter, Body, Request
 from fastapi.responses import JSONResponse
+from celery.result import AsyncResult
 from fastapi_versioning import version
 from geojson import FeatureCollection
+from pydantic.datetime_parse import parse_datetime
 
-from src.app import RawData
-from src.config import export_rate_limit, limiter
+from src.app import RawData, StatusCache
+from src.cache import ExportCache, InFlightExports, request_key
+from src.config import (
+    export_rate_limit,
+    large_export_seconds,
+    limiter,
+    max_export_seconds,
+    use_export_cache,
+    use_export_estimate,
+    use_request_coalescing,
+)
 from src.config import logger as logging
 from src.validation.models import (
     RawDataCurrentParams,
@@ -39,54 +48,24 @@ from src.validation.models import (
     StatusResponse,
 )
 
-from .api_worker import process_raw_data
+from .api_worker import LARGE_EXPORTS_QUEUE, celery, process_raw_data
 
 router = APIRouter(prefix="")
 
+status_cache = StatusCache()
+
 
 @router.get("/status/", response_model=StatusResponse)
 @version(1)
 def check_database_last_updated():
-    """Gives status about how recent the osm data is , it will give the last time that database was updated completely"""
-    result = RawData().check_status()
-    return {"last_updated": result}
-
-
-def remove_file(path: str) -> None:
-    """Used for removing temp file dir and its all content after zip file is delivered to user"""
-    try:
-        shutil.rmtree(path)
-    except OSError as ex:
-        logging.error("Error: %s - %s.", ex.filename, ex.strerror)
-
-
-def watch_s3_upload(url: str, path: str) -> None:
-    """Watches upload of s3 either it is completed or not and removes the temp file after completion
-
-    Args:
-        url (_type_): url generated by the script where data will be available
-        path (_type_): path where temp file is located at
-    """
-    start_time = time.time()
-    remove_temp_file = True
-    check_call = requests.head(url).status_code
-    if check_call != 200:
-        logging.debug("Upload is not done yet waiting ...")
-        while check_call != 200:  # check until status is not green
-            check_call = requests.head(url).status_code
-            if time.time() - start_time > 300:
-                logging.error(
-                    "Upload time took more than 5 min , Killing watch : %s , URL : %s",
-                    path,
-                    url,
-                )
-                remove_temp_file = False  # don't remove the file if upload fails
-                break
-            time.sleep(3)  # check each 3 second
-    # once it is verfied file is uploaded finally remove the file
-    if remove_temp_file:
-        logging.debug("File is uploaded at %s , flushing out from %s", url, path)
-        os.unlink(path)
+    """Gives status about how recent the osm data is , it will give the last time that database was updated completely , Served from memory and Age header tells how old it is in seconds"""
+    if status_cache.last_updated is None:
+        # background refresh hasn't finished yet
+        status_cache.refresh()
+    return JSONResponse(
+        {"last_updated": status_cache.last_updated},
+        headers={"Age": str(int(status_cache.age))},
+    )
 
 
 @router.post("/snapshot/", response_model=SnapshotResponse)
@@ -419,9 +398,97 @@ def get_osm_current_snapshot_as_file(
         }
     2. Now navigate to /tasks/ with your task id to track progress and result
 
+    Pass since or sinceExport to get only features created or modified after previous export , lastUpdated of export result is the time to pass as since for the next one
+
     """
-    task = process_raw_data.delay(params)
-    return JSONResponse({"task_id": task.id, "track_link": f"/tasks/status/{task.id}/"})
+    if params.since_export:
+        previous_export = AsyncResult(params.since_export, app=celery)
+        if previous_export.state != "SUCCESS" or not previous_export.result.get(
+            "last_updated"
+        ):
+            return JSONResponse(
+                {"detail": "Previous export is not finished or has expired"},
+                status_code=404,
+            )
+        # data of previous export was as recent as database at that time
+        params.since = parse_datetime(previous_export.result["last_updated"])
+        params.since_export = None
+    key = None
+    if use_export_cache or use_request_coalescing:
+        if status_cache.last_updated is None:
+            status_cache.refresh()
+        key = request_key(params, status_cache.last_updated)
+    if use_export_cache:
+        # expired entries are removed by worker , it has s3 client and disk of artifacts
+        cached = ExportCache(read_only=True).get(key)
+        if cached:
+            # same export is already done after last import
+            return JSONResponse(
+                {
+                    "task_id": cached["task_id"],
+                    "track_link": f"/tasks/status/{cached['task_id']}/",
+                    "download_url": cached["result"]["download_url"],
+                }
+            )
+    estimate, grid_lookup, options = None, None, {}
+    if use_export_estimate:
+        raw_data = RawData(params)
+        try:
+            # lookup is passed to worker so that it doesn't look up same geometry again
+            grid_lookup = RawData.get_grid_id(
+                params.geometry, raw_data.cur, params.country_export
+            )
+            estimate = raw_data.estimate_current_data(grid_lookup)
+        finally:
+            raw_data.cur.close()
+            RawData.close_con(raw_data.con)
+        if max_export_seconds and estimate["seconds"] > max_export_seconds:
+            return JSONResponse(
+                {
+                    "detail": f"Export is estimated to take {estimate['seconds']} sec , more than {max_export_seconds} sec allowed . Use smaller area or more filters",
+                    "estimate": estimate,
+                },
+                status_code=400,
+            )
+        if large_export_seconds and estimate["seconds"] > large_export_seconds:
+            # long exports don't hold workers of small ones
+            options["queue"] = LARGE_EXPORTS_QUEUE
+    task_id = str(uuid4())
+    if use_request_coalescing:
+        in_flight_exports = InFlightExports()
+        running_task_id = in_flight_exports.claim(key, task_id)
+        if running_task_id != task_id:
+            # same export is already running , request gets its result
+            return JSONResponse(
+                {
+                    "task_id": running_task_id,
+                    "track_link": f"/tasks/status/{running_task_id}/",
+                }
+            )
+    try:
+        process_raw_data.apply_async(
+            args=(params, key, estimate, grid_lookup), task_id=task_id, **options
+        )
+    except Exception:
+        if use_request_coalescing:
+            in_flight_exports.release(key, task_id)
+        raise
+    response = {"task_id": task_id, "track_link": f"/tasks/status/{task_id}/"}
+    if estimate:
+        response["estimate"] = estimate
+    return JSONResponse(response)
+
+
+@router.get("/snapshot/cache/")
+@version(1)
+def get_export_cache_stats():
+    """Gives hit rate and size of export cache along with no of requests attached to running exports"""
+    if not (use_export_cache or use_request_coalescing):
+        return JSONResponse({"detail": "Export cache is not enabled"}, status_code=404)
+    stats = ExportCache(read_only=True).stats() if use_export_cache else {}
+    if use_request_coalescing:
+        stats.update(InFlightExports().stats())
+    return stats
 
 
 @router.post("/snapshot/plain/", response_model=FeatureCollection)
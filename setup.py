@@ -19,6 +19,7 @@ setuptools.setup(
         "orjson==3.6.7",
         "slowapi==0.1.6",
     ],
+    extras_require={"geometry_index": ["shapely>=2.0"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "Topic :: Software Development :: Libraries :: Python Modules",
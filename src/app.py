@@ -18,11 +18,15 @@
 # <info@hotosm.org>
 """Page contains Main core logic of app"""
 
+import multiprocessing
 import os
+import shutil
 import subprocess
 import sys
 import threading
 import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from json import dumps
 from json import loads as json_loads
 
@@ -38,22 +42,66 @@ from src.config import (
     AWS_ACCESS_KEY_ID,
     AWS_SECRET_ACCESS_KEY,
     BUCKET_NAME,
+    country_extract_formats,
+    country_extracts,
+    estimate_rows_per_second,
     export_path,
+    extraction_engine,
     get_db_connection_params,
     grid_index_threshold,
     level,
+    parallel_table_extraction,
+    parameterized_queries,
+    partition_workers,
+    s3_upload_part_size,
+    status_refresh_interval,
+    use_fragment_cache,
+    use_geometry_index,
 )
 from src.config import logger as logging
 from src.config import use_connection_pooling
+from src.cache import FragmentCache
+from src.country_extracts import (
+    FEATURE_COLLECTION_FOOTER,
+    FEATURE_COLLECTION_HEADER,
+    CountryExtracts,
+    FeatureFilter,
+)
+from src.geometry_index import GEOMETRY_INDEX_SUPPORT, GeometryIndex
 from src.query_builder.builder import (
     check_last_updated_rawdata,
+    execute_prepared_query,
     extract_geometry_type_query,
+    extraction_table_queries,
     get_country_id_query,
+    get_extraction_tables,
+    get_feature_query,
     get_grid_id_query,
+    get_grid_partition_query,
+    prepare_query,
     raw_currentdata_extraction_query,
     raw_extract_plain_geojson,
 )
-from src.validation.models import RawDataOutputType
+from src.validation.models import RawDataCurrentParams, RawDataOutputType
+from src.writers.flatgeobuf import FlatGeobufWriter
+from src.writers.geopackage import GeoPackageWriter
+from src.writers.shapefile import (
+    SHAPE_POINT,
+    SHAPE_POLYGON,
+    SHAPE_POLYLINE,
+    ShapefileWriter,
+)
+
+if use_geometry_index:
+    if GEOMETRY_INDEX_SUPPORT:
+        geometry_index = GeometryIndex()  # one per process
+    else:
+        logging.error(
+            "shapely is required for geometry_index , looking up grid and country from database"
+        )
+        geometry_index = None
+else:
+    geometry_index = None
 
 # import instance for pooling
 if use_connection_pooling:
@@ -69,6 +117,50 @@ global LOCAL_CON_POOL
 # getting the pool instance which was fireup when API is started
 LOCAL_CON_POOL = database_instance
 
+# buffer size used while reading COPY output from database
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# size of output relative to row width of database and time relative to geojson of each output type , rough figures used for export estimates
+OUTPUT_TYPE_COST = {
+    "geojson": (2.5, 1),
+    "csv": (1.5, 0.5),
+    "fgb": (1.2, 1.5),
+    "shp": (1.2, 2),
+    "gpkg": (1.5, 2),
+    "kml": (3, 3),
+    "sql": (2, 3),
+    "mbtiles": (1, 5),
+}
+
+
+def estimate_export(table_estimates, output_type):
+    """Turns rows and row width estimated by planner for each table into expected rows , bytes and seconds of export
+
+    Args:
+        table_estimates: list of (table , rows , row width in bytes)
+        output_type: output type of export
+
+    Returns:
+        dict of rows , bytes , seconds and rows of each table
+    """
+    size_factor, time_factor = OUTPUT_TYPE_COST.get(output_type, (2, 2))
+    tables = {}
+    rows, size = 0, 0
+    for table, table_rows, width in table_estimates:
+        tables[table] = tables.get(table, 0) + table_rows
+        rows += table_rows
+        size += table_rows * width
+    return {
+        "rows": rows,
+        "bytes": int(size * size_factor),
+        "seconds": round(rows * time_factor / estimate_rows_per_second, 1),
+        "tables": tables,
+    }
+
+
+# names of statements prepared on each connection , prepared statements live as long as the connection does
+PREPARED_STATEMENTS = weakref.WeakKeyDictionary()
+
 
 def print_psycopg2_exception(err):
     """
@@ -143,6 +235,66 @@ def run_ogr2ogr_cmd(cmd):
         raise ex
 
 
+def open_output(path, zip_file=None):
+    """Opens binary file to write export , If zip_file is passed it is written as entry of the zip (named after path) instead of disk so that compression happens while data is streamed"""
+    if zip_file is not None:
+        return zip_file.open(os.path.basename(path), "w", force_zip64=True)
+    return open(path, "wb")
+
+
+def wkb_query(query, schema, columns, force_polygon_cw=False, with_envelope=False):
+    """Wraps ogr export query to select geometry as wkb followed by columns , columns missing in schema of the query are selected as null , with_envelope adds min_x , min_y , max_x , max_y of geometry after wkb"""
+    selects = []
+    for column, column_type in columns.items():
+        cast = "::text" if column_type == "str" else ""
+        if column in schema:
+            # column aliases are not quoted in builder so postgres keeps them in lowercase
+            selects.append(f"""t."{column.lower()}"{cast}""")
+        else:
+            selects.append(f"null{cast if cast else '::bigint'}")
+    if with_envelope:
+        selects = [
+            "ST_XMin(t.geom) , ST_YMin(t.geom) , ST_XMax(t.geom) , ST_YMax(t.geom)"
+        ] + selects
+    geom = "ST_ForcePolygonCW(t.geom)" if force_polygon_cw else "t.geom"
+    return f"""select ST_AsBinary({geom}) , {' , '.join(selects)} from ({query}) t"""
+
+
+def extract_partition(jobs):
+    """Runs table queries of one partition on its own connection , Runs inside process pool so it doesn't use connection pool of parent process
+
+    Args:
+        jobs: list of (query , path) , query gives osm_id , whether row crosses partition and geojson feature of each row , they are written to its path separated by tab so that parent can remove duplicates
+
+    Returns:
+        no of rows written
+    """
+    con, cur = Database(get_db_connection_params("RAW_DATA")).connect()
+    cur.close()
+    row_count = 0
+    try:
+        for query, path in jobs:
+            # path is added to fragment cache by parent , it should exist only once it is complete
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as part_file:
+                    with con.cursor(name="fetch_partition") as cursor:
+                        cursor.itersize = 1000
+                        cursor.execute(query)
+                        for osm_id, crossing, feature in cursor:
+                            part_file.write(f"{osm_id}\t{int(crossing)}\t{feature}\n")
+                            row_count += 1
+            except Exception:
+                # partial file is never completed , it would be left in cache directory
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            os.replace(temp_path, path)
+    finally:
+        con.close()
+    return row_count
+
+
 class Database:
     """Database class is used to connect with your database , run query  and get result from it . It has all tests and validation inside class"""
 
@@ -236,17 +388,23 @@ class RawData:
             #     self.params = RawDataCurrentParams(**parameters)
             # else:
             self.params = parameters
+        self.fragment_cache_stats = None  # hits and misses of partitioned export
+        self.con = RawData.get_connection(dbdict)
+        self.cur = self.con.cursor(cursor_factory=DictCursor)
+
+    @staticmethod
+    def get_connection(dbdict=None):
+        """Gives connection from pool if connection pooling is configured else opens new connection"""
         # only use connection pooling if it is configured in config file
         if use_connection_pooling:
             # if database credentials directly from class is not passed grab from pool
-            pool_conn = LOCAL_CON_POOL.get_conn_from_pool()
-            self.con, self.cur = pool_conn, pool_conn.cursor(cursor_factory=DictCursor)
-        else:
-            # else use our default db class
-            if not dbdict:
-                dbdict = get_db_connection_params("RAW_DATA")
-            self.d_b = Database(dict(dbdict))
-            self.con, self.cur = self.d_b.connect()
+            return LOCAL_CON_POOL.get_conn_from_pool()
+        # else use our default db class
+        if not dbdict:
+            dbdict = get_db_connection_params("RAW_DATA")
+        con, cur = Database(dict(dbdict)).connect()
+        cur.close()
+        return con
 
     @staticmethod
     def close_con(con):
@@ -259,71 +417,127 @@ class RawData:
                 con.close()
 
     @staticmethod
-    def ogr_export_shp(point_query, line_query, poly_query, working_dir, file_name):
-        """Function written to support ogr type extractions as well , In this way we will be able to support all file formats supported by Ogr , Currently it is slow when dataset gets bigger as compared to our own conversion method but rich in feature and data types even though it is slow"""
-        db_items = get_db_connection_params("RAW_DATA")
-        if point_query:
-            query_path = os.path.join(working_dir, "point.sql")
-            # writing to .sql to pass in ogr2ogr because we don't want to pass too much argument on command with sql
-            with open(query_path, "w", encoding="UTF-8") as file:
-                file.write(point_query)
-            # standard file path for the generation
-            point_file_path = os.path.join(working_dir, f"{file_name}_point.shp")
-            # command for ogr2ogr to generate file
-
-            cmd = """ogr2ogr -overwrite -f "ESRI Shapefile" {export_path} PG:"host={host} port={port} user={username} dbname={db} password={password}" -sql @"{pg_sql_select}" -lco ENCODING=UTF-8 -progress""".format(
-                export_path=point_file_path,
-                host=db_items.get("host"),
-                port=db_items.get("port"),
-                username=db_items.get("user"),
-                db=db_items.get("database"),
-                password=db_items.get("password"),
-                pg_sql_select=query_path,
-            )
-            logging.debug("Calling ogr2ogr-Point Shapefile")
-            run_ogr2ogr_cmd(cmd)
-            # clear query file we don't need it anymore
-            os.remove(query_path)
-
-        if line_query:
-            query_path = os.path.join(working_dir, "line.sql")
-            # writing to .sql to pass in ogr2ogr because we don't want to pass too much argument on command with sql
-            with open(query_path, "w", encoding="UTF-8") as file:
-                file.write(line_query)
-            line_file_path = os.path.join(working_dir, f"{file_name}_line.shp")
-            cmd = """ogr2ogr -overwrite -f "ESRI Shapefile" {export_path} PG:"host={host} port={port} user={username} dbname={db} password={password}" -sql @"{pg_sql_select}" -lco ENCODING=UTF-8 -progress""".format(
-                export_path=line_file_path,
-                host=db_items.get("host"),
-                port=db_items.get("port"),
-                username=db_items.get("user"),
-                db=db_items.get("database"),
-                password=db_items.get("password"),
-                pg_sql_select=query_path,
-            )
-            logging.debug("Calling ogr2ogr-Line Shapefile")
-            run_ogr2ogr_cmd(cmd)
-            # clear query file we don't need it anymore
-            os.remove(query_path)
-
-        if poly_query:
-            query_path = os.path.join(working_dir, "poly.sql")
-            poly_file_path = os.path.join(working_dir, f"{file_name}_poly.shp")
-            # writing to .sql to pass in ogr2ogr because we don't want to pass too much argument on command with sql
-            with open(query_path, "w", encoding="UTF-8") as file:
-                file.write(poly_query)
-            cmd = """ogr2ogr -overwrite -f "ESRI Shapefile" {export_path} PG:"host={host} port={port} user={username} dbname={db} password={password}" -sql @"{pg_sql_select}" -lco ENCODING=UTF-8 -progress""".format(
-                export_path=poly_file_path,
-                host=db_items.get("host"),
-                port=db_items.get("port"),
-                username=db_items.get("user"),
-                db=db_items.get("database"),
-                password=db_items.get("password"),
-                pg_sql_select=query_path,
-            )
-            logging.debug("Calling ogr2ogr-Poly Shapefile")
-            run_ogr2ogr_cmd(cmd)
-            # clear query file we don't need it anymore
-            os.remove(query_path)
+    def query2shapefile(con, query, schema, shape_type, file_path):
+        """Streams features of query from server side cursor and writes shapefile without ogr2ogr , Files are split when they reach 2 GB
+
+        Args:
+            con: database connection
+            query: ogr export query of single geometry type
+            schema: column schema generated by query builder for the query
+            shape_type: shapefile shape type (point , polyline or polygon)
+            file_path: path of shapefile without extension
+
+        Returns:
+            no of features written
+        """
+        start_time = time.time()
+        # shapefile expects outer ring of polygon in clockwise direction
+        shp_query = wkb_query(query, schema, schema, force_polygon_cw=True)
+        logging.debug(shp_query)
+        writer = ShapefileWriter(file_path, shape_type, schema)
+        try:
+            with con.cursor(name="fetch_shp") as cursor:  # using server side cursor
+                cursor.itersize = 1000
+                cursor.execute(shp_query)
+                for row in cursor:
+                    writer.write(row[0], row[1:])
+                cursor.close()
+        finally:
+            writer.close()
+        logging.debug(
+            "Shapefile %s Done : %s rows in %s parts in %s sec",
+            file_path,
+            writer.total_count,
+            len(writer.paths),
+            round(time.time() - start_time, 2),
+        )
+        return writer.total_count
+
+    @staticmethod
+    def query2flatgeobuf(con, queries, file_path, zip_file=None):
+        """Streams features of queries from server side cursor and writes flatgeobuf with spatial index without ogr2ogr
+
+        Args:
+            con: database connection
+            queries: list of (ogr export query , schema) , features of all queries goes to same layer
+            file_path: path of flatgeobuf file
+            zip_file: zip archive to write the file into instead of disk
+
+        Returns:
+            no of features written
+        """
+        start_time = time.time()
+        columns = {}
+        for _, schema in queries:
+            columns.update(schema)
+        writer = FlatGeobufWriter(file_path, columns)
+        try:
+            for query, schema in queries:
+                fgb_query = wkb_query(query, schema, columns)
+                logging.debug(fgb_query)
+                with con.cursor(name="fetch_fgb") as cursor:  # using server side cursor
+                    cursor.itersize = 1000
+                    cursor.execute(fgb_query)
+                    for row in cursor:
+                        writer.write(row[0], row[1:])
+                    cursor.close()
+        except Exception:
+            # partial file is not indexed and written , error of query is raised as it is
+            writer.abort()
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+        with open_output(file_path, zip_file) as f:
+            writer.close(f)
+        logging.debug(
+            "FlatGeobuf %s Done : %s rows in %s sec",
+            file_path,
+            writer.feature_count,
+            round(time.time() - start_time, 2),
+        )
+        return writer.feature_count
+
+    @staticmethod
+    def query2geopackage(con, tables, file_path):
+        """Streams features of queries from server side cursor and writes each of them to its own table of geopackage without ogr2ogr
+
+        Args:
+            con: database connection
+            tables: list of (table name , geometry type , ogr export query , schema)
+            file_path: path of geopackage file
+
+        Returns:
+            no of features written
+        """
+        start_time = time.time()
+        writer = GeoPackageWriter(file_path)
+        count = 0
+        try:
+            for name, geometry_type, query, schema in tables:
+                writer.create_table(name, geometry_type, schema)
+                gpkg_query = wkb_query(query, schema, schema, with_envelope=True)
+                logging.debug(gpkg_query)
+                with con.cursor(
+                    name="fetch_gpkg"
+                ) as cursor:  # using server side cursor
+                    cursor.itersize = 1000
+                    cursor.execute(gpkg_query)
+                    for row in cursor:
+                        writer.write(name, row[0], row[5:], envelope=row[1:5])
+                        count += 1
+                    cursor.close()
+        except Exception:
+            # partial geopackage is not committed , error of query is raised as it is
+            writer.abort()
+            raise
+        writer.close()
+        logging.debug(
+            "GeoPackage %s Done : %s rows in %s sec",
+            file_path,
+            count,
+            round(time.time() - start_time, 2),
+        )
+        return count
 
     @staticmethod
     def ogr_export(query, outputtype, working_dir, dump_temp_path, params):
@@ -411,34 +625,305 @@ class RawData:
         os.remove(query_path)
 
     @staticmethod
-    def query2geojson(con, extraction_query, dump_temp_file_path):
-        """Function written from scratch without being dependent on any library, Provides better performance for geojson binding"""
+    def query2geojson(
+        con,
+        extraction_query,
+        dump_temp_file_path,
+        engine=None,
+        zip_file=None,
+        query_params=None,
+    ):
+        """Function written from scratch without being dependent on any library, Provides better performance for geojson binding
+
+        Args:
+            con: database connection
+            extraction_query: query which returns one geojson feature per row
+            dump_temp_file_path: path of the geojson file to write
+            engine: cursor / copy , defaults to extraction_engine from config
+            zip_file: zip archive to write the file into instead of disk
+            query_params: bind parameters of extraction_query
+
+        Returns:
+            no of features written
+        """
         # creating geojson file
-        pre_geojson = """{"type": "FeatureCollection","features": ["""
-        post_geojson = """]}"""
-        logging.debug(extraction_query)
+        pre_geojson = b"""{"type": "FeatureCollection","features": ["""
+        post_geojson = b"""]}"""
         # writing to the file
         # directly writing query result to the file one by one without holding them in object so that it will not eat up our memory
-        with open(dump_temp_file_path, "a", encoding="utf-8") as f:
+        with open_output(dump_temp_file_path, zip_file) as f:
             f.write(pre_geojson)
+            row_count = RawData.query2features(
+                con, extraction_query, f, engine, query_params
+            )
+            # close the writing geojson with last part
+            f.write(post_geojson)
+        return row_count
+
+    @staticmethod
+    def query2features(
+        con, extraction_query, f, engine=None, query_params=None, separator=b","
+    ):
+        """Writes the geojson features returned by query to binary file object separated by separator , without featurecollection header and footer , query_params are bound to query if passed
+
+        Returns:
+            no of features written
+        """
+        engine = engine if engine else extraction_engine
+        logging.debug(extraction_query)
+        start_time = time.time()
+        if engine == "copy":
+            # csv format does not escape backslash like text format does, quote and delimiter are set to characters which never appears in geojson so rows are written as it is
+            copy_query = f"""COPY ({extraction_query}) TO STDOUT WITH (FORMAT CSV, DELIMITER E'\\x02', QUOTE E'\\x01')"""
+            copy_stream = GeojsonCopyStream(f, separator)
+            with con.cursor() as cursor:
+                if query_params:
+                    # COPY doesn't accept parameters , they are bound on client side
+                    copy_query = cursor.mogrify(copy_query, query_params).decode()
+                cursor.copy_expert(copy_query, copy_stream, size=COPY_CHUNK_SIZE)
+            row_count = copy_stream.row_count
+        else:
+            row_count = 0
             logging.debug("Server side Cursor Query Sent with 1000 Chunk Size")
             with con.cursor(name="fetch_raw") as cursor:  # using server side cursor
                 cursor.itersize = (
                     1000  # chunk size to get 1000 row at a time in client side
                 )
-                cursor.execute(extraction_query)
-                first = True
+                cursor.execute(extraction_query, query_params)
                 for row in cursor:
-                    if first:
-                        first = False
-                        f.write(row[0])
-                    else:
-                        f.write(",")
-                        f.write(row[0])
+                    if row_count > 0:
+                        f.write(separator)
+                    f.write(row[0].encode("utf-8"))
+                    row_count += 1
                 cursor.close()  # closing connection to avoid memory issues
-                # close the writing geojson with last part
-            f.write(post_geojson)
-        logging.debug("Server side Query Result  Post Processing Done")
+        logging.debug(
+            "Query Result Post Processing Done with %s engine : %s rows in %s sec",
+            engine,
+            row_count,
+            round(time.time() - start_time, 2),
+        )
+        return row_count
+
+    @staticmethod
+    def query2csv(
+        con, extraction_query, dump_temp_file_path, zip_file=None, query_params=None
+    ):
+        """Exports query as csv with header using COPY , quoting and encoding is done by postgres and output is streamed to file as it is , query_params are bound to query if passed
+
+        Returns:
+            no of rows written
+        """
+        start_time = time.time()
+        copy_query = f"""COPY ({extraction_query}) TO STDOUT WITH CSV HEADER"""
+        logging.debug(copy_query)
+        with open_output(dump_temp_file_path, zip_file) as f:
+            with con.cursor() as cursor:
+                if query_params:
+                    copy_query = cursor.mogrify(copy_query, query_params).decode()
+                cursor.copy_expert(copy_query, f, size=COPY_CHUNK_SIZE)
+                row_count = cursor.rowcount
+        logging.debug(
+            "CSV %s Done : %s rows in %s sec",
+            dump_temp_file_path,
+            row_count,
+            round(time.time() - start_time, 2),
+        )
+        return row_count
+
+    @staticmethod
+    def query2geojson_parallel(
+        query_list,
+        dump_temp_file_path,
+        engine=None,
+        zip_file=None,
+        query_params=None,
+        table_names=None,
+    ):
+        """Runs query of each table on its own connection at the same time and joins their results to single geojson in the order of query_list
+
+        Args:
+            query_list: list of table queries returning one geojson feature per row
+            dump_temp_file_path: path of the geojson file to write
+            engine: cursor / copy , defaults to extraction_engine from config
+            zip_file: zip archive to write the file into instead of disk , parts are still kept on disk
+            query_params: bind parameters shared by queries of query_list
+            table_names: table of each query , used in timing logs
+
+        Returns:
+            no of features written
+        """
+
+        def write_part(index):
+            part_path = f"{dump_temp_file_path}.part{index}"
+            start_time = time.time()
+            con = RawData.get_connection()
+            try:
+                with open(part_path, "wb") as part_file:
+                    row_count = RawData.query2features(
+                        con, query_list[index], part_file, engine, query_params
+                    )
+            finally:
+                RawData.close_con(con)
+            logging.debug(
+                "Table query %s : %s rows in %s sec",
+                table_names[index] if table_names else index,
+                row_count,
+                round(time.time() - start_time, 2),
+            )
+            return part_path, row_count
+
+        with ThreadPoolExecutor(max_workers=len(query_list)) as executor:
+            # map keeps the order of query_list so output is deterministic
+            parts = list(executor.map(write_part, range(len(query_list))))
+
+        total_rows = 0
+        with open_output(dump_temp_file_path, zip_file) as f:
+            f.write(b"""{"type": "FeatureCollection","features": [""")
+            for part_path, row_count in parts:
+                if row_count > 0:
+                    if total_rows > 0:
+                        f.write(b",")
+                    with open(part_path, "rb") as part_file:
+                        shutil.copyfileobj(part_file, f)
+                    total_rows += row_count
+                os.remove(part_path)
+            f.write(b"""]}""")
+        return total_rows
+
+    @staticmethod
+    def query2geojson_partitioned(
+        partitions,
+        dump_temp_file_path,
+        workers=None,
+        zip_file=None,
+        fragment_cache=None,
+    ):
+        """Runs partitions of the extraction in process pool and writes their features to geojson as each partition finishes , Features crossing partitions are written only once
+
+        Args:
+            partitions: list of (table query list , fragment keys) from get_partition_queries
+            dump_temp_file_path: path of the geojson file to write
+            workers: no of processes , defaults to partition_workers from config
+            zip_file: zip archive to write the file into instead of disk , parts are still kept on disk
+            fragment_cache: FragmentCache , table queries of fully covered grid cells are taken from it or written to it
+
+        Returns:
+            no of features written
+        """
+        workers = workers if workers else partition_workers
+        start_time = time.time()
+        # only features crossing partitions are kept , others can't be extracted twice
+        crossing_keys = set()
+        row_count, duplicate_count = 0, 0
+
+        def write_rows(f, sources):
+            nonlocal row_count, duplicate_count
+            for query_index, path in sources:
+                with open(path, encoding="utf-8") as part_file:
+                    for line in part_file:
+                        osm_id, crossing, feature = line.rstrip("\n").split("\t", 2)
+                        if crossing == "1":
+                            # same table query has same index in every partition
+                            key = (query_index, int(osm_id))
+                            if key in crossing_keys:
+                                duplicate_count += 1
+                                continue
+                            crossing_keys.add(key)
+                        if row_count > 0:
+                            f.write(b",")
+                        f.write(feature.encode("utf-8"))
+                        row_count += 1
+                os.remove(path)
+
+        with open_output(dump_temp_file_path, zip_file) as f:
+            f.write(b"""{"type": "FeatureCollection","features": [""")
+            # spawn is used so that child process doesn't inherit database connections of worker
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = {}
+                for index, (query_list, fragment_keys) in enumerate(partitions):
+                    jobs, sources, misses = [], [], []
+                    for query_index, query in enumerate(query_list):
+                        # every part is read from file of its own , cached fragments can be evicted by other exports meanwhile
+                        path = f"{dump_temp_file_path}.part{index}.{query_index}"
+                        sources.append((query_index, path))
+                        if fragment_cache and fragment_keys:
+                            if fragment_cache.get(fragment_keys[query_index], path):
+                                continue
+                            misses.append((fragment_keys[query_index], path))
+                        jobs.append((query, path))
+                    if jobs:
+                        futures[executor.submit(extract_partition, jobs)] = (
+                            sources,
+                            misses,
+                        )
+                    else:
+                        write_rows(f, sources)  # every table is in cache
+                for future in as_completed(futures):
+                    future.result()
+                    sources, misses = futures[future]
+                    for key, path in misses:
+                        fragment_cache.put(key, path)
+                    write_rows(f, sources)
+            f.write(b"""]}""")
+        if fragment_cache:
+            fragment_cache.evict()
+        logging.debug(
+            "Partitioned extraction of %s partitions with %s workers Done : %s rows , %s duplicates removed , fragment cache %s in %s sec",
+            len(partitions),
+            workers,
+            row_count,
+            duplicate_count,
+            fragment_cache.stats() if fragment_cache else None,
+            round(time.time() - start_time, 2),
+        )
+        return row_count
+
+    @staticmethod
+    def get_partition_queries(params, con, geometry_dump):
+        """Splits the geometry with grid and generates table queries for each grid part
+
+        Returns:
+            list of (table query list , fragment keys) for each partition , fragment keys are given only for grid cells fully covered by geometry
+        """
+        with con.cursor() as cur:
+            cur.execute(get_grid_partition_query(geometry_dump))
+            partitions = cur.fetchall()
+            cur.execute(check_last_updated_rawdata())
+            import_date = str(cur.fetchall()[0][0])
+        partition_queries = []
+        for poly_id, part_geometry_dump, covered in partitions:
+            if part_geometry_dump is None or '"coordinates":[]' in part_geometry_dump:
+                continue  # geometry only touches the grid
+            query_list = [
+                get_feature_query(query, part_geometry_dump, params.precision)
+                for query in raw_currentdata_extraction_query(
+                    params,
+                    g_id=None,
+                    c_id=None,
+                    geometry_dump=part_geometry_dump,
+                    ogr_export=True,
+                    as_list=True,
+                )
+            ]
+            fragment_keys = (
+                [FragmentCache.key(query, import_date) for query in query_list]
+                if covered
+                else None
+            )
+            partition_queries.append((query_list, fragment_keys))
+        logging.debug("Geometry is split into %s partitions", len(partition_queries))
+        return partition_queries
+
+    @staticmethod
+    def execute_prepared(cur, name, query, args, param_types=("text",)):
+        """Executes query as prepared statement , statement is prepared on the first call for each connection and later calls only send name and args so parsing and planning is skipped"""
+        prepared = PREPARED_STATEMENTS.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(prepare_query(name, query, param_types))
+            prepared.add(name)
+        cur.execute(execute_prepared_query(name, len(args)), args)
 
     @staticmethod
     def get_grid_id(geom, cur, country_export=False):
@@ -461,34 +946,48 @@ class RawData:
 
         if int(geom_area) > grid_index_threshold or country_export:
             # this will be applied only when polygon gets bigger we will be slicing index size to search
-            country_query = get_country_id_query(geometry_dump)
-            # check if polygon intersects two countries
-            check_country = cur.execute(country_query)
-            count = 0
-            result_country = cur.fetchall()
+            if geometry_index:
+                # tables are looked up in memory , database is touched only to check replication status
+                geometry_index.refresh(cur)
+                geometry_shape = geometry_index.to_shape(json_loads(geom.json()))
+                result_country = geometry_index.country_ids(geometry_shape)
+            elif parameterized_queries:
+                RawData.execute_prepared(
+                    cur,
+                    "country_lookup",
+                    get_country_id_query(None, prepared=True),
+                    (geometry_dump,),
+                )
+                result_country = cur.fetchall()
+            else:
+                country_query = get_country_id_query(geometry_dump)
+                # check if polygon intersects two countries
+                cur.execute(country_query)
+                result_country = cur.fetchall()
             logging.debug(result_country)
-            for s in result_country:
-                count += 1
+            count = len(result_country)
             if count == 1:  # intersects with only one country
-                for row in result_country:
-                    country = row[0]
-                    break
+                country = result_country[0][0]
+            elif country_export and count > 0:  # force country index
+                country = result_country[0][0]  # get which has higher % intersection
             else:  # intersect with multiple countries or no country ,  use grid index instead
-                if country_export:  # force country index
-                    if count == 0:
-                        # geom didn't intersected with any country
-                        logging.warning("Geom didn't intersect with any country")
-                        # use default grid index
-                        cur.execute(get_grid_id_query(geometry_dump))
-                        grid_id = cur.fetchall()
-                    else:
-                        for row in result_country:
-                            country = row[0]  # get which has higher % intersection
-                            break
+                if country_export:
+                    # geom didn't intersected with any country
+                    logging.warning("Geom didn't intersect with any country")
+                # use default grid index
+                if geometry_index:
+                    grid_id = geometry_index.grid_ids(geometry_shape)
+                elif parameterized_queries:
+                    RawData.execute_prepared(
+                        cur,
+                        "grid_lookup",
+                        get_grid_id_query(None, prepared=True),
+                        (geometry_dump,),
+                    )
+                    grid_id = cur.fetchall()
                 else:
                     cur.execute(get_grid_id_query(geometry_dump))
                     grid_id = cur.fetchall()
-            cur.close()
         return grid_id, geometry_dump, geom_area, country
 
     @staticmethod
@@ -499,18 +998,184 @@ class RawData:
 
         return feature_collection
 
-    def extract_current_data(self, exportname):
+    def geometry_type_layers(self, grid_id, country):
+        """(file suffix , ogr export query , schema) of each requested geometry type , shared by writers which keeps point , line and polygon apart"""
+        (
+            point_query,
+            line_query,
+            poly_query,
+            point_schema,
+            line_schema,
+            poly_schema,
+        ) = extract_geometry_type_query(
+            self.params, ogr_export=True, g_id=grid_id, c_id=country
+        )
+        return [
+            (suffix, query, schema)
+            for suffix, query, schema in [
+                ("point", point_query, point_schema),
+                ("line", line_query, line_schema),
+                ("poly", poly_query, poly_schema),
+            ]
+            if query
+        ]
+
+    def write_output(
+        self,
+        grid_id,
+        country,
+        geometry_dump,
+        working_dir,
+        dump_temp_file_path,
+        engine=None,
+        zip_file=None,
+    ):
+        """Runs extraction query of output_type and writes result to dump_temp_file_path , shapefile and geopackage are written to working_dir
+
+        Args:
+            grid_id: intersecting grid ids from get_grid_id
+            country: country id from get_grid_id
+            geometry_dump: geojson of request geometry
+            working_dir: dir where results are saved
+            dump_temp_file_path: path of output file
+            engine: cursor / copy engine for geojson extraction , defaults to extraction_engine from config
+            zip_file: open zip archive , geojson , csv and fgb are streamed into it directly
+        """
+        output_type = self.params.output_type
+        # geojson and csv queries are filled with placeholders and their values are collected here
+        query_params = {} if parameterized_queries else None
+        # currently we have only geojson binding function written other than that we have depend on ogr
+        if output_type == RawDataOutputType.GEOJSON.value:
+            if grid_id and partition_workers:
+                fragment_cache = FragmentCache() if use_fragment_cache else None
+                RawData.query2geojson_partitioned(
+                    RawData.get_partition_queries(self.params, self.con, geometry_dump),
+                    dump_temp_file_path,
+                    zip_file=zip_file,
+                    fragment_cache=fragment_cache,
+                )  # splits large geometry with grid and runs parts in process pool
+                if fragment_cache:
+                    self.fragment_cache_stats = fragment_cache.stats()
+            elif parallel_table_extraction:
+                RawData.query2geojson_parallel(
+                    raw_currentdata_extraction_query(
+                        self.params,
+                        g_id=grid_id,
+                        c_id=country,
+                        geometry_dump=geometry_dump,
+                        as_list=True,
+                        bind_params=query_params,
+                    ),
+                    dump_temp_file_path,
+                    engine=engine,
+                    zip_file=zip_file,
+                    query_params=query_params,
+                    table_names=get_extraction_tables(self.params),
+                )  # runs each table on its own connection
+            else:
+                RawData.query2geojson(
+                    self.con,
+                    raw_currentdata_extraction_query(
+                        self.params,
+                        g_id=grid_id,
+                        c_id=country,
+                        geometry_dump=geometry_dump,
+                        bind_params=query_params,
+                    ),
+                    dump_temp_file_path,
+                    engine=engine,
+                    zip_file=zip_file,
+                    query_params=query_params,
+                )  # uses own conversion class
+        elif output_type == RawDataOutputType.SHAPEFILE.value:
+            file_name = self.params.file_name if self.params.file_name else "Export"
+            shape_types = {
+                "point": SHAPE_POINT,
+                "line": SHAPE_POLYLINE,
+                "poly": SHAPE_POLYGON,
+            }
+            for suffix, query, schema in self.geometry_type_layers(grid_id, country):
+                RawData.query2shapefile(
+                    self.con,
+                    query,
+                    schema,
+                    shape_types[suffix],
+                    os.path.join(working_dir, f"{file_name}_{suffix}"),
+                )  # uses own shapefile writer
+        elif output_type == RawDataOutputType.FLATGEOBUF.value:
+            RawData.query2flatgeobuf(
+                self.con,
+                [
+                    (query, schema)
+                    for _, query, schema in self.geometry_type_layers(grid_id, country)
+                ],
+                dump_temp_file_path,
+                zip_file=zip_file,
+            )  # uses own flatgeobuf writer
+        elif output_type == RawDataOutputType.GEOPACKAGE.value:
+            file_name = self.params.file_name if self.params.file_name else "Export"
+            RawData.query2geopackage(
+                self.con,
+                [
+                    (
+                        f"{file_name}_{suffix}",
+                        "POINT" if suffix == "point" else "GEOMETRY",
+                        query,
+                        schema,
+                    )
+                    for suffix, query, schema in self.geometry_type_layers(
+                        grid_id, country
+                    )
+                ],
+                dump_temp_file_path,
+            )  # uses own geopackage writer
+        elif output_type == RawDataOutputType.CSV.value:
+            RawData.query2csv(
+                self.con,
+                raw_currentdata_extraction_query(
+                    self.params,
+                    grid_id,
+                    country,
+                    geometry_dump,
+                    ogr_export=True,
+                    bind_params=query_params,
+                ),
+                dump_temp_file_path,
+                zip_file=zip_file,
+                query_params=query_params,
+            )  # postgres writes csv itself
+        else:
+            RawData.ogr_export(
+                query=raw_currentdata_extraction_query(
+                    self.params, grid_id, country, geometry_dump, ogr_export=True
+                ),
+                outputtype=output_type,
+                dump_temp_path=dump_temp_file_path,
+                working_dir=working_dir,
+                params=self.params,
+            )  # uses ogr export to export
+
+    def extract_current_data(
+        self, exportname, engine=None, zip_file=None, grid_lookup=None
+    ):
         """Responsible for Extracting rawdata current snapshot, Initially it creates a geojson file , Generates query , run it with 1000 chunk size and writes it directly to the geojson file and closes the file after dump
         Args:
             exportname: takes filename as argument to create geojson file passed from routers
+            engine: cursor / copy engine for geojson extraction , defaults to extraction_engine from config
+            zip_file: open zip archive , geojson , csv and fgb are streamed into it directly and other formats which needs seekable file are left in working_dir
+            grid_lookup: result of get_grid_id for params if it is already looked up while export was estimated
 
         Returns:
             geom_area: area of polygon supplied
             working_dir: dir where results are saved
         """
         # first check either geometry needs grid or not for querying
-        grid_id, geometry_dump, geom_area, country = RawData.get_grid_id(
-            self.params.geometry, self.cur, self.params.country_export
+        grid_id, geometry_dump, geom_area, country = (
+            grid_lookup
+            if grid_lookup
+            else RawData.get_grid_id(
+                self.params.geometry, self.cur, self.params.country_export
+            )
         )
         output_type = self.params.output_type
         # Check whether the export path exists or not
@@ -524,48 +1189,25 @@ class RawData:
             f"{self.params.file_name if self.params.file_name else 'Export'}.{output_type.lower()}",
         )
         try:
-            # currently we have only geojson binding function written other than that we have depend on ogr
-            if output_type == RawDataOutputType.GEOJSON.value:
-                RawData.query2geojson(
-                    self.con,
-                    raw_currentdata_extraction_query(
-                        self.params,
-                        g_id=grid_id,
-                        c_id=country,
-                        geometry_dump=geometry_dump,
-                    ),
-                    dump_temp_file_path,
-                )  # uses own conversion class
-            elif output_type == RawDataOutputType.SHAPEFILE.value:
-                (
-                    point_query,
-                    line_query,
-                    poly_query,
-                    point_schema,
-                    line_schema,
-                    poly_schema,
-                ) = extract_geometry_type_query(
-                    self.params, ogr_export=True, g_id=grid_id, c_id=country
+            if (
+                country
+                and self.params.country_export
+                and country in country_extracts
+                and self.extract_from_country_extract(
+                    country, dump_temp_file_path, zip_file
                 )
-                RawData.ogr_export_shp(
-                    point_query=point_query,
-                    line_query=line_query,
-                    poly_query=poly_query,
-                    working_dir=working_dir,
-                    file_name=self.params.file_name
-                    if self.params.file_name
-                    else "Export",
-                )  # using ogr2ogr
+            ):
+                logging.info("Served from extract of country %s", country)
             else:
-                RawData.ogr_export(
-                    query=raw_currentdata_extraction_query(
-                        self.params, grid_id, country, geometry_dump, ogr_export=True
-                    ),
-                    outputtype=output_type,
-                    dump_temp_path=dump_temp_file_path,
-                    working_dir=working_dir,
-                    params=self.params,
-                )  # uses ogr export to export
+                self.write_output(
+                    grid_id,
+                    country,
+                    geometry_dump,
+                    working_dir,
+                    dump_temp_file_path,
+                    engine=engine,
+                    zip_file=zip_file,
+                )
             return geom_area, working_dir
         except Exception as ex:
             logging.error(ex)
@@ -574,6 +1216,103 @@ class RawData:
             # closing connection before leaving class
             RawData.close_con(self.con)
 
+    def extract_from_country_extract(self, country, dump_temp_file_path, zip_file=None):
+        """Writes output of country_export request from extract of the country built after latest import , geojson with filters is filtered while streaming and other formats are only used without filters
+
+        Returns:
+            True if output is written , False if request needs to go to database
+        """
+        if (
+            self.params.since
+            or self.params.precision is not None
+            or self.params.compact
+        ):
+            return False  # extracts keep every feature with all columns at default precision
+        entry = CountryExtracts().get(country)
+        if entry is None:
+            return False
+        self.cur.execute(check_last_updated_rawdata())
+        if entry["import_date"] != str(self.cur.fetchall()[0][0]):
+            return False  # built before latest import
+        output_type = self.params.output_type
+        feature_filter = FeatureFilter(self.params)
+        if output_type == RawDataOutputType.GEOJSON.value:
+            source_path = os.path.join(entry["directory"], entry["files"]["geojson"][0])
+            if not os.path.exists(source_path):
+                return False  # built on other machine
+            with open_output(dump_temp_file_path, zip_file) as f:
+                feature_filter.write(source_path, f)
+            return True
+        if output_type not in entry["files"] or not feature_filter.is_empty:
+            return False
+        file_name = self.params.file_name if self.params.file_name else "Export"
+        source_paths = [
+            os.path.join(entry["directory"], name)
+            for name in entry["files"][output_type]
+        ]
+        if not all(os.path.exists(path) for path in source_paths):
+            return False
+        for source_path in source_paths:
+            # extracts are built with Export as file name , layers inside geopackage keeps it
+            shutil.copyfile(
+                source_path,
+                os.path.join(
+                    os.path.dirname(dump_temp_file_path),
+                    os.path.basename(source_path).replace("Export", file_name, 1),
+                ),
+            )
+        return True
+
+    @staticmethod
+    def build_country_extract(country_id, directory, output_types=None):
+        """Extracts whole country to directory , geojson is written one feature per line so that filtered requests can be streamed from it and other output types are written as they are in exports
+
+        Args:
+            country_id: ogc_fid of countries_un
+            directory: directory where extract is written
+            output_types: output types built along with geojson , defaults to country_extract_formats from config
+
+        Returns:
+            dict of output type and list of file names inside directory
+        """
+        output_types = country_extract_formats if output_types is None else output_types
+        start_time = time.time()
+        # country export ignores geometry so params are not validated against max_area
+        params = RawDataCurrentParams.construct(country_export=True, file_name="Export")
+        raw = RawData(params)
+        files = {}
+        try:
+            with open(os.path.join(directory, "Export.geojson"), "wb") as f:
+                f.write(FEATURE_COLLECTION_HEADER + b"\n")
+                row_count = RawData.query2features(
+                    raw.con,
+                    raw_currentdata_extraction_query(params, None, country_id, None),
+                    f,
+                    separator=b",\n",
+                )
+                f.write(b"\n" + FEATURE_COLLECTION_FOOTER)
+            files["geojson"] = ["Export.geojson"]
+            for output_type in output_types:
+                existing = set(os.listdir(directory))
+                params.output_type = output_type
+                raw.write_output(
+                    None,
+                    country_id,
+                    None,
+                    directory,
+                    os.path.join(directory, f"Export.{output_type}"),
+                )
+                files[output_type] = sorted(set(os.listdir(directory)) - existing)
+        finally:
+            RawData.close_con(raw.con)
+        logging.info(
+            "Extract of country %s Done : %s features in %s sec",
+            country_id,
+            row_count,
+            round(time.time() - start_time, 2),
+        )
+        return files
+
     def check_status(self):
         """Gives status about DB update, Substracts with current time and last db update time"""
         status_query = check_last_updated_rawdata()
@@ -584,6 +1323,34 @@ class RawData:
         RawData.close_con(self.con)
         return str(behind_time[0][0])
 
+    def estimate_current_data(self, grid_lookup=None):
+        """Estimates export of params with EXPLAIN of each table query that its output type runs , nothing is extracted
+
+        Args:
+            grid_lookup: result of get_grid_id for params if it is already looked up
+
+        Returns:
+            dict of rows , bytes , seconds and rows of each table from estimate_export
+        """
+        grid_id, geometry_dump, geom_area, country = (
+            grid_lookup
+            if grid_lookup
+            else RawData.get_grid_id(
+                self.params.geometry, self.cur, self.params.country_export
+            )
+        )
+        query_params = {} if parameterized_queries else None
+        table_estimates = []
+        for table, query in extraction_table_queries(
+            self.params, grid_id, country, geometry_dump, bind_params=query_params
+        ):
+            self.cur.execute(f"EXPLAIN (FORMAT JSON) {query}", query_params)
+            plan = self.cur.fetchone()[0][0]["Plan"]
+            table_estimates.append((table, plan["Plan Rows"], plan["Plan Width"]))
+        estimate = estimate_export(table_estimates, self.params.output_type)
+        logging.debug("Export of %s sqkm is estimated as %s", geom_area, estimate)
+        return estimate
+
     def extract_plain_geojson(self):
         """Gets geojson for small area : Performs direct query with/without geometry"""
         query = raw_extract_plain_geojson(self.params, inspect_only=True)
@@ -617,6 +1384,49 @@ class RawData:
         return FeatureCollection(features=features)
 
 
+class StatusCache:
+    """Keeps last updated time of database in memory of the process , Background thread refreshes it on interval so that status requests never touch database"""
+
+    def __init__(self, interval=status_refresh_interval):
+        self.interval = interval
+        self.last_updated = None
+        self.refreshed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def age(self):
+        """seconds since last refresh"""
+        return time.time() - self.refreshed_at if self.refreshed_at else None
+
+    def refresh(self):
+        """reads last updated time from database"""
+        self.last_updated = RawData().check_status()
+        self.refreshed_at = time.time()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as ex:
+                # keeps serving last known status until database is back
+                logging.error("Couldn't refresh database status : %s", ex)
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """starts background thread which refreshes status on interval"""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="status-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """stops background thread after its current refresh"""
+        self._stop.set()
+
+
 class S3FileTransfer:
     """Responsible for the file transfer to s3 from API maachine"""
 
@@ -677,13 +1487,141 @@ class S3FileTransfer:
             logging.error(ex)
             raise ex
         logging.debug("Uploaded %s in %s sec", file_name, time.time() - start_time)
-        # generate the download url
+        self.verify_upload(file_name, os.path.getsize(file_path))
+        return self.get_object_url(file_name)
+
+    def verify_upload(self, file_name, size, etag=None):
+        """Confirms upload from object metadata on s3 , size and etag (if passed) should match with what was sent"""
+        head = self.s_3.head_object(Bucket=BUCKET_NAME, Key=file_name)
+        if head["ContentLength"] != size or (etag and head["ETag"] != etag):
+            raise ValueError(
+                f"Upload of {file_name} is not complete : {head['ContentLength']} bytes , etag {head['ETag']} on s3 , expected {size} bytes , etag {etag}"
+            )
+        logging.debug("Upload of %s is verified", file_name)
+
+    def get_object_url(self, file_name):
+        """generates the download url of uploaded file"""
         bucket_location = self.get_bucket_location(bucket_name=BUCKET_NAME)
         object_url = (
             f"""https://s3.{bucket_location}.amazonaws.com/{BUCKET_NAME}/{file_name}"""
         )
         return object_url
 
+    def open_upload_stream(self, file_name, file_suffix="zip"):
+        """Starts multipart upload and returns stream , data written to the stream is uploaded while it is written and upload completes when stream is closed"""
+        return S3MultipartUploadStream(
+            self.s_3, BUCKET_NAME, f"{file_name}.{file_suffix}", s3_upload_part_size
+        )
+
+
+class S3MultipartUploadStream:
+    """Binary write only stream which uploads to s3 as multipart upload , Part is uploaded in background thread as soon as it is filled so upload overlaps with the extraction and nothing is written to disk
+
+    Args:
+        s_3: boto3 s3 client
+        bucket: bucket name
+        key: object key
+        part_size: size of each part except last one in bytes , minimum 5 MB on s3
+        max_workers: no of parts uploaded at the same time , twice of it can be held in memory
+    """
+
+    def __init__(self, s_3, bucket, key, part_size=16 * 1024 * 1024, max_workers=4):
+        self.s_3 = s_3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s_3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self.buffer = bytearray()
+        self.size = 0
+        self.part_number = 0
+        self.part_stats = []  # part number , bytes , seconds of each uploaded part
+        self.closed = False
+        self.etag = None
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # writer waits when enough parts are pending so memory stays bounded
+        self._pending = threading.BoundedSemaphore(max_workers * 2)
+        self._start_time = time.time()
+
+    def write(self, data):
+        """Adds data to buffer and submits every full part of buffer for upload , returns no of bytes written"""
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def flush(self):
+        """parts are uploaded only when they are full , nothing to do here"""
+
+    def _submit(self, body):
+        self._pending.acquire()
+        self.part_number += 1
+        self._futures.append(
+            self._executor.submit(self._upload_part, self.part_number, body)
+        )
+
+    def _upload_part(self, part_number, body):
+        try:
+            start_time = time.time()
+            response = self.s_3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            seconds = time.time() - start_time
+            self.part_stats.append((part_number, len(body), seconds))
+            logging.debug(
+                "Uploaded part %s of %s : %s MB at %s MB/sec",
+                part_number,
+                self.key,
+                round(len(body) / 1000000, 2),
+                round(len(body) / 1000000 / seconds, 2) if seconds else "-",
+            )
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+        finally:
+            self._pending.release()
+
+    def close(self):
+        """Uploads remaining data and completes the upload , upload is aborted if any of the part fails"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or self.part_number == 0:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self._futures]
+            self.etag = self.s_3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": parts},
+            )["ETag"]
+        except Exception as ex:
+            self.abort()
+            raise ex
+        finally:
+            self._executor.shutdown(wait=True)
+        logging.debug(
+            "Streamed %s to s3 : %s MB in %s parts in %s sec",
+            self.key,
+            round(self.size / 1000000, 2),
+            self.part_number,
+            round(time.time() - self._start_time, 2),
+        )
+
+    def abort(self):
+        """Cancels multipart upload so that uploaded parts are not kept on s3"""
+        self.closed = True
+        self._executor.shutdown(wait=True)
+        self.s_3.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
 
 class ProgressPercentage(object):
     """Determines the project percentage of aws s3 upload file call
@@ -711,3 +1649,32 @@ class ProgressPercentage(object):
                 self._size,
                 percentage,
             )
+
+
+class GeojsonCopyStream:
+    """File like object passed to copy_expert , COPY sends one geojson feature per line and this joins them with comma before writing to the actual file
+
+    Args:
+        file : binary file object where features are written
+        separator : written between features
+    """
+
+    def __init__(self, file, separator=b","):
+        self._file = file
+        self._separator = separator
+        self._pending_separator = False
+        self.row_count = 0
+
+    def write(self, data):
+        """writes the chunk received from COPY , line breaks are replaced with comma and last line break is kept pending until next chunk arrives"""
+        if not data:
+            return
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.row_count += data.count(b"\n")
+        if self._pending_separator:
+            self._file.write(self._separator)
+        self._pending_separator = data.endswith(b"\n")
+        if self._pending_separator:
+            data = data[:-1]
+        self._file.write(data.replace(b"\n", self._separator))
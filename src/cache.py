@@ -0,0 +1,326 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains cache of export results , Exports are reused for same request until database is updated with new import"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import redis
+
+from src.config import (
+    BUCKET_NAME,
+    export_cache_max_size,
+    export_cache_ttl,
+    export_path,
+    fragment_cache_max_size,
+    limiter_storage_uri,
+    request_coalescing_ttl,
+)
+from src.config import logger as logging
+
+CACHE_PREFIX = "export_cache"
+IN_FLIGHT_PREFIX = "export_in_flight"
+FRAGMENT_CACHE_DIR = os.path.join(export_path, "fragments")
+COORDINATE_PRECISION = 7  # ~1 cm , smaller differences are treated as same geometry
+
+
+def round_coordinates(coordinates):
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(value) for value in coordinates]
+    return round(coordinates, COORDINATE_PRECISION)
+
+
+def sort_filters(filters):
+    """sorts lists inside filters so that order of tags / attributes doesn't change fingerprint"""
+    if isinstance(filters, dict):
+        return {key: sort_filters(value) for key, value in filters.items()}
+    if isinstance(filters, list):
+        return sorted(sort_filters(value) for value in filters)
+    return filters
+
+
+def request_fingerprint(params):
+    """Canonical hash of RawDataCurrentParams , file name is left out since it doesn't change the data"""
+    request = params.dict(exclude={"file_name"})
+    geometry = dict(request.pop("geometry"))
+    request["geometry"] = {
+        "type": geometry["type"],
+        "coordinates": round_coordinates(geometry["coordinates"]),
+    }
+    request["filters"] = sort_filters(request.get("filters"))
+    request["geometry_type"] = sorted(request.get("geometry_type") or [])
+    canonical = json.dumps(
+        request, sort_keys=True, separators=(",", ":"), default=str
+    )  # since is datetime
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_key(params, import_date):
+    """key of request used by export cache and in flight exports , import date makes older exports unreachable after new import"""
+    return f"{request_fingerprint(params)}:{import_date}"
+
+
+class ExportCache:
+    """Keeps result of finished exports in redis along with their artifact , Entries are evicted when they are older than ttl or least recently used ones when artifacts are bigger than max_size in total
+
+    Args:
+        redis_client: redis connection , defaults to limiter_storage_uri from config
+        s_3: s3 client used to delete evicted artifacts from bucket
+        read_only: entries are only read , expired ones are left to worker which removes them along with their artifact , used by api which has neither s3 client nor disk of worker
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_size=export_cache_max_size,
+        ttl=export_cache_ttl,
+        s_3=None,
+        read_only=False,
+    ):
+        self.redis = (
+            redis_client if redis_client else redis.Redis.from_url(limiter_storage_uri)
+        )
+        self.max_size = max_size
+        self.ttl = ttl
+        self.s_3 = s_3
+        self.read_only = read_only
+        self.entries_key = f"{CACHE_PREFIX}:entries"
+        self.lru_key = f"{CACHE_PREFIX}:lru"  # keys scored by last access time
+
+    def get(self, key):
+        """Returns cached entry or None , hit and miss are counted"""
+        entry = self.redis.hget(self.entries_key, key)
+        if entry:
+            entry = json.loads(entry)
+            if time.time() - entry["created"] > self.ttl or (
+                not self.read_only and self.artifact_missing(entry)
+            ):
+                if not self.read_only:
+                    self.remove(key)
+            else:
+                self.redis.zadd(self.lru_key, {key: time.time()})
+                self.redis.incr(f"{CACHE_PREFIX}:hits")
+                return entry
+        self.redis.incr(f"{CACHE_PREFIX}:misses")
+        return None
+
+    def set(self, key, task_id, result, artifact, size, storage="disk"):
+        """Caches result of export and evicts old entries if cache is over its limits
+
+        Args:
+            key: key generated with request_key()
+            task_id: id of the export task , used for track link
+            result: result returned by export task
+            artifact: s3 key or local path (file or directory) removed on eviction
+            size: size of artifact in bytes
+            storage: disk / s3
+        """
+        entry = {
+            "task_id": task_id,
+            "result": result,
+            "artifact": artifact,
+            "size": size,
+            "storage": storage,
+            "created": time.time(),
+        }
+        self.redis.hset(self.entries_key, key, json.dumps(entry))
+        self.redis.zadd(self.lru_key, {key: time.time()})
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries and entries whose artifact is gone and then least recently used ones until cache fits max_size"""
+        total_size = 0
+        for key, entry in self.redis.hgetall(self.entries_key).items():
+            entry = json.loads(entry)
+            if time.time() - entry["created"] > self.ttl or self.artifact_missing(
+                entry
+            ):
+                self.remove(key)
+            else:
+                total_size += entry["size"]
+        while total_size > self.max_size:
+            oldest = self.redis.zrange(self.lru_key, 0, 0)
+            if not oldest:
+                break
+            total_size -= self.remove(oldest[0])
+
+    def remove(self, key):
+        """Removes entry along with its artifact , returns size freed"""
+        key = key.decode() if isinstance(key, bytes) else key
+        entry = self.redis.hget(self.entries_key, key)
+        self.redis.hdel(self.entries_key, key)
+        self.redis.zrem(self.lru_key, key)
+        if entry is None:
+            return 0
+        entry = json.loads(entry)
+        self.delete_artifact(entry["artifact"], entry["storage"])
+        logging.debug("Evicted %s from export cache", key)
+        return entry["size"]
+
+    @staticmethod
+    def artifact_missing(entry):
+        """whether artifact on disk is removed , only meaningful on host which wrote it"""
+        return entry["storage"] == "disk" and not os.path.exists(entry["artifact"])
+
+    def delete_artifact(self, artifact, storage):
+        """Deletes artifact from s3 bucket or disk , errors are only logged so that entry is still removed"""
+        try:
+            if storage == "s3":
+                if self.s_3:
+                    self.s_3.delete_object(Bucket=BUCKET_NAME, Key=artifact)
+            elif os.path.isdir(artifact):
+                shutil.rmtree(artifact)
+            elif os.path.exists(artifact):
+                os.remove(artifact)
+        except Exception as ex:
+            logging.error("Couldn't remove cached artifact %s : %s", artifact, ex)
+
+    def stats(self):
+        """hit , miss counts and hit rate along with size of cache"""
+        hits = int(self.redis.get(f"{CACHE_PREFIX}:hits") or 0)
+        misses = int(self.redis.get(f"{CACHE_PREFIX}:misses") or 0)
+        sizes = [
+            json.loads(entry)["size"] for entry in self.redis.hvals(self.entries_key)
+        ]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0,
+            "entries": len(sizes),
+            "size_bytes": sum(sizes),
+        }
+
+
+class InFlightExports:
+    """Keeps task id of running export for each request key in redis so that identical requests received while it is running attach to it instead of queuing same export again
+
+    Args:
+        redis_client: redis connection , defaults to limiter_storage_uri from config
+        ttl: seconds after which running export is forgotten , protects from workers which died without releasing
+    """
+
+    def __init__(self, redis_client=None, ttl=request_coalescing_ttl):
+        self.redis = (
+            redis_client if redis_client else redis.Redis.from_url(limiter_storage_uri)
+        )
+        self.ttl = ttl
+
+    def claim(self, key, task_id):
+        """Registers task_id as export of key if there isn't one already , returns task id of the export request should attach to"""
+        while True:
+            if self.redis.set(
+                f"{IN_FLIGHT_PREFIX}:{key}", task_id, nx=True, ex=self.ttl
+            ):
+                return task_id
+            running_task_id = self.redis.get(f"{IN_FLIGHT_PREFIX}:{key}")
+            if running_task_id is not None:
+                self.redis.incr(f"{IN_FLIGHT_PREFIX}:coalesced")
+                return running_task_id.decode()
+            # released in between , try again
+
+    def release(self, key, task_id):
+        """Removes key if it still belongs to task_id , called by worker when export is finished or failed"""
+        running_task_id = self.redis.get(f"{IN_FLIGHT_PREFIX}:{key}")
+        if running_task_id is not None and running_task_id.decode() == task_id:
+            self.redis.delete(f"{IN_FLIGHT_PREFIX}:{key}")
+
+    def stats(self):
+        """no of requests attached to already running exports"""
+        return {"coalesced": int(self.redis.get(f"{IN_FLIGHT_PREFIX}:coalesced") or 0)}
+
+
+def link_or_copy(source, destination):
+    """Hard links source to destination , copies it when they are on different file systems"""
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class FragmentCache:
+    """Keeps rows of table queries of grid cells on local disk , Least recently used fragments are removed when they are bigger than max_size in total
+
+    Hits and misses are counted on the instance so each export can report its own
+
+    Args:
+        directory: where fragments are kept
+        max_size: size of fragments in bytes
+    """
+
+    def __init__(self, directory=FRAGMENT_CACHE_DIR, max_size=fragment_cache_max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(query, import_date):
+        """query of fully covered grid cell already holds grid geometry , table and filters"""
+        return hashlib.sha256(f"{import_date}\n{query}".encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        """path of fragment of key inside cache directory"""
+        return os.path.join(self.directory, f"{key}.tsv")
+
+    def get(self, key, destination):
+        """Links fragment to destination and returns destination or None if it is not in cache , hit and miss are counted
+
+        destination belongs to caller so fragment can be evicted by other exports while it is read
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)  # modification time is used as last access time
+            link_or_copy(path, destination)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return destination
+
+    def put(self, key, path):
+        """Adds file at path as fragment of key , file is linked so caller can still read and remove it"""
+        temp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        link_or_copy(path, temp_path)
+        os.replace(temp_path, self.path(key))
+
+    def evict(self):
+        """Removes least recently used fragments until cache fits max_size"""
+        fragments = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tsv"):
+                stat = entry.stat()
+                fragments.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in fragments)
+        for _, size, path in sorted(fragments):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by other process
+            total_size -= size
+
+    def stats(self):
+        """hit and miss counts of this instance"""
+        return {"hits": self.hits, "misses": self.misses}
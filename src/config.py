@@ -87,7 +87,117 @@ allow_bind_zip_filter = config.get("API_CONFIG", "allow_bind_zip_filter", fallba
 if allow_bind_zip_filter:
     allow_bind_zip_filter = True if allow_bind_zip_filter.lower() == "true" else False
 
+# engine used to stream geojson out of database : cursor (server side cursor) or copy (COPY TO STDOUT)
+extraction_engine = config.get(
+    "API_CONFIG", "extraction_engine", fallback="cursor"
+).lower()
+if extraction_engine not in ["cursor", "copy"]:
+    logging.error(
+        "value not supported for extraction_engine ,switching to default cursor engine"
+    )
+    extraction_engine = "cursor"
+
+# runs query of each table (nodes,ways_line,ways_poly,relations) on separate connection at the same time
+parallel_table_extraction = config.getboolean(
+    "API_CONFIG", "parallel_table_extraction", fallback=False
+)
+
+# no of processes used to extract large geojson exports grid by grid , 0 disables partitioned extraction
+partition_workers = int(config.get("API_CONFIG", "partition_workers", fallback=0))
+
+# geometry and tag filters of geojson and csv extraction are sent as bind parameters , country and grid lookups are run as prepared statements
+parameterized_queries = config.getboolean(
+    "API_CONFIG", "parameterized_queries", fallback=False
+)
+
+# tables whose grid column is filled , grid cells of request are used to filter them along with geometry for large requests
+grid_index_tables = [
+    table_name.strip().lower()
+    for table_name in config.get(
+        "API_CONFIG", "grid_index_tables", fallback="ways_poly"
+    ).split(",")
+    if table_name.strip()
+]
+if not set(grid_index_tables) <= {"nodes", "ways_line", "ways_poly", "relations"}:
+    logging.error(
+        "value not supported for grid_index_tables , supported tables are : nodes,ways_line,ways_poly,relations , using ways_poly only"
+    )
+    grid_index_tables = ["ways_poly"]
+
+# request geometries with more vertices than this are split into pieces of at most this many vertices and features are matched against the pieces , 0 disables
+subdivide_vertices = int(config.get("API_CONFIG", "subdivide_vertices", fallback=0))
+
+# estimates rows , size and time of snapshot exports from planner statistics before they are queued
+use_export_estimate = config.getboolean("API_CONFIG", "export_estimate", fallback=False)
+estimate_rows_per_second = int(
+    config.get("API_CONFIG", "estimate_rows_per_second", fallback=10000)
+)  # geojson rows written per second by one worker , other formats are scaled from it
+max_export_seconds = int(
+    config.get("API_CONFIG", "max_export_seconds", fallback=0)
+)  # exports estimated to take longer are rejected , 0 never rejects
+large_export_seconds = int(
+    config.get("API_CONFIG", "large_export_seconds", fallback=0)
+)  # exports estimated to take longer go to large_exports queue , 0 keeps them on default queue
+
+# features of grid cells fully covered by partitioned exports are kept on local disk and reused by later exports covering same cells
+use_fragment_cache = config.getboolean("API_CONFIG", "fragment_cache", fallback=False)
+fragment_cache_max_size = (
+    int(config.get("API_CONFIG", "fragment_cache_max_size", fallback=2048)) * 1000000
+)  # MB of fragments kept on disk of each worker
+
+# seconds between background refreshes of database status served by /status/
+status_refresh_interval = int(
+    config.get("API_CONFIG", "status_refresh_interval", fallback=60)
+)
+
+# keeps grid and countries_un in memory of each process to find grid and country of request without database , requires shapely
+use_geometry_index = config.getboolean("API_CONFIG", "geometry_index", fallback=False)
+
+# reuses export of same request until database gets new import
+use_export_cache = config.getboolean("API_CONFIG", "export_cache", fallback=False)
+export_cache_max_size = (
+    int(config.get("API_CONFIG", "export_cache_max_size", fallback=10240)) * 1000000
+)  # MB of artifacts kept in cache
+export_cache_ttl = (
+    int(config.get("API_CONFIG", "export_cache_ttl", fallback=24)) * 3600
+)  # hours , keep it within celery result expiry so that track link keeps working
+
+# identical snapshot requests received while one is still running are attached to the running export
+use_request_coalescing = config.getboolean(
+    "API_CONFIG", "request_coalescing", fallback=False
+)
+request_coalescing_ttl = (
+    int(config.get("API_CONFIG", "request_coalescing_ttl", fallback=60)) * 60
+)  # minutes , running export is forgotten after it even if worker never reports back
+
+# ogc_fid of countries_un whose whole country extract is built after each import , country_export requests of them are served from it
+country_extracts = [
+    int(country_id)
+    for country_id in config.get("API_CONFIG", "country_extracts", fallback="").split(
+        ","
+    )
+    if country_id.strip()
+]
+# formats built for country extracts along with geojson , geojson is always built since filtered requests are derived from it
+country_extract_formats = [
+    output_type.strip().lower()
+    for output_type in config.get(
+        "API_CONFIG", "country_extract_formats", fallback=""
+    ).split(",")
+    if output_type.strip() and output_type.strip().lower() != "geojson"
+]
+if not set(country_extract_formats) <= {"shp", "fgb", "gpkg", "csv"}:
+    logging.error(
+        "value not supported for country_extract_formats , supported formats are : shp,fgb,gpkg,csv , building geojson only"
+    )
+    country_extract_formats = []
+# seconds between checks for new import to rebuild country extracts
+country_extracts_interval = int(
+    config.get("API_CONFIG", "country_extracts_interval", fallback=900)
+)
+
 AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME = None, None, None
+stream_s3_upload, s3_upload_part_size = False, 16 * 1024 * 1024
 # check either to use connection pooling or not
 use_connection_pooling = config.getboolean(
     "API_CONFIG", "use_connection_pooling", fallback=False
@@ -108,6 +218,16 @@ if file_upload_method == "s3":
     BUCKET_NAME = config.get(
         "EXPORT_UPLOAD", "BUCKET_NAME", fallback="exports-stage.hotosm.org"
     )
+    # uploads zip as multipart upload while it is being written instead of uploading after export is done
+    stream_s3_upload = config.getboolean(
+        "EXPORT_UPLOAD", "STREAM_UPLOAD", fallback=False
+    )
+    # part size in MB , s3 doesn't accept parts smaller than 5 MB
+    s3_upload_part_size = (
+        max(int(config.get("EXPORT_UPLOAD", "UPLOAD_PART_SIZE", fallback=16)), 5)
+        * 1024
+        * 1024
+    )
 elif file_upload_method not in ["s3", "disk"]:
     logging.error(
         "value not supported for file_upload_method ,switching to default disk method"
@@ -0,0 +1,236 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains whole country extracts built after each import , country_export requests are served from them instead of scanning the country again"""
+import json
+import os
+import re
+import shutil
+
+import orjson
+import redis
+
+from src.config import export_path, limiter_storage_uri
+from src.config import logger as logging
+from src.query_builder.builder import extract_attributes_tags, remove_spaces
+
+COUNTRY_EXTRACTS_PREFIX = "country_extracts"
+COUNTRY_EXTRACTS_DIR = os.path.join(export_path, "country_extracts")
+FEATURE_COLLECTION_HEADER = b"""{"type": "FeatureCollection","features": ["""
+FEATURE_COLLECTION_FOOTER = b"""]}"""
+# geojson geometry type to geometry type of request
+# geometries of other types are relations , like GeometryCollection , they are extracted only when relations are scanned once for line and polygon
+GEOMETRY_TYPES = {
+    "Point": "point",
+    "LineString": "line",
+    "MultiLineString": "line",
+    "Polygon": "polygon",
+    "MultiPolygon": "polygon",
+}
+
+
+class CountryExtracts:
+    """Keeps directory and files of country extract built from latest import in redis for each country
+
+    Args:
+        redis_client: redis connection , defaults to limiter_storage_uri from config
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = (
+            redis_client if redis_client else redis.Redis.from_url(limiter_storage_uri)
+        )
+        self.entries_key = f"{COUNTRY_EXTRACTS_PREFIX}:entries"
+
+    @staticmethod
+    def directory(country_id, import_date):
+        """directory of country extract built from import"""
+        return os.path.join(
+            COUNTRY_EXTRACTS_DIR, str(country_id), re.sub(r"\W+", "_", import_date)
+        )
+
+    def get(self, country_id):
+        """Returns entry of country or None if it is not built yet"""
+        entry = self.redis.hget(self.entries_key, str(country_id))
+        return json.loads(entry) if entry else None
+
+    def set(self, country_id, import_date, directory, files):
+        """Registers new extract of country and removes extract of previous import
+
+        Args:
+            country_id: ogc_fid of countries_un
+            import_date: import date of database when extract was started
+            directory: directory of extract
+            files: dict of output type and list of file names inside directory
+        """
+        previous = self.get(country_id)
+        self.redis.hset(
+            self.entries_key,
+            str(country_id),
+            json.dumps(
+                {"import_date": import_date, "directory": directory, "files": files}
+            ),
+        )
+        if previous and previous["directory"] != directory:
+            shutil.rmtree(previous["directory"], ignore_errors=True)
+
+    def lock(self, country_id, ttl=6 * 3600):
+        """Makes sure only one worker builds extract of country at a time , returns False if it is already being built"""
+        return bool(
+            self.redis.set(
+                f"{COUNTRY_EXTRACTS_PREFIX}:building:{country_id}", 1, nx=True, ex=ttl
+            )
+        )
+
+    def unlock(self, country_id):
+        """releases build lock of country taken by lock()"""
+        self.redis.delete(f"{COUNTRY_EXTRACTS_PREFIX}:building:{country_id}")
+
+
+class FeatureFilter:
+    """Applies geometry type , tag and attribute filters of request on geojson features of country extract the same way query builder applies them on database
+
+    Args:
+        params: RawDataCurrentParams of request
+    """
+
+    def __init__(self, params):
+        filters = params.filters
+        if filters is not None and not isinstance(filters, dict):
+            filters = filters.dict()
+        (
+            _,
+            _,
+            point_attribute_filter,
+            line_attribute_filter,
+            poly_attribute_filter,
+            master_attribute_filter,
+            point_tag_filter,
+            line_tag_filter,
+            poly_tag_filter,
+            master_tag_filter,
+        ) = extract_attributes_tags(filters)
+        self.join_by = params.join_filter_type
+        self.geometry_types = set(params.geometry_type or ["point", "line", "polygon"])
+        if "all_geometry" in self.geometry_types:
+            self.geometry_types = {"point", "line", "polygon"}
+        # master filter is used for all geometry types if it is passed
+        self.tag_filters = {
+            "point": master_tag_filter or point_tag_filter,
+            "line": master_tag_filter or line_tag_filter,
+            "polygon": master_tag_filter or poly_tag_filter,
+        }
+        self.attribute_filters = {
+            geometry_type: self.columns(master_attribute_filter or attribute_filter)
+            for geometry_type, attribute_filter in [
+                ("point", point_attribute_filter),
+                ("line", line_attribute_filter),
+                ("polygon", poly_attribute_filter),
+            ]
+        }
+        # same condition as build_query_plan uses to keep every geometry of relations
+        self.merged_relations = (
+            {"line", "polygon"} <= self.geometry_types
+            and self.tag_filters["line"] == self.tag_filters["polygon"]
+            and self.attribute_filters["line"] == self.attribute_filters["polygon"]
+        )
+
+    @staticmethod
+    def columns(attribute_filter):
+        """tag key and property name of each attribute , same as column alias given by create_column_filter"""
+        columns = []
+        for column in attribute_filter or []:
+            for key in column.split(","):
+                if key != "":
+                    # postgres folds unquoted alias to lower case
+                    columns.append((key.strip(), remove_spaces(key.strip()).lower()))
+        return columns
+
+    @property
+    def is_empty(self):
+        """True if every feature of extract is delivered as it is"""
+        return (
+            self.geometry_types == {"point", "line", "polygon"}
+            and not any(self.tag_filters.values())
+            and not any(self.attribute_filters.values())
+        )
+
+    def match_tags(self, tags, tag_filter):
+        """Whether tags of feature match tag filter , same as generate_tag_filter_query does on database
+
+        Key with values matches if tag has one of the values , key without values matches any value of it , conditions of keys are joined with join_by (AND / OR)
+        """
+        conditions = []
+        for key, values in tag_filter.items():
+            if len(values) >= 1:
+                conditions.append(
+                    tags.get(key.strip()) in [value.strip() for value in values]
+                )
+            else:
+                conditions.append(key.strip() in tags)
+        return all(conditions) if self.join_by == "AND" else any(conditions)
+
+    def apply(self, feature):
+        """Returns feature with properties of request or None if it is filtered out"""
+        geometry_type = GEOMETRY_TYPES.get((feature.get("geometry") or {}).get("type"))
+        if geometry_type is None and self.merged_relations:
+            geometry_type = "polygon"  # filters of line and polygon are same
+        if geometry_type not in self.geometry_types:
+            return None
+        properties = feature["properties"]
+        tags = properties.get("tags") or {}
+        tag_filter = self.tag_filters[geometry_type]
+        if tag_filter and not self.match_tags(tags, tag_filter):
+            return None
+        columns = self.attribute_filters[geometry_type]
+        if columns:
+            feature["properties"] = {"osm_id": properties["osm_id"]}
+            for key, name in columns:
+                feature["properties"][name] = tags.get(key)
+        return feature
+
+    def write(self, source_path, f):
+        """Streams features of country extract written one feature per line to binary file object as feature collection
+
+        Returns:
+            no of features written , None if extract is copied as it is
+        """
+        row_count = 0
+        with open(source_path, "rb") as source:
+            if self.is_empty:
+                shutil.copyfileobj(source, f)
+                return None  # not counted
+            f.write(FEATURE_COLLECTION_HEADER)
+            for line in source:
+                line = line.rstrip(b",\n")
+                if (
+                    not line
+                    or line == FEATURE_COLLECTION_HEADER
+                    or line == FEATURE_COLLECTION_FOOTER
+                ):
+                    continue
+                feature = self.apply(orjson.loads(line))
+                if feature is None:
+                    continue
+                if row_count > 0:
+                    f.write(b",")
+                f.write(orjson.dumps(feature))
+                row_count += 1
+            f.write(FEATURE_COLLECTION_FOOTER)
+        logging.debug("%s features filtered from %s", row_count, source_path)
+        return row_count
@@ -0,0 +1,107 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains in memory spatial index of grid and countries_un tables , used to find grid and country of request without querying database"""
+import threading
+import time
+
+from src.config import logger as logging
+from src.query_builder.builder import (
+    check_last_updated_rawdata,
+    get_country_geometries_query,
+    get_grid_geometries_query,
+)
+
+try:
+    from shapely import STRtree, area, from_wkb, intersection, make_valid
+    from shapely.geometry import shape
+except ImportError:  # shapely is optional , lookup falls back to database without it
+    STRtree = None
+
+GEOMETRY_INDEX_SUPPORT = STRtree is not None
+
+
+class GeometryIndex:
+    """Keeps grid cells and country boundaries in STRtree , Tables are loaded once per process and reloaded only when database gets new import
+
+    Args:
+        refresh_interval: seconds between checks of replication status
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.import_date = None
+        self.checked_at = 0
+        self.grid = None
+        self.countries = None
+        self._lock = threading.Lock()
+
+    def refresh(self, cur):
+        """Loads index if database is updated after it was loaded , replication status is checked once in refresh_interval"""
+        with self._lock:
+            if (
+                self.import_date is not None
+                and time.time() - self.checked_at < self.refresh_interval
+            ):
+                return
+            cur.execute(check_last_updated_rawdata())
+            import_date = str(cur.fetchone()[0])
+            self.checked_at = time.time()
+            if import_date != self.import_date:
+                self.load(cur)
+                self.import_date = import_date
+
+    def load(self, cur):
+        """Reads grid and countries_un from database and builds their trees"""
+        start_time = time.time()
+        self.grid = self._build(cur, get_grid_geometries_query())
+        self.countries = self._build(cur, get_country_geometries_query())
+        logging.debug(
+            "Geometry index loaded with %s grid cells and %s countries in %s sec",
+            len(self.grid[0]),
+            len(self.countries[0]),
+            round(time.time() - start_time, 2),
+        )
+
+    @staticmethod
+    def _build(cur, query):
+        cur.execute(query)
+        rows = cur.fetchall()
+        ids = [row[0] for row in rows]
+        geometries = from_wkb([bytes(row[1]) for row in rows])
+        return ids, geometries, STRtree(geometries)
+
+    @staticmethod
+    def to_shape(geometry):
+        """shapely geometry from geojson dict"""
+        return shape(geometry)
+
+    def grid_ids(self, geom):
+        """Gives intersecting grid ids in same format as database rows"""
+        ids, _, tree = self.grid
+        return [(ids[i],) for i in sorted(tree.query(geom, predicate="intersects"))]
+
+    def country_ids(self, geom):
+        """Gives intersecting country ids ordered by area of intersection , biggest first"""
+        ids, geometries, tree = self.countries
+        candidates = tree.query(geom, predicate="intersects")
+        if len(candidates) == 0:
+            return []
+        areas = area(intersection(geometries[candidates], make_valid(geom)))
+        ordered = sorted(zip(candidates, areas), key=lambda item: -item[1])
+        return [(ids[i],) for i, _ in ordered]
@@ -18,56 +18,196 @@
 # <info@hotosm.org>
 """Page Contains Query logic required for application"""
 import re
-from json import dumps
+from datetime import timezone
+from functools import lru_cache
+from json import dumps, loads
 
 from src.config import logger as logging
-from src.validation.models import SupportedFilters, SupportedGeometryFilters
+from src.config import grid_index_tables, subdivide_vertices
+from src.query_builder.plan import (
+    RELATION_LINE_TYPES,
+    RELATION_POLYGON_TYPES,
+    IndexHint,
+    Projection,
+    QueryPlan,
+    TableScan,
+    TagFilter,
+    TagPredicate,
+)
+from src.validation.models import (
+    RawDataOutputType,
+    SupportedFilters,
+    SupportedGeometryFilters,
+)
 
 
-def get_grid_id_query(geometry_dump):
+CSV_GEOM_COLUMNS = """ST_X(ST_Centroid(geom)) as longitude , ST_Y(ST_Centroid(geom)) as latitude , GeometryType(geom) as geom_type"""
 
+
+# features of these tables can span many grid cells , their grid column keeps every cell they intersect
+GRID_ARRAY_TABLES = ["ways_line", "relations"]
+
+# request geometry is bound once per statement and referenced by every table query
+REQUEST_GEOMETRY_CTE = (
+    """with request_geometry as (select ST_GEOMFROMGEOJSON(%(geometry)s) as geom)"""
+)
+# pieces of complex request geometry , features are tested only against pieces whose bounding box they touch
+REQUEST_PIECES_CTE = """request_pieces as (select ST_Subdivide(geom, {max_vertices}) as geom from request_geometry)"""
+
+
+def bind_value(bind_params, value):
+    """adds value to bind_params and returns its placeholder , psycopg2 pyformat style"""
+    name = f"p{len(bind_params)}"
+    bind_params[name] = value
+    return f"%({name})s"
+
+
+def prepare_query(name, query, param_types):
+    """generates PREPARE statement of query , parameters of query are referenced as $1 , $2 .."""
+    return f"""PREPARE {name}({' , '.join(param_types)}) AS {query}"""
+
+
+def execute_prepared_query(name, params_count):
+    """generates EXECUTE of prepared statement with psycopg2 placeholders for its parameters"""
+    placeholders = " , ".join(["%s"] * params_count)
+    return f"""EXECUTE {name}({placeholders})"""
+
+
+def get_grid_id_query(geometry_dump, prepared=False):
+    """grid cells intersecting geometry , if prepared is passed geometry is left as $1 parameter"""
+    geometry = "$1" if prepared else f"'{geometry_dump}'"
     base_query = f"""select
                         b.poly_id
                     from
                         grid b
                     where
-                        ST_Intersects(ST_GEOMFROMGEOJSON('{geometry_dump}') ,
+                        ST_Intersects(ST_GEOMFROMGEOJSON({geometry}) ,
                         b.geom)"""
     return base_query
 
 
-def get_country_id_query(geom_dump):
+def get_grid_partition_query(geometry_dump):
+    """Gives intersecting grid id along with the part of geometry that falls inside the grid and whether grid is fully covered by geometry , used to split large extraction into small work units
+
+    part of fully covered grid is the grid itself so that its queries are same for every request covering it
+    """
+    base_query = f"""select
+                        b.poly_id ,
+                        case when ST_Covers(ST_GEOMFROMGEOJSON('{geometry_dump}'), b.geom) then ST_AsGeoJSON(b.geom)
+                        else ST_AsGeoJSON(ST_CollectionExtract(ST_Intersection(ST_MakeValid(ST_GEOMFROMGEOJSON('{geometry_dump}')), b.geom), 3)) end ,
+                        ST_Covers(ST_GEOMFROMGEOJSON('{geometry_dump}'), b.geom)
+                    from
+                        grid b
+                    where
+                        ST_Intersects(ST_GEOMFROMGEOJSON('{geometry_dump}') ,
+                        b.geom)
+                    order by b.poly_id"""
+    return base_query
+
+
+def get_grid_geometries_query():
+    """all grid cells , used to build in memory geometry index"""
+    return """select poly_id , ST_AsBinary(geom) from grid"""
+
+
+def get_country_geometries_query():
+    """all country boundaries , used to build in memory geometry index"""
+    return """select ogc_fid , ST_AsBinary(wkb_geometry) from countries_un"""
+
 
+def get_country_id_query(geom_dump, prepared=False):
+    """countries intersecting geometry ordered by intersection area , if prepared is passed geometry is left as $1 parameter"""
+    geometry = "$1" if prepared else f"'{geom_dump}'"
     base_query = f"""select
                         b.ogc_fid
                     from
                         countries_un b
                     where
-                        ST_Intersects(ST_GEOMFROMGEOJSON('{geom_dump}') ,
+                        ST_Intersects(ST_GEOMFROMGEOJSON({geometry}) ,
                         b.wkb_geometry)
-                    order by ST_Area(ST_Intersection(b.wkb_geometry,ST_MakeValid(ST_GEOMFROMGEOJSON('{geom_dump}')))) desc
+                    order by ST_Area(ST_Intersection(b.wkb_geometry,ST_MakeValid(ST_GEOMFROMGEOJSON({geometry})))) desc
 
                     """
     return base_query
 
 
-def get_query_as_geojson(query_list, ogr_export=None):
-    table_base_query = []
-    if ogr_export:
-        table_base_query = query_list
-    else:
-        for i in range(len(query_list)):
-            table_base_query.append(
-                f"""select ST_AsGeoJSON(t{i}.*) from ({query_list[i]}) t{i}"""
-            )
-    final_query = " UNION ALL ".join(table_base_query)
-    return final_query
-
-
-def create_geom_filter(geom):
-    """generates geometry intersection filter - Rawdata extraction"""
-    geometry_dump = dumps(dict(geom))
-    return f"""ST_intersects(ST_GEOMFROMGEOJSON('{geometry_dump}'), geom)"""
+def as_geojson(alias, precision=None):
+    """ST_AsGeoJSON of row , coordinates are written with precision decimal places if passed instead of postgis default 9"""
+    if precision is None:
+        return f"""ST_AsGeoJSON({alias}.*)"""
+    return f"""ST_AsGeoJSON({alias}.*, 'geom', {precision})"""
+
+
+def get_feature_query(query, partition_dump, precision=None):
+    """osm_id , whether row crosses partition and geojson feature of each row of table query of partition , used where duplicate features are removed
+
+    Grid cells don't overlap so row inside bounding box of its part is extracted by no other partition , only crossing rows need to be checked for duplicates
+    """
+    return f"""select t.osm_id , not ST_ContainsProperly(ST_Envelope(ST_GEOMFROMGEOJSON('{partition_dump}')), t.geom) , {as_geojson("t", precision)} from ({query}) t"""
+
+
+@lru_cache(maxsize=128)
+def get_rectangle(geometry_dump):
+    """xmin , ymin , xmax , ymax of geometry if it is an axis aligned rectangle , None otherwise"""
+    if not geometry_dump:
+        return None
+    geometry = loads(geometry_dump)
+    coordinates = geometry.get("coordinates")
+    if geometry.get("type") == "MultiPolygon" and len(coordinates) == 1:
+        coordinates = coordinates[0]
+    elif geometry.get("type") != "Polygon":
+        return None
+    if len(coordinates) != 1 or len(coordinates[0]) != 5:
+        return None  # holes or more vertices
+    ring = [tuple(point[:2]) for point in coordinates[0]]
+    if ring[0] != ring[-1]:
+        return None
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if x1 != x2 and y1 != y2:
+            return None  # edge is not axis aligned
+    xs, ys = {x for x, _ in ring}, {y for _, y in ring}
+    if len(xs) != 2 or len(ys) != 2:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+@lru_cache(maxsize=128)
+def count_vertices(geometry_dump):
+    """no of vertices of polygon or multipolygon"""
+    if not geometry_dump:
+        return 0
+    geometry = loads(geometry_dump)
+    polygons = geometry.get("coordinates") or []
+    if geometry.get("type") == "Polygon":
+        polygons = [polygons]
+    return sum(len(ring) for polygon in polygons for ring in polygon)
+
+
+def create_geometry_filter(
+    geometry_dump, table_name=None, parameterized=False, subdivided=False
+):
+    """generates geometry intersection filter of table , if geometry is a rectangle only its bounding box is checked
+
+    Points are inside the rectangle whenever they are inside its bounding box , other features whose bounding box is inside the rectangle intersect it without exact test
+    If subdivided is passed features are tested against request_pieces , query should be prefixed with with clause of plan
+    """
+    if subdivided:
+        return f"""geom && (select geom from request_geometry) and exists (select 1 from request_pieces where ST_intersects(request_pieces.geom, {table_name}.geom))"""
+    geometry = (
+        """(select geom from request_geometry)"""
+        if parameterized
+        else f"""ST_GEOMFROMGEOJSON('{geometry_dump}')"""
+    )
+    rectangle = get_rectangle(geometry_dump)
+    if rectangle is None:
+        return f"""ST_intersects({geometry}, geom)"""
+    envelope = geometry
+    if not parameterized:
+        xmin, ymin, xmax, ymax = rectangle
+        envelope = f"""ST_MakeEnvelope({xmin}, {ymin}, {xmax}, {ymax}, 4326)"""
+    if table_name == "nodes":
+        return f"""geom && {envelope}"""
+    return f"""geom && {envelope} and (geom @ {envelope} or ST_intersects({envelope}, geom))"""
 
 
 def format_file_name_str(input_str):
@@ -107,9 +247,7 @@ def create_column_filter(columns, create_schema=False, output_type="geojson"):
                     if create_schema:
                         schema[remove_spaces(cl.strip())] = "str"
         if output_type == "csv":  # if it is csv geom logic is different
-            filter_col.append("ST_X(ST_Centroid(geom)) as longitude")
-            filter_col.append("ST_Y(ST_Centroid(geom)) as latitude")
-            filter_col.append("GeometryType(geom) as geom_type")
+            filter_col.append(CSV_GEOM_COLUMNS)
 
         else:
             filter_col.append("geom")
@@ -121,228 +259,124 @@ def create_column_filter(columns, create_schema=False, output_type="geojson"):
         return """osm_id ,tags,changeset,timestamp,geom"""  # this is default attribute that we will deliver to user if user defines his own attribute column then those will be appended with osm_id only
 
 
-def generate_tag_filter_query(filter, join_by="OR", user_for_geojson=False):
-    incoming_filter = []
-    if user_for_geojson:
-        for item in filter:
-            key = item["key"]
-            value = item["value"]
-            if len(value) == 1 and value[0] == "*":
-                value = []
-            if len(value) >= 1:
-                sub_append = []
-                pre = """ tags @> '{"""
-                post = """ }'"""
-                for v in value:
-                    sub_append.append(
-                        f"""{pre} "{key.strip()}" : "{v.strip()}" {post}"""
-                    )
-                sub_append_join = " OR ".join(sub_append)
+def create_tag_containment(key, value):
+    """jsonb literal of single tag for containment (@>) filter"""
+    return dumps({key: value}).replace("'", "''")
 
-                incoming_filter.append(f"({sub_append_join})")
-            else:
-                incoming_filter.append(f"""tags ? '{key.strip()}'""")
 
+def generate_tag_filter_query(
+    filter, join_by="OR", user_for_geojson=False, bind_params=None
+):
+    """generates where condition of tags with containment (@>) and existence (?, ?|, ?&) operators so that gin index on tags can serve it
+
+    filter is {key : [values]} , plain snapshot passes list of {key , value} where * matches any value
+    if bind_params dict is passed keys and values are added to it and query gets placeholders instead of literals
+    """
+    if user_for_geojson:
+        predicates = [
+            (item["key"], [] if item["value"] == ["*"] else item["value"])
+            for item in filter
+        ]
     else:
-        for key, value in filter.items():
-
-            if len(value) > 1:
-                v_l = []
-                for lil in value:
-                    v_l.append(f""" '{lil.strip()}' """)
-                v_l_join = " , ".join(v_l)
-                value_tuple = f"""({v_l_join})"""
-
-                k = f""" '{key.strip()}' """
-                incoming_filter.append(
-                    """tags ->> """ + k + """IN """ + value_tuple + """"""
-                )
-            elif len(value) == 1:
-                incoming_filter.append(
-                    f"""tags ->> '{key.strip()}' = '{value[0].strip()}'"""
-                )
-            else:
-                incoming_filter.append(f"""tags ? '{key.strip()}'""")
+        predicates = filter.items()
+    incoming_filter = []
+    existence_keys = []
+    for key, value in predicates:
+        key = key.strip()
+        if len(value) == 0:
+            existence_keys.append(key)
+        elif bind_params is not None:
+            # array keeps the same statement for any no of values
+            v = bind_value(bind_params, [dumps({key: lil.strip()}) for lil in value])
+            incoming_filter.append(f"""tags @> ANY({v}::jsonb[])""")
+        else:
+            containment = " OR ".join(
+                f"""tags @> '{create_tag_containment(key, lil.strip())}'"""
+                for lil in value
+            )
+            # values of key are grouped when other keys are joined to them
+            incoming_filter.append(
+                f"({containment})"
+                if len(value) > 1 and len(predicates) > 1
+                else containment
+            )
+
+    if existence_keys:
+        # keys without values are checked together
+        if bind_params is not None:
+            keys = bind_value(
+                bind_params,
+                existence_keys[0] if len(existence_keys) == 1 else existence_keys,
+            )
+        elif len(existence_keys) == 1:
+            keys = f"""'{existence_keys[0].replace("'", "''")}'"""
+        else:
+            keys_join = " , ".join(
+                f"""'{key.replace("'", "''")}'""" for key in existence_keys
+            )
+            keys = f"""array[{keys_join}]"""
+        if len(existence_keys) == 1:
+            operator = "?"
+        else:
+            operator = "?&" if join_by == "AND" else "?|"
+        incoming_filter.append(f"""tags {operator} {keys}""")
 
     tag_filter = f" {join_by} ".join(incoming_filter)
 
     return tag_filter
 
 
-def extract_geometry_type_query(params, ogr_export=False, g_id=None, c_id=None):
-    """used for specifically focused on export tool , this will generate separate queries for line point and polygon can be used on other datatype support - Rawdata extraction"""
-
-    geom_filter = create_geom_filter(params.geometry)
-    select_condition = """osm_id ,tags,changeset,timestamp,geom"""  # this is default attribute that we will deliver to user if user defines his own attribute column then those will be appended with osm_id only
-    schema = {
+def projection_schema(projection):
+    """column schema of ogr export query of projection , writers create their fields from it"""
+    if projection.columns:
+        return create_column_filter(list(projection.columns), create_schema=True)[1]
+    if projection.compact:
+        return {"osm_id": "int64", "tags": "str"}
+    return {
         "osm_id": "int64",
+        "version": "int64",
         "tags": "str",
         "changeset": "int64",
         "timestamp": "str",
     }
-    query_point, query_line, query_poly = None, None, None
-    (
-        attribute_filter,
-        master_attribute_filter,
-        master_tag_filter,
-        poly_attribute_filter,
-        poly_tag_filter,
-    ) = (None, None, None, None, None)
-    point_schema, line_schema, poly_schema = None, None, None
-    (
-        tags,
-        attributes,
-        point_attribute_filter,
-        line_attribute_filter,
-        poly_attribute_filter,
-        master_attribute_filter,
-        point_tag_filter,
-        line_tag_filter,
-        poly_tag_filter,
-        master_tag_filter,
-    ) = (None, None, None, None, None, None, None, None, None, None)
-    if params.filters:
-        params.filters = (
-            params.filters.dict()
-        )  # FIXME: temp fix , since validation model got changed
-        (
-            tags,
-            attributes,
-            point_attribute_filter,
-            line_attribute_filter,
-            poly_attribute_filter,
-            master_attribute_filter,
-            point_tag_filter,
-            line_tag_filter,
-            poly_tag_filter,
-            master_tag_filter,
-        ) = extract_attributes_tags(params.filters)
-
-    if (
-        master_attribute_filter
-    ):  # if no specific point , line or poly filter is not passed master columns filter will be used , if master columns is also empty then above default select statement will be used
-        select_condition, schema = create_column_filter(
-            output_type=params.output_type,
-            columns=master_attribute_filter,
-            create_schema=True,
-        )
-    if master_tag_filter:
-        attribute_filter = generate_tag_filter_query(
-            master_tag_filter, params.join_filter_type
-        )
-    if params.geometry_type is None:  # fix me
-        params.geometry_type = ["point", "line", "polygon"]
-
-    for type in params.geometry_type:
-        if type == SupportedGeometryFilters.POINT.value:
-            if point_attribute_filter:
-                select_condition, schema = create_column_filter(
-                    output_type=params.output_type,
-                    columns=point_attribute_filter,
-                    create_schema=True,
-                )
-            where_clause_for_nodes = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "nodes"
-            )
-
-            query_point = f"""select
-                        {select_condition}
-                        from
-                            nodes
-                        where
-                            {where_clause_for_nodes}"""
-            if point_tag_filter:
-                attribute_filter = generate_tag_filter_query(
-                    point_tag_filter, params.join_filter_type
-                )
-            if attribute_filter:
-                query_point += f""" and ({attribute_filter})"""
-            point_schema = schema
-
-            query_point = get_query_as_geojson([query_point], ogr_export=ogr_export)
-
-        if type == SupportedGeometryFilters.LINE.value:
-            query_line_list = []
-            if line_attribute_filter:
-                select_condition, schema = create_column_filter(
-                    output_type=params.output_type,
-                    columns=line_attribute_filter,
-                    create_schema=True,
-                )
-            where_clause_for_line = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "ways_line"
-            )
 
-            query_ways_line = f"""select
-                {select_condition}
-                from
-                    ways_line
-                where
-                    {where_clause_for_line}"""
-            where_clause_for_rel = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "relations"
-            )
 
-            query_relations_line = f"""select
-                {select_condition}
-                from
-                    relations
-                where
-                    {where_clause_for_rel}"""
-            if line_tag_filter:
-                attribute_filter = generate_tag_filter_query(
-                    line_tag_filter, params.join_filter_type
-                )
-            if attribute_filter:
-                query_ways_line += f""" and ({attribute_filter})"""
-                query_relations_line += f""" and ({attribute_filter})"""
-            query_relations_line += """ and (geometrytype(geom)='MULTILINESTRING')"""
-            query_line_list.append(query_ways_line)
-            query_line_list.append(query_relations_line)
-            query_line = get_query_as_geojson(query_line_list, ogr_export=ogr_export)
-            line_schema = schema
-
-        if type == SupportedGeometryFilters.POLYGON.value:
-            query_poly_list = []
-            if poly_attribute_filter:
-                select_condition, schema = create_column_filter(
-                    output_type=params.output_type,
-                    columns=poly_attribute_filter,
-                    create_schema=True,
-                )
-
-            where_clause_for_poly = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "ways_poly"
-            )
-
-            query_ways_poly = f"""select
-                {select_condition}
-                from
-                    ways_poly
-                where
-                    {where_clause_for_poly}"""
-            where_clause_for_relations = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "relations"
-            )
-
-            query_relations_poly = f"""select
-                {select_condition}
-                from
-                    relations
-                where
-                    {where_clause_for_relations}"""
-            if poly_tag_filter:
-                attribute_filter = generate_tag_filter_query(
-                    poly_tag_filter, params.join_filter_type
-                )
-            if attribute_filter:
-                query_ways_poly += f""" and ({attribute_filter})"""
-                query_relations_poly += f""" and ({attribute_filter})"""
-            query_relations_poly += """ and (geometrytype(geom)='POLYGON' or geometrytype(geom)='MULTIPOLYGON')"""
-            query_poly_list.append(query_ways_poly)
-            query_poly_list.append(query_relations_poly)
-            query_poly = get_query_as_geojson(query_poly_list, ogr_export=ogr_export)
-            poly_schema = schema
+def extract_geometry_type_query(params, ogr_export=False, g_id=None, c_id=None):
+    """used for specifically focused on export tool , this will generate separate queries for line point and polygon can be used on other datatype support - Rawdata extraction
+
+    Queries are compiled from query plan of request so they extract same features and columns as geojson export does , None is returned for geometry types which are not requested
+    """
+    # country extracts are built without geometry , country filter is used instead
+    geometry_dump = dumps(dict(params.geometry)) if params.geometry else None
+    plan = build_query_plan(params, g_id, c_id, geometry_dump, separate_relations=True)
+    table_queries, _ = compile_query_plan(plan, ogr_export=ogr_export)
+    with_clause = create_with_clause(plan)
+    geometry_types = [
+        SupportedGeometryFilters.POINT.value,
+        SupportedGeometryFilters.LINE.value,
+        SupportedGeometryFilters.POLYGON.value,
+    ]
+    queries, schemas = {}, {}
+    for scan, query in zip(plan.scans, table_queries):
+        if scan.table == "nodes":
+            geometry_type = SupportedGeometryFilters.POINT.value
+        elif scan.table == "ways_line" or scan.geometry_types == RELATION_LINE_TYPES:
+            geometry_type = SupportedGeometryFilters.LINE.value
+        else:
+            geometry_type = SupportedGeometryFilters.POLYGON.value
+        queries.setdefault(geometry_type, []).append(query)
+        schemas[geometry_type] = projection_schema(scan.projection)
+    for geometry_type, query_list in queries.items():
+        final_query = " UNION ALL ".join(query_list)
+        if with_clause:
+            final_query = f"{with_clause} {final_query}"
+        queries[geometry_type] = final_query
+    query_point, query_line, query_poly = (
+        queries.get(geometry_type) for geometry_type in geometry_types
+    )
+    point_schema, line_schema, poly_schema = (
+        schemas.get(geometry_type) for geometry_type in geometry_types
+    )
     return query_point, query_line, query_poly, point_schema, line_schema, poly_schema
 
 
@@ -397,17 +431,26 @@ def extract_attributes_tags(filters):
     )
 
 
+def create_since_filter(since):
+    """features created or modified after since , timestamp column keeps utc time of last edit without time zone"""
+    if since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return f"""timestamp > '{since.isoformat(sep=" ")}'"""
+
+
 def generate_where_clause_indexes_case(
-    geom_filter, g_id, c_id, country_export, table_name="ways_poly"
+    geom_filter, g_id, c_id, country_export, table_name="ways_poly", since=None
 ):
     where_clause = geom_filter
     if g_id:
-        if (
-            table_name == "ways_poly"
-        ):  # currently grid index is only available for ways_poly
+        if table_name in grid_index_tables:
             column_name = "grid"
-            grid_filter_base = [f"""{column_name} = {ind[0]}""" for ind in g_id]
-            grid_filter = " OR ".join(grid_filter_base)
+            if table_name in GRID_ARRAY_TABLES:
+                grid_ids = " , ".join(str(ind[0]) for ind in g_id)
+                grid_filter = f"""{column_name} && ARRAY[{grid_ids}]"""
+            else:
+                grid_filter_base = [f"""{column_name} = {ind[0]}""" for ind in g_id]
+                grid_filter = " OR ".join(grid_filter_base)
             where_clause = f"({grid_filter}) and ({geom_filter})"
     if c_id:
         if table_name == "ways_poly" or table_name == "nodes":
@@ -422,18 +465,56 @@ def generate_where_clause_indexes_case(
             if table_name == "ways_poly" or table_name == "nodes":
 
                 where_clause = f"(country = {c_id})"
+    if since:
+        # kept next to spatial filter so that index on timestamp can be used
+        where_clause += f" and ({create_since_filter(since)})"
 
     return where_clause
 
 
-def raw_currentdata_extraction_query(
-    params, g_id, c_id, geometry_dump, ogr_export=False, select_all=False
-):
-    """Default function to support current snapshot extraction with all of the feature that export_tool_api has"""
-    geom_filter = f"""ST_intersects(ST_GEOMFROMGEOJSON('{geometry_dump}'), geom)"""
+def filters_as_dict(filters):
+    """filters of request as dict , request may keep them as model or as already parsed dict"""
+    if filters is None or isinstance(filters, dict):
+        return filters
+    return filters.dict()
+
+
+def create_projection(columns, select_all=False, csv=False, compact=False):
+    """projection of plan , select_all and compact only matter for default columns so they are dropped when columns are passed"""
+    columns = tuple(columns or ())
+    if columns:
+        return Projection(columns, False, csv)
+    if compact:
+        return Projection((), False, csv, True)
+    return Projection((), select_all, csv)
+
+
+def create_tag_filter(tag_filter, join_by):
+    """tag filter of plan from {key : [values]} of request"""
+    if not tag_filter:
+        return None
+    return TagFilter(
+        tuple(
+            TagPredicate(key.strip(), tuple(value.strip() for value in values))
+            for key, values in tag_filter.items()
+        ),
+        join_by,
+    )
+
 
-    base_query = []
+def build_query_plan(
+    params,
+    g_id,
+    c_id,
+    geometry_dump,
+    select_all=False,
+    parameterized=False,
+    separate_relations=False,
+):
+    """Turns request into query plan of tables to scan , params are only read
 
+    Relations are scanned once for line and polygon when both are extracted with same columns and tags , unless separate_relations is passed for outputs writing line and polygon to different layers
+    """
     (
         tags,
         attributes,
@@ -445,44 +526,8 @@ def raw_currentdata_extraction_query(
         line_tag_filter,
         poly_tag_filter,
         master_tag_filter,
-    ) = (None, None, None, None, None, None, None, None, None, None)
-
-    point_select_condition = None
-    line_select_condition = None
-    poly_select_condition = None
-
-    point_tag = None
-    line_tag = None
-    poly_tag = None
-    master_tag = None
-    use_geomtype_in_relation = True
-
-    # query_table = []
-    if select_all:
-        select_condition = """osm_id,version,tags,changeset,timestamp,geom"""  # FIXme have condition for displaying userinfo after user authentication
-    else:
-        select_condition = """osm_id ,version,tags,changeset,timestamp,geom"""  # this is default attribute that we will deliver to user if user defines his own attribute column then those will be appended with osm_id only
-
-    point_select_condition = select_condition  # initializing default
-    line_select_condition = select_condition
-    poly_select_condition = select_condition
-
-    if params.filters:
-        params.filters = (
-            params.filters.dict()
-        )  # FIXME: temp fix , since validation model got changed
-        (
-            tags,
-            attributes,
-            point_attribute_filter,
-            line_attribute_filter,
-            poly_attribute_filter,
-            master_attribute_filter,
-            point_tag_filter,
-            line_tag_filter,
-            poly_tag_filter,
-            master_tag_filter,
-        ) = extract_attributes_tags(params.filters)
+    ) = extract_attributes_tags(filters_as_dict(params.filters))
+    csv = params.output_type == "csv"
     attribute_customization_full_support = ["geojson", "shp"]
 
     if params.output_type not in attribute_customization_full_support:
@@ -497,7 +542,8 @@ def raw_currentdata_extraction_query(
                 poly_attribute_filter,
             ]
         ]
-        merged_result = list({x for l in merged_array for x in l})
+        # sorted so that same request always gets same columns in same order
+        merged_result = sorted({x for l in merged_array for x in l})
         logging.debug(merged_result)
         if point_attribute_filter:
             point_attribute_filter = merged_result
@@ -506,151 +552,252 @@ def raw_currentdata_extraction_query(
         if poly_attribute_filter:
             poly_attribute_filter = merged_result
 
-    if attributes:
-        if master_attribute_filter:
-            if len(master_attribute_filter) > 0:
-                select_condition = create_column_filter(
-                    output_type=params.output_type, columns=master_attribute_filter
-                )
-                # if master attribute is supplied it will be applied to other geom type as well even though value is supplied they will be ignored
-                point_select_condition = select_condition
-                line_select_condition = select_condition
-                poly_select_condition = select_condition
-        else:
-            if point_attribute_filter:
-                if len(point_attribute_filter) > 0:
-                    point_select_condition = create_column_filter(
-                        output_type=params.output_type, columns=point_attribute_filter
-                    )
-            if line_attribute_filter:
-                if len(line_attribute_filter) > 0:
-                    line_select_condition = create_column_filter(
-                        output_type=params.output_type, columns=line_attribute_filter
-                    )
-            if poly_attribute_filter:
-                if len(poly_attribute_filter) > 0:
-                    poly_select_condition = create_column_filter(
-                        output_type=params.output_type, columns=poly_attribute_filter
-                    )
-
-    if tags:
-        if (
-            master_tag_filter
-        ):  # if master tag is supplied then other tags should be ignored and master tag will be used
-            master_tag = generate_tag_filter_query(
-                master_tag_filter, params.join_filter_type
-            )
-            point_tag = master_tag
-            line_tag = master_tag
-            poly_tag = master_tag
-        else:
-            if point_tag_filter:
-                point_tag = generate_tag_filter_query(
-                    point_tag_filter, params.join_filter_type
-                )
-            if line_tag_filter:
-                line_tag = generate_tag_filter_query(
-                    line_tag_filter, params.join_filter_type
-                )
-            if poly_tag_filter:
-                poly_tag = generate_tag_filter_query(
-                    poly_tag_filter, params.join_filter_type
-                )
+    if master_attribute_filter:
+        # if master attribute is supplied it will be applied to other geom type as well even though value is supplied they will be ignored
+        point_attribute_filter = master_attribute_filter
+        line_attribute_filter = master_attribute_filter
+        poly_attribute_filter = master_attribute_filter
+    compact = bool(params.compact)
+    point_projection = create_projection(
+        point_attribute_filter, select_all, csv, compact
+    )
+    line_projection = create_projection(line_attribute_filter, select_all, csv, compact)
+    poly_projection = create_projection(poly_attribute_filter, select_all, csv, compact)
 
-    # condition for geometry types
-    if params.geometry_type is None:
-        params.geometry_type = ["point", "line", "polygon"]
-    if SupportedGeometryFilters.ALLGEOM.value in params.geometry_type:
-        params.geometry_type = ["point", "line", "polygon"]
-    if SupportedGeometryFilters.POINT.value in params.geometry_type:
-        where_clause_for_nodes = generate_where_clause_indexes_case(
-            geom_filter, g_id, c_id, params.country_export, "nodes"
-        )
+    if master_tag_filter:
+        # if master tag is supplied then other tags should be ignored and master tag will be used
+        point_tag_filter = master_tag_filter
+        line_tag_filter = master_tag_filter
+        poly_tag_filter = master_tag_filter
+    point_tag = create_tag_filter(point_tag_filter, params.join_filter_type)
+    line_tag = create_tag_filter(line_tag_filter, params.join_filter_type)
+    poly_tag = create_tag_filter(poly_tag_filter, params.join_filter_type)
+
+    geometry_types = params.geometry_type or ["point", "line", "polygon"]
+    if SupportedGeometryFilters.ALLGEOM.value in geometry_types:
+        geometry_types = ["point", "line", "polygon"]
+    extract_point = SupportedGeometryFilters.POINT.value in geometry_types
+    extract_line = SupportedGeometryFilters.LINE.value in geometry_types
+    extract_poly = SupportedGeometryFilters.POLYGON.value in geometry_types
+    merge_relations = (
+        not separate_relations
+        and extract_line
+        and extract_poly
+        and line_projection == poly_projection
+        and line_tag == poly_tag
+    )
 
-        query_point = f"""select
-                    {point_select_condition}
-                    from
-                        nodes
-                    where
-                        {where_clause_for_nodes}"""
-        if point_tag:
-            query_point += f""" and ({point_tag})"""
-        base_query.append(query_point)
-
-    if SupportedGeometryFilters.LINE.value in params.geometry_type:
-        where_clause_for_line = generate_where_clause_indexes_case(
-            geom_filter, g_id, c_id, params.country_export, "ways_line"
+    scans = []
+    if extract_point:
+        scans.append(TableScan("nodes", point_projection, point_tag))
+    if extract_line:
+        scans.append(TableScan("ways_line", line_projection, line_tag))
+        if not merge_relations:
+            scans.append(
+                TableScan("relations", line_projection, line_tag, RELATION_LINE_TYPES)
+            )
+    if extract_poly:
+        scans.append(TableScan("ways_poly", poly_projection, poly_tag))
+        scans.append(
+            TableScan(
+                "relations",
+                poly_projection,
+                poly_tag,
+                () if merge_relations else RELATION_POLYGON_TYPES,
+            )
         )
 
-        query_ways_line = f"""select
-            {line_select_condition}
-            from
-                ways_line
-            where
-                {where_clause_for_line}"""
-        if line_tag:
-            query_ways_line += f""" and ({line_tag})"""
-        base_query.append(query_ways_line)
-
-        if SupportedGeometryFilters.POLYGON.value in params.geometry_type:
-            if poly_select_condition == line_select_condition and poly_tag == line_tag:
-                use_geomtype_in_relation = False
-
-        if use_geomtype_in_relation:
-            where_clause_for_rel = generate_where_clause_indexes_case(
-                geom_filter, g_id, c_id, params.country_export, "relations"
-            )
+    return QueryPlan(
+        scans=tuple(scans),
+        geometry_dump=geometry_dump,
+        index_hint=IndexHint(
+            grid_ids=tuple(ind[0] for ind in g_id) if g_id else (),
+            country_id=c_id,
+            country_export=bool(params.country_export),
+        ),
+        since=params.since,
+        parameterized=parameterized,
+        precision=params.precision,
+        subdivide_vertices=subdivide_vertices
+        if subdivide_vertices and count_vertices(geometry_dump) > subdivide_vertices
+        else 0,
+    )
 
-            query_relations_line = f"""select
-                {line_select_condition}
-                from
-                    relations
-                where
-                    {where_clause_for_rel}"""
-            if line_tag:
-                query_relations_line += f""" and ({line_tag})"""
-            query_relations_line += """ and (geometrytype(geom)='MULTILINESTRING')"""
-            base_query.append(query_relations_line)
-
-    if SupportedGeometryFilters.POLYGON.value in params.geometry_type:
-        where_clause_for_poly = generate_where_clause_indexes_case(
-            geom_filter, g_id, c_id, params.country_export, "ways_poly"
-        )
 
-        query_ways_poly = f"""select
-            {poly_select_condition}
-            from
-                ways_poly
-            where
-                {where_clause_for_poly}"""
-        if poly_tag:
-            query_ways_poly += f""" and ({poly_tag})"""
-        base_query.append(query_ways_poly)
-        where_clause_for_relations = generate_where_clause_indexes_case(
-            geom_filter, g_id, c_id, params.country_export, "relations"
+def compile_projection(projection):
+    """select condition of projection"""
+    output_type = "csv" if projection.csv else "geojson"
+    if projection.columns:
+        return create_column_filter(
+            output_type=output_type, columns=list(projection.columns)
         )
-        query_relations_poly = f"""select
-            {poly_select_condition}
-            from
-                relations
-            where
-                {where_clause_for_relations}"""
-        if poly_tag:
-            query_relations_poly += f""" and ({poly_tag})"""
-        if use_geomtype_in_relation:
-            query_relations_poly += """ and (geometrytype(geom)='POLYGON' or geometrytype(geom)='MULTIPOLYGON')"""
-        base_query.append(query_relations_poly)
-
-    if ogr_export:
-        # since query will be different for ogr exports and geojson exports because for ogr exports we don't need to grab each row in geojson
-        table_base_query = base_query
+    if projection.compact:
+        select_condition = """osm_id ,tags,geom"""
+    elif projection.select_all:
+        select_condition = """osm_id,version,tags,changeset,timestamp,geom"""  # FIXme have condition for displaying userinfo after user authentication
     else:
-        table_base_query = []
-        for i in range(len(base_query)):
-            table_base_query.append(
-                f"""select ST_AsGeoJSON(t{i}.*) from ({base_query[i]}) t{i}"""
+        select_condition = """osm_id ,version,tags,changeset,timestamp,geom"""  # this is default attribute that we will deliver to user if user defines his own attribute column then those will be appended with osm_id only
+    if projection.csv:
+        # csv can't hold geometry , location is delivered same as attribute filter does
+        select_condition = f"""{select_condition[:-len('geom')]} {CSV_GEOM_COLUMNS}"""
+    return select_condition
+
+
+def get_extraction_tables(params):
+    """tables scanned by raw_currentdata_extraction_query of params in the same order as its queries"""
+    return [scan.table for scan in build_query_plan(params, None, None, None).scans]
+
+
+def extraction_table_queries(params, g_id, c_id, geometry_dump, bind_params=None):
+    """(table , query) of each table scan of params , queries are same as output type of params runs them so that they can be explained to estimate export
+
+    shapefile , flatgeobuf and geopackage join queries of same geometry type with UNION ALL and they are not parameterized , other formats except geojson and csv go through ogr
+    """
+    output_type = params.output_type
+    plan = build_query_plan(
+        params,
+        g_id,
+        c_id,
+        geometry_dump,
+        parameterized=bind_params is not None
+        and output_type
+        in [RawDataOutputType.GEOJSON.value, RawDataOutputType.CSV.value],
+        separate_relations=output_type
+        in [
+            RawDataOutputType.SHAPEFILE.value,
+            RawDataOutputType.FLATGEOBUF.value,
+            RawDataOutputType.GEOPACKAGE.value,
+        ],
+    )
+    table_queries, plan_bind_params = compile_query_plan(
+        plan, ogr_export=output_type != RawDataOutputType.GEOJSON.value
+    )
+    if plan.parameterized:
+        bind_params.update(plan_bind_params)
+    with_clause = create_with_clause(plan)
+    return [
+        (scan.table, f"{with_clause} {query}" if with_clause else query)
+        for scan, query in zip(plan.scans, table_queries)
+    ]
+
+
+def create_with_clause(plan):
+    """with clause of request geometry and its pieces that table queries of plan refer to , empty if they don't need one"""
+    if not plan.parameterized and not plan.subdivide_vertices:
+        return ""
+    with_clause = REQUEST_GEOMETRY_CTE
+    if not plan.parameterized:
+        with_clause = f"""with request_geometry as (select ST_GEOMFROMGEOJSON('{plan.geometry_dump}') as geom)"""
+    if plan.subdivide_vertices:
+        pieces = REQUEST_PIECES_CTE.format(max_vertices=plan.subdivide_vertices)
+        with_clause += f""" , {pieces}"""
+    return with_clause
+
+
+@lru_cache(maxsize=128)
+def compile_query_plan(plan, ogr_export=False):
+    """Compiles plan to query of each table scan , memoized on plan so repeated requests don't build sql again
+
+    Returns:
+        tuple of table queries , tuple of bind params items when plan is parameterized
+    """
+    bind_params = None
+    if plan.parameterized:
+        bind_params = {"geometry": plan.geometry_dump}
+    g_id = [(grid_id,) for grid_id in plan.index_hint.grid_ids]
+    tag_conditions = {}  # scans sharing tag filter share its bind params too
+
+    table_queries = []
+    for i, scan in enumerate(plan.scans):
+        select_condition = compile_projection(scan.projection)
+        if plan.parameterized:
+            # % of attribute names would be taken as placeholder
+            select_condition = select_condition.replace("%", "%%")
+        where_clause = generate_where_clause_indexes_case(
+            create_geometry_filter(
+                plan.geometry_dump,
+                scan.table,
+                parameterized=plan.parameterized,
+                subdivided=bool(plan.subdivide_vertices),
+            ),
+            g_id,
+            plan.index_hint.country_id,
+            plan.index_hint.country_export,
+            scan.table,
+            since=plan.since,
+        )
+        # indentation is same as queries were written before , sql of request doesn't change
+        if scan.table == "nodes":
+            indent = " " * 20
+        elif scan.geometry_types == RELATION_LINE_TYPES:
+            indent = " " * 16
+        else:
+            indent = " " * 12
+        query = f"""select
+{indent}{select_condition}
+{indent}from
+{indent}    {scan.table}
+{indent}where
+{indent}    {where_clause}"""
+        if scan.tag_filter:
+            if scan.tag_filter not in tag_conditions:
+                tag_conditions[scan.tag_filter] = generate_tag_filter_query(
+                    {
+                        predicate.key: list(predicate.values)
+                        for predicate in scan.tag_filter.predicates
+                    },
+                    scan.tag_filter.join_by,
+                    bind_params=bind_params,
+                )
+            query += f""" and ({tag_conditions[scan.tag_filter]})"""
+        if scan.geometry_types:
+            geometry_type_filter = " or ".join(
+                f"geometrytype(geom)='{geometry_type}'"
+                for geometry_type in scan.geometry_types
             )
+            query += f""" and ({geometry_type_filter})"""
+        if not ogr_export:
+            # since query will be different for ogr exports and geojson exports because for ogr exports we don't need to grab each row in geojson
+            query = (
+                f"""select {as_geojson(f"t{i}", plan.precision)} from ({query}) t{i}"""
+            )
+        table_queries.append(query)
+    return tuple(table_queries), tuple(bind_params.items()) if bind_params else ()
+
+
+def raw_currentdata_extraction_query(
+    params,
+    g_id,
+    c_id,
+    geometry_dump,
+    ogr_export=False,
+    select_all=False,
+    as_list=False,
+    bind_params=None,
+):
+    """Default function to support current snapshot extraction with all of the feature that export_tool_api has , if as_list is passed query of each table is returned separately in the same order as they are joined in UNION ALL
+
+    if bind_params dict is passed geometry and tag filters are added to it and query is returned with placeholders , query should be executed along with bind_params
+    """
+    plan = build_query_plan(
+        params,
+        g_id,
+        c_id,
+        geometry_dump,
+        select_all=select_all,
+        parameterized=bind_params is not None,
+    )
+    table_base_query, plan_bind_params = compile_query_plan(plan, ogr_export=ogr_export)
+    if bind_params is not None:
+        bind_params.update(plan_bind_params)
+    with_clause = create_with_clause(plan)
+    if as_list:
+        if with_clause:
+            return [f"{with_clause} {query}" for query in table_base_query]
+        return list(table_base_query)
     final_query = " UNION ALL ".join(table_base_query)
+    if with_clause:
+        final_query = f"{with_clause} {final_query}"
     if params.output_type == "csv":
         logging.debug(final_query)
     return final_query
@@ -0,0 +1,70 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains query plan of snapshot extraction , request is turned into plan by builder and plan is compiled to sql
+
+Plan is made of tuples only so that it is hashable and compiled sql can be memoized on it
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+
+# geometry types of relations kept when line and polygon of relations are extracted separately
+RELATION_LINE_TYPES = ("MULTILINESTRING",)
+RELATION_POLYGON_TYPES = ("POLYGON", "MULTIPOLYGON")
+
+
+class TagPredicate(NamedTuple):
+    key: str
+    values: Tuple[str, ...]  # empty values matches any value of key
+
+
+class TagFilter(NamedTuple):
+    predicates: Tuple[TagPredicate, ...]
+    join_by: str
+
+
+class Projection(NamedTuple):
+    columns: Tuple[str, ...]  # attribute columns , empty for default columns
+    select_all: bool = False
+    csv: bool = False
+    compact: bool = False  # default columns without version , changeset and timestamp
+
+
+class TableScan(NamedTuple):
+    table: str
+    projection: Projection
+    tag_filter: Optional[TagFilter] = None
+    geometry_types: Tuple[str, ...] = ()  # empty keeps every geometry of table
+
+
+class IndexHint(NamedTuple):
+    grid_ids: Tuple[int, ...] = ()
+    country_id: Optional[int] = None
+    country_export: bool = False
+
+
+class QueryPlan(NamedTuple):
+    scans: Tuple[TableScan, ...]
+    geometry_dump: Optional[str]
+    index_hint: IndexHint
+    since: Optional[datetime] = None
+    parameterized: bool = False
+    precision: Optional[
+        int
+    ] = None  # decimal places of geojson coordinates , postgis default when None
+    subdivide_vertices: int = 0  # max vertices of request geometry pieces , 0 matches features with whole geometry
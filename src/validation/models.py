@@ -18,6 +18,7 @@
 # <info@hotosm.org>
 """Page contains validation models for application"""
 import json
+from datetime import datetime
 from enum import Enum
 from typing import Dict, List, Optional, Union
 
@@ -165,6 +166,27 @@ class RawDataCurrentParams(BaseModel):
             ],
         },
     )
+    since: Optional[datetime] = Field(
+        default=None,
+        example="2022-06-27 19:59:24+05:45",
+        description="Exports only features created or modified after this time , pass lastUpdated of previous export result to get changes since it. Deleted features are not part of database so they can't be delivered",
+    )
+    since_export: Optional[str] = Field(
+        default=None,
+        example="3fded368-456f-4ef4-a1b8-c099a7f77ca4",
+        description="Task id of previous export , exports features created or modified after data of that export",
+    )
+    precision: Optional[int] = Field(
+        default=None,
+        ge=0,
+        le=15,
+        example=7,
+        description="Decimal places of coordinates in geojson output , 7 keeps centimetre precision . Defaults to 9",
+    )
+    compact: Optional[bool] = Field(
+        default=False,
+        description="Delivers osm_id , tags and geometry only , version , changeset and timestamp are left out . Ignored when attributes are filtered",
+    )
     if allow_bind_zip_filter:
         bind_zip: Optional[bool] = True
 
@@ -212,6 +234,22 @@ class RawDataCurrentParams(BaseModel):
             )
         return value
 
+    @validator("since_export", allow_reuse=True)
+    def check_since_option(cls, value, values):
+        """only one of since and since_export can be used"""
+        if value and values.get("since"):
+            raise ValueError("Pass either since or since_export , not both")
+        return value
+
+    @validator("precision", allow_reuse=True)
+    def check_precision_output_type(cls, value, values):
+        """precision is applied where geojson is generated by database"""
+        if value is not None and values.get("output_type") != (
+            RawDataOutputType.GEOJSON.value
+        ):
+            raise ValueError("precision is supported for geojson output only")
+        return value
+
     @validator("geometry_type", allow_reuse=True)
     def return_unique_value(cls, value):
         """return unique list"""
@@ -251,9 +289,23 @@ class SnapshotParamsPlain(BaseModel):
         return value
 
 
+class ExportEstimate(BaseModel):
+    rows: int
+    bytes: int
+    seconds: float
+    tables: Dict[str, int]
+
+
 class SnapshotResponse(BaseModel):
     task_id: str
     track_link: str
+    download_url: Optional[str] = Field(
+        default=None, description="Only when same export is served from cache"
+    )
+    estimate: Optional[ExportEstimate] = Field(
+        default=None,
+        description="Rows , size in bytes and time in seconds expected from export , only when export estimate is enabled",
+    )
 
     class Config:
         schema_extra = {
@@ -271,6 +323,11 @@ class SnapshotTaskResult(BaseModel):
     query_area: str
     binded_file_size: str
     zip_file_size_bytes: int
+    last_updated: Optional[str]
+    fragment_cache: Optional[Dict[str, int]] = Field(
+        default=None, description="Hits and misses of grid cells taken from cache"
+    )
+    estimate: Optional[ExportEstimate]
 
 
 class SnapshotTaskResponse(BaseModel):
@@ -290,6 +347,7 @@ class SnapshotTaskResponse(BaseModel):
                     "query_area": "6 Sq Km ",
                     "binded_file_size": "7 MB",
                     "zip_file_size_bytes": 1331601,
+                    "last_updated": "2022-06-27 19:59:24+05:45",
                 },
             }
         }
@@ -0,0 +1,430 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains streaming FlatGeobuf writer with packed hilbert r-tree spatial index
+
+Flatbuffers of header and features are encoded here directly so flatbuffers library is not required , Tables are laid out with vtable first and their children after them which is valid for any flatbuffers reader
+"""
+import os
+import struct
+from array import array
+from math import floor
+
+from .wkb import (
+    GEOMETRYCOLLECTION,
+    LINESTRING,
+    MULTILINESTRING,
+    MULTIPOINT,
+    MULTIPOLYGON,
+    POINT,
+    POLYGON,
+    bounding_box,
+    flatten_points,
+    parse_wkb,
+)
+
+MAGIC_BYTES = b"fgb\x03fgb\x00"
+INDEX_NODE_SIZE = 16
+NODE_ITEM_SIZE = 40  # min_x , min_y , max_x , max_y , offset
+HILBERT_MAX = (1 << 16) - 1
+
+# flatgeobuf column types used for query builder schema types
+COLUMN_TYPE_LONG = 7
+COLUMN_TYPE_STRING = 11
+COLUMN_TYPES = {"int64": COLUMN_TYPE_LONG, "str": COLUMN_TYPE_STRING}
+GEOMETRY_TYPE_UNKNOWN = 0
+
+
+def _pad(data):
+    """pads data to multiple of 8 so that next object stays aligned"""
+    return data + b"\0" * (-len(data) % 8)
+
+
+def fb_string(value):
+    encoded = value.encode("utf-8")
+    return _pad(struct.pack("<I", len(encoded)) + encoded + b"\0"), 0
+
+
+def fb_vector(fmt, values):
+    """vector of scalars , returns blob data and position of vector inside it"""
+    if struct.calcsize(fmt) == 8:
+        # length is placed 4 bytes ahead so that elements are 8 byte aligned
+        return (
+            _pad(
+                b"\0" * 4 + struct.pack(f"<I{len(values)}{fmt}", len(values), *values)
+            ),
+            4,
+        )
+    return _pad(struct.pack(f"<I{len(values)}{fmt}", len(values), *values)), 0
+
+
+def fb_table_vector(tables):
+    """vector of tables , children are placed after offsets"""
+    count = len(tables)
+    head_length = 4 + 4 * count
+    position = head_length + (-head_length % 8)
+    offsets, children = [], []
+    for i, (data, start) in enumerate(tables):
+        offsets.append(position + start - (4 + 4 * i))
+        children.append(data)
+        position += len(data)
+    head = struct.pack(f"<I{count}I", count, *offsets)
+    return _pad(head) + b"".join(children), 0
+
+
+def fb_table(fields):
+    """Encodes table , fields is list ordered by field id with None for absent field or (struct format , value) where format offset takes child blob"""
+    while fields and fields[-1] is None:
+        fields = fields[:-1]
+    vtable_length = 4 + 2 * len(fields)
+    table_position = vtable_length + (-vtable_length % 8)
+    present = [(i, field) for i, field in enumerate(fields) if field is not None]
+    # bigger fields first for less padding
+    present.sort(
+        key=lambda item: -(4 if item[1][0] == "offset" else struct.calcsize(item[1][0]))
+    )
+    field_positions = {}
+    cursor = 4  # soffset to vtable
+    for i, (fmt, _) in present:
+        size = 4 if fmt == "offset" else struct.calcsize(fmt)
+        cursor += -cursor % size
+        field_positions[i] = cursor
+        cursor += size
+    table_size = cursor
+    table = bytearray(table_size + (-table_size % 8))
+    struct.pack_into("<i", table, 0, table_position)
+    children = []
+    child_position = table_position + len(table)
+    for i, (fmt, value) in present:
+        if fmt == "offset":
+            data, start = value
+            struct.pack_into(
+                "<I",
+                table,
+                field_positions[i],
+                child_position + start - (table_position + field_positions[i]),
+            )
+            children.append(data)
+            child_position += len(data)
+        else:
+            struct.pack_into(f"<{fmt}", table, field_positions[i], value)
+    vtable = struct.pack(
+        f"<2H{len(fields)}H",
+        vtable_length,
+        table_size,
+        *[field_positions.get(i, 0) for i in range(len(fields))],
+    )
+    return _pad(vtable) + bytes(table) + b"".join(children), table_position
+
+
+def fb_finish(table):
+    """Size prefixed flatbuffer with root table"""
+    data, start = table
+    buffer = struct.pack("<I4x", 8 + start) + data
+    return struct.pack("<I", len(buffer)) + buffer
+
+
+def hilbert(x, y):
+    """hilbert curve value of 16 bit x and y , same as flatgeobuf reference implementation"""
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+
+    return ((i1 << 1) | i0) & 0xFFFFFFFF
+
+
+def level_bounds(item_count, node_size):
+    """Gives start and end position of each level of packed r-tree from leaves to root"""
+    level_node_counts = [item_count]
+    count, node_count = item_count, item_count
+    while True:
+        count = (count + node_size - 1) // node_size
+        node_count += count
+        level_node_counts.append(count)
+        if count == 1:
+            break
+    bounds = []
+    position = node_count
+    for count in level_node_counts:
+        bounds.append((position - count, position))
+        position -= count
+    return node_count, bounds
+
+
+def geometry_table(geometry_type, coordinates, with_type=True):
+    """Encodes geometry to flatgeobuf geometry table"""
+    parts_table, ends, xy = None, None, []
+    if geometry_type == POINT:
+        xy = list(coordinates)
+    elif geometry_type in (LINESTRING, MULTIPOINT):
+        xy = [value for point in coordinates for value in point]
+    elif geometry_type in (POLYGON, MULTILINESTRING):
+        ends, end = [], 0
+        for part in coordinates:
+            xy.extend(value for point in part for value in point)
+            end += len(part)
+            ends.append(end)
+        if len(ends) == 1:
+            ends = None  # single part doesn't need ends
+    elif geometry_type == MULTIPOLYGON:
+        parts_table = fb_table_vector(
+            [geometry_table(POLYGON, polygon) for polygon in coordinates]
+        )
+    elif geometry_type == GEOMETRYCOLLECTION:
+        parts_table = fb_table_vector(
+            [geometry_table(part_type, part) for part_type, part in coordinates]
+        )
+    return fb_table(
+        [
+            ("offset", fb_vector("I", ends)) if ends else None,
+            ("offset", fb_vector("d", xy)) if xy else None,
+            None,
+            None,
+            None,
+            None,
+            ("B", geometry_type) if with_type else None,
+            ("offset", parts_table) if parts_table else None,
+        ]
+    )
+
+
+class FlatGeobufWriter:
+    """Writes FlatGeobuf with spatial index , Features are streamed to temporary file along with their bounding box and on close they are written after header and index in hilbert order
+
+    Args:
+        path: file path of fgb
+        schema: dict of column name and its type (int64 / str) in the order values are passed
+        name: layer name
+    """
+
+    def __init__(self, path, schema, name=None, index_node_size=INDEX_NODE_SIZE):
+        self.path = path
+        self.name = name if name else os.path.splitext(os.path.basename(path))[0]
+        self.columns = [
+            (column, COLUMN_TYPES.get(column_type, COLUMN_TYPE_STRING))
+            for column, column_type in schema.items()
+        ]
+        self.index_node_size = index_node_size
+        self.temp_path = f"{path}.features"
+        self.temp_file = open(self.temp_path, "wb")
+        self.bounds = array("d")  # min_x , min_y , max_x , max_y of each feature
+        self.offsets = array("Q")  # offset of feature in temp file
+        self.lengths = array("Q")
+        self.temp_size = 0
+        self.skipped_count = 0
+
+    @property
+    def feature_count(self):
+        """no of features written , features without geometry are not counted"""
+        return len(self.offsets)
+
+    def write(self, wkb, values):
+        """Writes one feature , values are in order of schema and None is left out from properties"""
+        if wkb is None:
+            self.skipped_count += 1  # feature without geometry can't be indexed
+            return
+        geometry_type, coordinates = parse_wkb(wkb)
+        bbox = bounding_box(flatten_points(geometry_type, coordinates))
+        if bbox is None:
+            self.skipped_count += 1
+            return
+        properties = []
+        for index, ((_, column_type), value) in enumerate(zip(self.columns, values)):
+            if value is None:
+                continue
+            if column_type == COLUMN_TYPE_LONG:
+                properties.append(struct.pack("<Hq", index, int(value)))
+            else:
+                encoded = str(value).encode("utf-8")
+                properties.append(struct.pack("<HI", index, len(encoded)) + encoded)
+        feature = fb_finish(
+            fb_table(
+                [
+                    ("offset", geometry_table(geometry_type, coordinates)),
+                    ("offset", fb_vector("B", b"".join(properties))),
+                ]
+            )
+        )
+        self.temp_file.write(feature)
+        self.bounds.extend(bbox)
+        self.offsets.append(self.temp_size)
+        self.lengths.append(len(feature))
+        self.temp_size += len(feature)
+
+    def close(self, f=None):
+        """Writes header , index and features in hilbert order to the final file , f is binary file object to write to instead of path , It is written sequentially so it doesn't need to be seekable"""
+        self.temp_file.close()
+        if f is None:
+            with open(self.path, "wb") as f:
+                self._write(f)
+        else:
+            self._write(f)
+        os.remove(self.temp_path)
+
+    def abort(self):
+        """Discards features written so far , final file is not written"""
+        self.temp_file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def _write(self, f):
+        order = self._hilbert_order()
+        extent = self._extent()
+        index_node_size = self.index_node_size if self.feature_count else 0
+        f.write(MAGIC_BYTES)
+        f.write(self._header(extent, index_node_size))
+        if index_node_size:
+            f.write(self._index(order))
+        with open(self.temp_path, "rb") as temp_file:
+            for i in order:
+                temp_file.seek(self.offsets[i])
+                f.write(temp_file.read(self.lengths[i]))
+
+    def _extent(self):
+        if not self.feature_count:
+            return None
+        return (
+            min(self.bounds[0::4]),
+            min(self.bounds[1::4]),
+            max(self.bounds[2::4]),
+            max(self.bounds[3::4]),
+        )
+
+    def _hilbert_order(self):
+        if not self.feature_count:
+            return []
+        min_x, min_y, max_x, max_y = self._extent()
+        width, height = max_x - min_x, max_y - min_y
+        bounds = self.bounds
+        values = array("I")
+        for i in range(self.feature_count):
+            x, y = 0, 0
+            if width:
+                x = floor(
+                    HILBERT_MAX
+                    * ((bounds[4 * i] + bounds[4 * i + 2]) / 2 - min_x)
+                    / width
+                )
+            if height:
+                y = floor(
+                    HILBERT_MAX
+                    * ((bounds[4 * i + 1] + bounds[4 * i + 3]) / 2 - min_y)
+                    / height
+                )
+            values.append(hilbert(x, y))
+        return sorted(range(self.feature_count), key=values.__getitem__, reverse=True)
+
+    def _index(self, order):
+        node_count, bounds = level_bounds(self.feature_count, self.index_node_size)
+        nodes = array("d", bytes(8 * 5 * node_count))
+        offsets = array("Q", bytes(8 * node_count))
+        # leaves are features in hilbert order with offset of feature in features section
+        leaf_start = bounds[0][0]
+        feature_offset = 0
+        for position, i in enumerate(order):
+            node = leaf_start + position
+            nodes[5 * node : 5 * node + 4] = self.bounds[4 * i : 4 * i + 4]
+            offsets[node] = feature_offset
+            feature_offset += self.lengths[i]
+        # parents keep the position of their first child as offset
+        for level in range(len(bounds) - 1):
+            position, end = bounds[level]
+            parent = bounds[level + 1][0]
+            while position < end:
+                offsets[parent] = position
+                last = min(position + self.index_node_size, end)
+                nodes[5 * parent] = min(nodes[5 * position : 5 * last : 5])
+                nodes[5 * parent + 1] = min(nodes[5 * position + 1 : 5 * last : 5])
+                nodes[5 * parent + 2] = max(nodes[5 * position + 2 : 5 * last : 5])
+                nodes[5 * parent + 3] = max(nodes[5 * position + 3 : 5 * last : 5])
+                position = last
+                parent += 1
+        index = bytearray(NODE_ITEM_SIZE * node_count)
+        for node in range(node_count):
+            struct.pack_into(
+                "<4dQ",
+                index,
+                NODE_ITEM_SIZE * node,
+                *nodes[5 * node : 5 * node + 4],
+                offsets[node],
+            )
+        return bytes(index)
+
+    def _header(self, extent, index_node_size):
+        columns = fb_table_vector(
+            [
+                fb_table([("offset", fb_string(name)), ("B", column_type)])
+                for name, column_type in self.columns
+            ]
+        )
+        crs = fb_table([("offset", fb_string("EPSG")), ("i", 4326)])
+        return fb_finish(
+            fb_table(
+                [
+                    ("offset", fb_string(self.name)),
+                    ("offset", fb_vector("d", extent)) if extent else None,
+                    ("B", GEOMETRY_TYPE_UNKNOWN),
+                    None,
+                    None,
+                    None,
+                    None,
+                    ("offset", columns),
+                    ("Q", self.feature_count),
+                    ("H", index_node_size),
+                    ("offset", crs),
+                ]
+            )
+        )
@@ -0,0 +1,204 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains GeoPackage writer built on sqlite3 for bulk loading , Rows are inserted in batches inside single transaction and r-tree spatial index is filled once at the end"""
+import os
+import sqlite3
+import struct
+from datetime import datetime, timezone
+
+from .wkb import bounding_box, flatten_points, parse_wkb
+
+GPKG_APPLICATION_ID = 0x47504B47  # GPKG
+GPKG_USER_VERSION = 10300  # 1.3.0
+BATCH_SIZE = 10000
+PAGE_SIZE = 65536
+SRS_ID = 4326
+
+COLUMN_TYPES = {"int64": "INTEGER", "str": "TEXT"}
+
+# little endian with envelope [minx, maxx, miny, maxy] , point needs no envelope
+GEOMETRY_HEADER = struct.Struct("<2sBBi4d")
+POINT_HEADER = struct.Struct("<2sBBi")
+EMPTY_FLAG = 0x10
+
+WGS84_DEFINITION = """GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]"""
+
+METADATA_TABLES = [
+    """CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)""",
+    """CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))""",
+    """CREATE TABLE gpkg_tile_matrix_set (table_name TEXT NOT NULL PRIMARY KEY, srs_id INTEGER NOT NULL, min_x DOUBLE NOT NULL, min_y DOUBLE NOT NULL, max_x DOUBLE NOT NULL, max_y DOUBLE NOT NULL, CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))""",
+    """CREATE TABLE gpkg_tile_matrix (table_name TEXT NOT NULL, zoom_level INTEGER NOT NULL, matrix_width INTEGER NOT NULL, matrix_height INTEGER NOT NULL, tile_width INTEGER NOT NULL, tile_height INTEGER NOT NULL, pixel_x_size DOUBLE NOT NULL, pixel_y_size DOUBLE NOT NULL, CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level), CONSTRAINT fk_tmm_table_name FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name))""",
+    """CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))""",
+]
+
+SPATIAL_REF_SYS = [
+    ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+    ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+    ("WGS 84 geodetic", SRS_ID, "EPSG", SRS_ID, WGS84_DEFINITION, None),
+]
+
+# triggers required by r-tree extension to keep index in sync after export is written
+RTREE_TRIGGERS = [
+    """CREATE TRIGGER "rtree_{t}_geom_insert" AFTER INSERT ON "{t}" WHEN (new.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN INSERT OR REPLACE INTO "rtree_{t}_geom" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END""",
+    """CREATE TRIGGER "rtree_{t}_geom_update1" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN INSERT OR REPLACE INTO "rtree_{t}_geom" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END""",
+    """CREATE TRIGGER "rtree_{t}_geom_update2" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "rtree_{t}_geom" WHERE id = OLD.fid; END""",
+    """CREATE TRIGGER "rtree_{t}_geom_update3" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "rtree_{t}_geom" WHERE id = OLD.fid; INSERT OR REPLACE INTO "rtree_{t}_geom" VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END""",
+    """CREATE TRIGGER "rtree_{t}_geom_update4" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) BEGIN DELETE FROM "rtree_{t}_geom" WHERE id IN (OLD.fid, NEW.fid); END""",
+    """CREATE TRIGGER "rtree_{t}_geom_delete" AFTER DELETE ON "{t}" WHEN old.geom NOT NULL BEGIN DELETE FROM "rtree_{t}_geom" WHERE id = OLD.fid; END""",
+]
+
+
+def gpkg_geometry(wkb, envelope=None):
+    """Converts wkb to geopackage geometry blob , envelope is (min_x , min_y , max_x , max_y) and is computed from wkb when not passed"""
+    if wkb is None:
+        return None, None
+    if envelope is None or None in envelope:
+        geometry_type, coordinates = parse_wkb(wkb)
+        envelope = bounding_box(flatten_points(geometry_type, coordinates))
+    if envelope is None:
+        return POINT_HEADER.pack(b"GP", 0, 0x01 | EMPTY_FLAG, SRS_ID) + wkb, None
+    min_x, min_y, max_x, max_y = envelope
+    if min_x == max_x and min_y == max_y:
+        return POINT_HEADER.pack(b"GP", 0, 0x01, SRS_ID) + wkb, envelope
+    header = GEOMETRY_HEADER.pack(b"GP", 0, 0x03, SRS_ID, min_x, max_x, min_y, max_y)
+    return header + wkb, envelope
+
+
+class GeoPackageWriter:
+    """Writes tables of features to new geopackage
+
+    Args:
+        path: file path of geopackage , existing file is replaced
+        batch_size: no of rows inserted at once
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        if os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.batch_size = batch_size
+        self.con = sqlite3.connect(path, isolation_level=None)
+        # bulk loading : page size has to be set before anything is created
+        self.con.execute(f"PRAGMA page_size = {PAGE_SIZE}")
+        self.con.execute("PRAGMA journal_mode = OFF")
+        self.con.execute("PRAGMA synchronous = OFF")
+        self.con.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self.con.execute("PRAGMA cache_size = -262144")  # 256 MB
+        self.con.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+        self.con.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+        self.con.execute("BEGIN")
+        for table in METADATA_TABLES:
+            self.con.execute(table)
+        self.con.executemany(
+            "INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+            SPATIAL_REF_SYS,
+        )
+        self.tables = {}
+
+    def create_table(self, name, geometry_type, schema):
+        """Creates feature table with geom column and columns of schema (int64 / str)"""
+        columns = "".join(
+            f""", "{column}" {COLUMN_TYPES.get(column_type, 'TEXT')}"""
+            for column, column_type in schema.items()
+        )
+        self.con.execute(
+            f"""CREATE TABLE "{name}" (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom {geometry_type}{columns})"""
+        )
+        # bounds are kept aside in temp table and moved to r-tree in one statement on close
+        self.con.execute(
+            f"""CREATE TEMP TABLE "{name}_bounds" (id INTEGER, minx DOUBLE, maxx DOUBLE, miny DOUBLE, maxy DOUBLE)"""
+        )
+        self.tables[name] = {
+            "geometry_type": geometry_type,
+            "insert": f"""INSERT INTO "{name}" VALUES (NULL, ?{', ?' * len(schema)})""",
+            "rows": [],
+            "bounds": [],  # fid , min_x , max_x , min_y , max_y
+            "name": name,
+            "fid": 0,
+            "extent": None,
+        }
+
+    def write(self, name, wkb, values, envelope=None):
+        """Adds feature to table , values are in order of schema"""
+        table = self.tables[name]
+        geometry, envelope = gpkg_geometry(wkb, envelope)
+        table["fid"] += 1
+        table["rows"].append((geometry, *values))
+        if envelope:
+            min_x, min_y, max_x, max_y = envelope
+            table["bounds"].append((table["fid"], min_x, max_x, min_y, max_y))
+            extent = table["extent"]
+            table["extent"] = (
+                envelope
+                if extent is None
+                else (
+                    min(extent[0], min_x),
+                    min(extent[1], min_y),
+                    max(extent[2], max_x),
+                    max(extent[3], max_y),
+                )
+            )
+        if len(table["rows"]) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        self.con.executemany(table["insert"], table["rows"])
+        self.con.executemany(
+            f"""INSERT INTO temp."{table['name']}_bounds" VALUES (?, ?, ?, ?, ?)""",
+            table["bounds"],
+        )
+        table["rows"], table["bounds"] = [], []
+
+    def abort(self):
+        """Discards geopackage , nothing is committed and file is removed"""
+        self.con.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        """Inserts pending rows , registers tables and builds r-tree index of each table at once"""
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        for name, table in self.tables.items():
+            self._flush(table)
+            extent = table["extent"] or (None, None, None, None)
+            self.con.execute(
+                "INSERT INTO gpkg_contents VALUES (?, 'features', ?, '', ?, ?, ?, ?, ?, ?)",
+                (name, name, now, *extent, SRS_ID),
+            )
+            self.con.execute(
+                "INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                (name, table["geometry_type"], SRS_ID),
+            )
+            self.con.execute(
+                f"""CREATE VIRTUAL TABLE "rtree_{name}_geom" USING rtree(id, minx, maxx, miny, maxy)"""
+            )
+            self.con.execute(
+                f"""INSERT INTO "rtree_{name}_geom" SELECT * FROM temp."{name}_bounds" """
+            )
+            self.con.execute(f"""DROP TABLE temp."{name}_bounds" """)
+            self.con.execute(
+                "INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+                (name,),
+            )
+            for trigger in RTREE_TRIGGERS:
+                self.con.execute(trigger.format(t=name))
+        self.con.execute("COMMIT")
+        self.con.execute("PRAGMA journal_mode = DELETE")
+        self.con.close()
@@ -0,0 +1,239 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains streaming ESRI Shapefile writer"""
+import struct
+from datetime import date
+
+from .wkb import (
+    LINESTRING,
+    MULTILINESTRING,
+    MULTIPOLYGON,
+    POINT,
+    POLYGON,
+    bounding_box,
+    parse_wkb,
+)
+
+SHAPE_NULL = 0
+SHAPE_POINT = 1
+SHAPE_POLYLINE = 3
+SHAPE_POLYGON = 5
+
+# offsets inside shapefile are signed 32 bit , both .shp and .dbf are split before reaching 2 GB
+MAX_FILE_SIZE = 2**31 - 1
+
+WGS84_PRJ = """GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]"""
+
+# schema type used by query builder to dbf field type , length and decimal , ogr reads N upto 18 digits as integer64
+DBF_FIELD_TYPES = {"int64": ("N", 18, 0), "str": ("C", 254, 0)}
+
+
+def dbf_field_names(columns):
+    """Dbf field names can have max 10 characters , truncates names and makes them unique same as ogr does"""
+    field_names = []
+    for column in columns:
+        name = "".join(c if c.isascii() else "_" for c in column)[:10]
+        suffix = 1
+        while name.lower() in [field.lower() for field in field_names]:
+            name = f"{name[:8]}_{suffix}"
+            suffix += 1
+        field_names.append(name)
+    return field_names
+
+
+class ShapefileWriter:
+    """Writes .shp , .shx , .dbf , .prj and .cpg directly from WKB geometry and attribute values , Once file gets bigger than max_file_size writer continues on new file with _1 , _2 .. suffix
+
+    Args:
+        path: file path without extension
+        shape_type: SHAPE_POINT , SHAPE_POLYLINE or SHAPE_POLYGON
+        schema: dict of column name and its type (int64 / str) in the order values are passed
+    """
+
+    def __init__(self, path, shape_type, schema, max_file_size=MAX_FILE_SIZE):
+        self.path = path
+        self.shape_type = shape_type
+        self.max_file_size = max_file_size
+        self.fields = [
+            (name, *DBF_FIELD_TYPES.get(column_type, DBF_FIELD_TYPES["str"]))
+            for name, column_type in zip(dbf_field_names(schema), schema.values())
+        ]
+        self.record_length = 1 + sum(field[2] for field in self.fields)
+        self.dbf_header_length = 32 + 32 * len(self.fields) + 1
+        self.part = 0
+        self.paths = []
+        self.total_count = 0
+        self._open()
+
+    def _open(self):
+        base_path = self.path if self.part == 0 else f"{self.path}_{self.part}"
+        self.paths.append(f"{base_path}.shp")
+        self.shp = open(f"{base_path}.shp", "wb")
+        self.shx = open(f"{base_path}.shx", "wb")
+        self.dbf = open(f"{base_path}.dbf", "wb")
+        with open(f"{base_path}.prj", "w", encoding="utf-8") as prj:
+            prj.write(WGS84_PRJ)
+        with open(f"{base_path}.cpg", "w", encoding="utf-8") as cpg:
+            cpg.write("UTF-8")
+        self.shp_size = 100
+        self.dbf_size = self.dbf_header_length
+        self.record_count = 0
+        self.bbox = None
+        # headers are written again with actual values while closing
+        self.shp.write(b"\0" * 100)
+        self.shx.write(b"\0" * 100)
+        self._write_dbf_header()
+
+    def write(self, wkb, values):
+        """Writes one feature , wkb can be None for features without geometry"""
+        content, bbox = self._shape_content(wkb)
+        record = self._dbf_record(values)
+        if self.record_count > 0 and (
+            self.shp_size + 8 + len(content) > self.max_file_size
+            or self.dbf_size + len(record) + 1 > self.max_file_size
+        ):
+            self._close_part()
+            self.part += 1
+            self._open()
+        self.record_count += 1
+        self.total_count += 1
+        self.shx.write(struct.pack(">2i", self.shp_size // 2, len(content) // 2))
+        self.shp.write(struct.pack(">2i", self.record_count, len(content) // 2))
+        self.shp.write(content)
+        self.shp_size += 8 + len(content)
+        self.dbf.write(record)
+        self.dbf_size += len(record)
+        if bbox:
+            self.bbox = (
+                bbox
+                if self.bbox is None
+                else (
+                    min(self.bbox[0], bbox[0]),
+                    min(self.bbox[1], bbox[1]),
+                    max(self.bbox[2], bbox[2]),
+                    max(self.bbox[3], bbox[3]),
+                )
+            )
+
+    def close(self):
+        """Finalizes headers of the current file"""
+        self._close_part()
+
+    def _shape_content(self, wkb):
+        null_shape = struct.pack("<i", SHAPE_NULL), None
+        if wkb is None:
+            return null_shape
+        geometry_type, coordinates = parse_wkb(wkb)
+        if self.shape_type == SHAPE_POINT:
+            if geometry_type != POINT:
+                return null_shape
+            x, y = coordinates
+            return struct.pack("<i2d", SHAPE_POINT, x, y), (x, y, x, y)
+
+        if self.shape_type == SHAPE_POLYLINE and geometry_type == LINESTRING:
+            parts = [coordinates]
+        elif self.shape_type == SHAPE_POLYLINE and geometry_type == MULTILINESTRING:
+            parts = coordinates
+        elif self.shape_type == SHAPE_POLYGON and geometry_type == POLYGON:
+            parts = coordinates
+        elif self.shape_type == SHAPE_POLYGON and geometry_type == MULTIPOLYGON:
+            parts = [ring for polygon in coordinates for ring in polygon]
+        else:
+            return null_shape
+        parts = [part for part in parts if part]
+        points = [point for part in parts for point in part]
+        if not points:
+            return null_shape
+        bbox = bounding_box(points)
+        part_index, start = [], 0
+        for part in parts:
+            part_index.append(start)
+            start += len(part)
+        content = b"".join(
+            [
+                struct.pack("<i4d2i", self.shape_type, *bbox, len(parts), len(points)),
+                struct.pack(f"<{len(parts)}i", *part_index),
+                struct.pack(
+                    f"<{len(points) * 2}d",
+                    *[value for point in points for value in point],
+                ),
+            ]
+        )
+        return content, bbox
+
+    def _dbf_record(self, values):
+        record = [b" "]  # record is not deleted
+        for (_, field_type, length, _), value in zip(self.fields, values):
+            if value is None:
+                record.append(b" " * length)
+            elif field_type == "N":
+                record.append(str(int(value)).rjust(length)[:length].encode("ascii"))
+            else:
+                encoded = str(value).encode("utf-8")
+                if len(encoded) > length:
+                    # cut without breaking multibyte character
+                    encoded = encoded[:length].decode("utf-8", "ignore").encode("utf-8")
+                record.append(encoded.ljust(length))
+        return b"".join(record)
+
+    def _write_dbf_header(self):
+        today = date.today()
+        header = [
+            struct.pack(
+                "<4BI2H20x",
+                3,
+                today.year - 1900,
+                today.month,
+                today.day,
+                self.record_count,
+                self.dbf_header_length,
+                self.record_length,
+            )
+        ]
+        for name, field_type, length, decimal in self.fields:
+            header.append(
+                struct.pack(
+                    "<11sc4x2B14x",
+                    name.encode("ascii"),
+                    field_type.encode("ascii"),
+                    length,
+                    decimal,
+                )
+            )
+        header.append(b"\r")
+        self.dbf.write(b"".join(header))
+
+    def _shp_header(self, file_length):
+        bbox = self.bbox if self.bbox else (0.0, 0.0, 0.0, 0.0)
+        return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length // 2) + struct.pack(
+            "<2i8d", 1000, self.shape_type, *bbox, 0.0, 0.0, 0.0, 0.0
+        )
+
+    def _close_part(self):
+        self.dbf.write(b"\x1a")  # end of file marker
+        self.dbf.seek(0)
+        self._write_dbf_header()
+        self.dbf.close()
+        self.shp.seek(0)
+        self.shp.write(self._shp_header(self.shp_size))
+        self.shp.close()
+        shx_size = 100 + 8 * self.record_count
+        self.shx.seek(0)
+        self.shx.write(self._shp_header(shx_size))
+        self.shx.close()
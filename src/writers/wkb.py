@@ -0,0 +1,122 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+"""Page contains WKB parser shared by the file writers"""
+import struct
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+GEOMETRYCOLLECTION = 7
+
+# EWKB flags , ST_AsBinary gives ISO WKB but EWKB is also accepted
+EWKB_Z = 0x80000000
+EWKB_M = 0x40000000
+EWKB_SRID = 0x20000000
+
+
+def parse_wkb(data):
+    """Parses 2d/3d/4d WKB to geometry type and coordinates , extra dimensions are dropped
+
+    Coordinates are nested like geojson , Point : (x, y) , LineString : [(x, y)] , Polygon : [[(x, y)]] and Multi geometries are list of them
+
+    Returns:
+        geometry type , coordinates
+    """
+    geometry_type, coordinates, _ = _parse(memoryview(data), 0)
+    return geometry_type, coordinates
+
+
+def _parse(buffer, offset):
+    byte_order = "<" if buffer[offset] == 1 else ">"
+    (type_code,) = struct.unpack_from(f"{byte_order}I", buffer, offset + 1)
+    offset += 5
+    dims = 2
+    if type_code & (EWKB_Z | EWKB_M | EWKB_SRID):
+        dims += bool(type_code & EWKB_Z) + bool(type_code & EWKB_M)
+        if type_code & EWKB_SRID:
+            offset += 4
+        type_code &= 0x0FFFFFFF
+    else:
+        # ISO WKB : 1000 z , 2000 m , 3000 zm
+        dims += (0, 1, 1, 2)[type_code // 1000]
+        type_code %= 1000
+
+    if type_code == POINT:
+        point = struct.unpack_from(f"{byte_order}{dims}d", buffer, offset)
+        return POINT, point[:2], offset + dims * 8
+    if type_code == LINESTRING:
+        points, offset = _parse_points(buffer, offset, byte_order, dims)
+        return LINESTRING, points, offset
+    if type_code == POLYGON:
+        (ring_count,) = struct.unpack_from(f"{byte_order}I", buffer, offset)
+        offset += 4
+        rings = []
+        for _ in range(ring_count):
+            ring, offset = _parse_points(buffer, offset, byte_order, dims)
+            rings.append(ring)
+        return POLYGON, rings, offset
+    if type_code in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION):
+        (part_count,) = struct.unpack_from(f"{byte_order}I", buffer, offset)
+        offset += 4
+        parts = []
+        for _ in range(part_count):
+            part_type, part, offset = _parse(buffer, offset)
+            # geometry collection keeps type of each part
+            parts.append((part_type, part) if type_code == GEOMETRYCOLLECTION else part)
+        return type_code, parts, offset
+    raise ValueError(f"Unsupported WKB geometry type : {type_code}")
+
+
+def _parse_points(buffer, offset, byte_order, dims):
+    (point_count,) = struct.unpack_from(f"{byte_order}I", buffer, offset)
+    offset += 4
+    values = struct.unpack_from(f"{byte_order}{point_count * dims}d", buffer, offset)
+    points = [(values[i], values[i + 1]) for i in range(0, point_count * dims, dims)]
+    return points, offset + point_count * dims * 8
+
+
+def flatten_points(geometry_type, coordinates):
+    """Gives all the points of geometry in a single list"""
+    if geometry_type == POINT:
+        return [coordinates]
+    if geometry_type in (LINESTRING, MULTIPOINT):
+        return coordinates
+    if geometry_type in (POLYGON, MULTILINESTRING):
+        return [point for part in coordinates for point in part]
+    if geometry_type == MULTIPOLYGON:
+        return [point for polygon in coordinates for ring in polygon for point in ring]
+    if geometry_type == GEOMETRYCOLLECTION:
+        return [
+            point
+            for part_type, part in coordinates
+            for point in flatten_points(part_type, part)
+        ]
+    return []
+
+
+def bounding_box(points):
+    """Gives minx , miny , maxx , maxy of points , None if there are no points"""
+    if not points:
+        return None
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
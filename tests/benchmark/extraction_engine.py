@@ -0,0 +1,63 @@
+"""Compares rows/sec of the cursor and COPY geojson extraction engines against the configured RAW_DATA database
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/extraction_engine.py --runs 3
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import raw_currentdata_extraction_query
+from src.validation.models import RawDataCurrentParams
+
+# same area as the locust geojson payload , kathmandu
+KATHMANDU = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [85.21270751953125, 27.646431146293423],
+            [85.49629211425781, 27.646431146293423],
+            [85.49629211425781, 27.762545086827302],
+            [85.21270751953125, 27.762545086827302],
+            [85.21270751953125, 27.646431146293423],
+        ]
+    ],
+}
+
+
+def run_engine(engine, query):
+    """Runs the query once with the engine and returns rows , seconds and file size"""
+    raw = RawData()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, f"{engine}.geojson")
+        start_time = time.time()
+        rows = RawData.query2geojson(raw.con, query, file_path, engine=engine)
+        took = time.time() - start_time
+        size = os.path.getsize(file_path)
+    RawData.close_con(raw.con)
+    return rows, took, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3, help="runs per engine")
+    args = parser.parse_args()
+
+    params = RawDataCurrentParams(geometry=KATHMANDU)
+    query = raw_currentdata_extraction_query(
+        params, g_id=None, c_id=None, geometry_dump=dumps(dict(params.geometry))
+    )
+    for engine in ["cursor", "copy"]:
+        for run in range(args.runs):
+            rows, took, size = run_engine(engine, query)
+            print(
+                f"{engine:<6} run {run + 1} : {rows} rows , {round(size / 1000000, 2)} MB in {round(took, 2)} sec -> {int(rows / took) if took else rows} rows/sec"
+            )
+
+
+if __name__ == "__main__":
+    main()
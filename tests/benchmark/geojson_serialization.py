@@ -0,0 +1,80 @@
+"""Compares size and throughput of geojson written with default precision and columns against reduced precision and compact columns on the configured RAW_DATA database
+
+Uses kathmandu payload of tests/load/locustfile.py , output is written to /dev/null
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/geojson_serialization.py --runs 3
+"""
+
+import argparse
+import os
+import time
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import raw_currentdata_extraction_query
+from src.validation.models import RawDataCurrentParams
+
+KATHMANDU = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [85.21270751953125, 27.646431146293423],
+            [85.49629211425781, 27.646431146293423],
+            [85.49629211425781, 27.762545086827302],
+            [85.21270751953125, 27.762545086827302],
+            [85.21270751953125, 27.646431146293423],
+        ]
+    ],
+}
+
+
+class CountingFile:
+    """file object which only counts bytes written to it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.f.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3, help="exports per option")
+    args = parser.parse_args()
+
+    raw = RawData()
+    baseline = None
+    for name, options in [
+        ("default", {}),
+        ("precision 7", {"precision": 7}),
+        ("compact", {"compact": True}),
+        ("precision 7 compact", {"precision": 7, "compact": True}),
+    ]:
+        query = raw_currentdata_extraction_query(
+            RawDataCurrentParams(geometry=KATHMANDU, **options),
+            None,
+            None,
+            dumps(KATHMANDU),
+        )
+        elapsed, size, rows = 0, 0, 0
+        for _ in range(args.runs):
+            with open(os.devnull, "wb") as f:
+                counting_file = CountingFile(f)
+                start_time = time.time()
+                rows = RawData.query2features(raw.con, query, counting_file)
+                elapsed += time.time() - start_time
+                size = counting_file.size
+        elapsed /= args.runs
+        baseline = baseline or size
+        print(
+            f"{name:<20}: {size / 1000000:.1f} MB ({size * 100 / baseline:.0f} %) , {rows} rows in {elapsed:.2f} sec , {rows / elapsed:.0f} rows / sec , {size / elapsed / 1000000:.1f} MB / sec"
+        )
+    RawData.close_con(raw.con)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compares grid and country lookup of get_grid_id from database with in memory geometry index against the configured RAW_DATA database
+
+Run from the project root (requires shapely) :
+    PYTHONPATH=. python tests/benchmark/geometry_index.py --runs 20
+"""
+
+import argparse
+import time
+
+import src.app
+from src.app import RawData
+from src.geometry_index import GeometryIndex
+from src.validation.models import RawDataCurrentParams
+
+# bigger than grid_index_threshold so that lookup happens , kathmandu valley and surroundings
+KATHMANDU_REGION = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [84.92431640625, 27.29127371475304],
+            [85.90759277343749, 27.29127371475304],
+            [85.90759277343749, 28.02592458049937],
+            [84.92431640625, 28.02592458049937],
+            [84.92431640625, 27.29127371475304],
+        ]
+    ],
+}
+
+
+def time_lookup(geometry, runs):
+    """Runs get_grid_id and returns result of last run with average milliseconds"""
+    raw = RawData()
+    took = 0
+    for _ in range(runs):
+        cur = raw.con.cursor()
+        start_time = time.time()
+        grid_id, _, _, country = RawData.get_grid_id(geometry, cur)
+        took += time.time() - start_time
+        cur.close()
+    RawData.close_con(raw.con)
+    return grid_id, country, took / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20, help="lookups per method")
+    args = parser.parse_args()
+
+    geometry = RawDataCurrentParams(geometry=KATHMANDU_REGION).geometry
+    src.app.geometry_index = None
+    grid_id, country, database_ms = time_lookup(geometry, args.runs)
+    print(f"database : grid {grid_id} country {country} in {database_ms:.2f} ms")
+
+    src.app.geometry_index = GeometryIndex()
+    time_lookup(geometry, 1)  # first lookup loads the index
+    index_grid_id, index_country, index_ms = time_lookup(geometry, args.runs)
+    print(
+        f"index    : grid {index_grid_id} country {index_country} in {index_ms:.3f} ms"
+    )
+    assert sorted(index_grid_id or []) == sorted(grid_id or [])
+    assert index_country == country
+    print(f"saved {database_ms - index_ms:.2f} ms per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measures scaling of partitioned geojson extraction with 1, 2, 4 and 8 processes against the configured RAW_DATA database
+
+Geometry must be bigger than grid_index_threshold so that it gets split by grid , default is ~8700 Sq.KM around kathmandu
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/partitioned_extraction.py --workers 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import time
+from json import dumps
+
+from src.app import RawData
+from src.validation.models import RawDataCurrentParams
+
+KATHMANDU_REGION = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [84.85, 27.3],
+            [85.85, 27.3],
+            [85.85, 28.1],
+            [84.85, 28.1],
+            [84.85, 27.3],
+        ]
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="process counts"
+    )
+    args = parser.parse_args()
+
+    params = RawDataCurrentParams(
+        geometry=KATHMANDU_REGION, geometryType=["point", "polygon"]
+    )
+    raw = RawData()
+    partition_queries = RawData.get_partition_queries(
+        params, raw.con, dumps(dict(params.geometry))
+    )
+    RawData.close_con(raw.con)
+    print(f"{len(partition_queries)} partitions")
+
+    base_time = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "partitioned.geojson")
+            start_time = time.time()
+            rows = RawData.query2geojson_partitioned(
+                partition_queries, file_path, workers=workers
+            )
+            took = time.time() - start_time
+        base_time = base_time if base_time else took
+        print(
+            f"{workers} processes : {rows} rows in {round(took, 2)} sec , speedup {round(base_time / took, 2)}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compares parse and plan time of inline extraction and lookup queries with parameterized and prepared ones against the configured RAW_DATA database
+
+Postgres reports planning time of the statement with EXPLAIN (SUMMARY) , round trip time includes parsing and sending the query
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/prepared_queries.py --runs 50
+"""
+
+import argparse
+import time
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import (
+    execute_prepared_query,
+    get_country_id_query,
+    prepare_query,
+    raw_currentdata_extraction_query,
+)
+from src.validation.models import RawDataCurrentParams
+
+PARAMS = {
+    "geometry": {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [83.96919250488281, 28.194446860487773],
+                [83.99751663208006, 28.194446860487773],
+                [83.99751663208006, 28.214869548073377],
+                [83.96919250488281, 28.214869548073377],
+                [83.96919250488281, 28.194446860487773],
+            ]
+        ],
+    },
+    "filters": {
+        "tags": {"all_geometry": {"building": ["yes", "house"], "amenity": []}},
+        "attributes": {"all_geometry": ["name", "addr:street"]},
+    },
+}
+
+
+def time_explain(cur, query, args, runs):
+    """Runs EXPLAIN of query and returns average planning and round trip milliseconds"""
+    planning, round_trip = 0, 0
+    for _ in range(runs):
+        start_time = time.time()
+        cur.execute(f"EXPLAIN (SUMMARY, FORMAT JSON) {query}", args)
+        plan = cur.fetchone()[0][0]
+        round_trip += time.time() - start_time
+        planning += plan["Planning Time"]
+    return planning / runs, round_trip / runs * 1000
+
+
+def report(name, query, args, cur, runs):
+    size = len(cur.mogrify(query, args)) if args else len(query)
+    planning_ms, round_trip_ms = time_explain(cur, query, args, runs)
+    print(
+        f"{name:<28}: {size:>6} bytes sent , planning {planning_ms:.3f} ms , round trip {round_trip_ms:.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=50, help="queries per method")
+    args = parser.parse_args()
+
+    geometry_dump = dumps(PARAMS["geometry"])
+    raw = RawData()
+    cur = raw.con.cursor()
+
+    inline_query = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**PARAMS), None, None, geometry_dump
+    )
+    report("inline extraction", inline_query, None, cur, args.runs)
+    bind_params = {}
+    parameterized_query = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**PARAMS),
+        None,
+        None,
+        geometry_dump,
+        bind_params=bind_params,
+    )
+    report("parameterized extraction", parameterized_query, bind_params, cur, args.runs)
+
+    report(
+        "inline country lookup",
+        get_country_id_query(geometry_dump),
+        None,
+        cur,
+        args.runs,
+    )
+    cur.execute(
+        prepare_query(
+            "benchmark_country_lookup",
+            get_country_id_query(None, prepared=True),
+            ["text"],
+        )
+    )
+    report(
+        "prepared country lookup",
+        execute_prepared_query("benchmark_country_lookup", 1),
+        (geometry_dump,),
+        cur,
+        args.runs,
+    )
+    cur.close()
+    RawData.close_con(raw.con)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compares time spent per row by geometry filter of rectangular requests with bounding box fast path and with exact intersection test on the configured RAW_DATA database loaded with pokhara fixture
+
+Same rectangle is passed with an extra vertex in middle of its first edge so that builder doesn't detect it as rectangle and uses ST_intersects , both queries give same rows
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/rectangle_filter.py --runs 10
+"""
+
+import argparse
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import raw_currentdata_extraction_query
+from src.validation.models import RawDataCurrentParams
+
+XMIN, YMIN, XMAX, YMAX = 83.9, 28.15, 84.05, 28.25
+
+RECTANGLE = {
+    "type": "Polygon",
+    "coordinates": [
+        [[XMIN, YMIN], [XMAX, YMIN], [XMAX, YMAX], [XMIN, YMAX], [XMIN, YMIN]]
+    ],
+}
+POLYGON = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [XMIN, YMIN],
+            [(XMIN + XMAX) / 2, YMIN],
+            [XMAX, YMIN],
+            [XMAX, YMAX],
+            [XMIN, YMAX],
+            [XMIN, YMIN],
+        ]
+    ],
+}
+
+
+def time_query(cur, query, runs):
+    """Runs EXPLAIN ANALYZE of query and returns average execution milliseconds and rows"""
+    execution = 0
+    for _ in range(runs):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+        plan = cur.fetchone()[0][0]
+        execution += plan["Execution Time"]
+    return execution / runs, plan["Plan"]["Actual Rows"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="queries per filter")
+    args = parser.parse_args()
+
+    raw = RawData()
+    cur = raw.con.cursor()
+    results = {}
+    for name, geometry in [("ST_intersects", POLYGON), ("bounding box", RECTANGLE)]:
+        for table in ["point", "line", "polygon"]:
+            query = raw_currentdata_extraction_query(
+                RawDataCurrentParams(geometry=geometry, geometry_type=[table]),
+                None,
+                None,
+                dumps(geometry),
+                ogr_export=True,
+            )
+            execution_ms, rows = time_query(cur, query, args.runs)
+            results[(name, table)] = execution_ms, rows
+            print(
+                f"{name:<14} {table:<8}: {execution_ms:.3f} ms , {rows} rows , {execution_ms * 1000 / max(rows, 1):.3f} us per row"
+            )
+    for table in ["point", "line", "polygon"]:
+        exact_ms, rows = results[("ST_intersects", table)]
+        bbox_ms, _ = results[("bounding box", table)]
+        print(
+            f"{table:<8} saved {(exact_ms - bbox_ms) * 1000 / max(rows, 1):.3f} us per row"
+        )
+    cur.close()
+    RawData.close_con(raw.con)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compares extraction of complex request geometry tested as a whole and split into pieces on the configured RAW_DATA database loaded with pokhara fixture
+
+Request geometry is an irregular polygon around Pokhara with --vertices vertices , like district boundaries are
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/subdivided_geometry.py --runs 5 --vertices 5000 --max-vertices 256
+"""
+
+import argparse
+import math
+import random
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import (
+    build_query_plan,
+    compile_query_plan,
+    create_with_clause,
+)
+from src.validation.models import RawDataCurrentParams
+
+
+def irregular_polygon(vertices, center=(83.985, 28.205), radius=0.03):
+    """polygon with jagged boundary around center"""
+    random.seed(vertices)
+    ring = []
+    for i in range(vertices - 1):
+        angle = 2 * math.pi * i / (vertices - 1)
+        distance = radius * random.uniform(0.6, 1)
+        ring.append(
+            [
+                round(center[0] + distance * math.cos(angle), 7),
+                round(center[1] + distance * math.sin(angle), 7),
+            ]
+        )
+    return {"type": "Polygon", "coordinates": [ring + ring[:1]]}
+
+
+def time_query(cur, query, runs):
+    """Runs EXPLAIN ANALYZE of query and returns average execution milliseconds and rows"""
+    execution = 0
+    for _ in range(runs):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+        plan = cur.fetchone()[0][0]
+        execution += plan["Execution Time"]
+    return execution / runs, plan["Plan"]["Actual Rows"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5, help="queries per method")
+    parser.add_argument("--vertices", type=int, default=5000)
+    parser.add_argument("--max-vertices", type=int, default=256)
+    args = parser.parse_args()
+
+    geometry = irregular_polygon(args.vertices)
+    geometry_dump = dumps(geometry)
+    plan = build_query_plan(
+        RawDataCurrentParams(geometry=geometry), None, None, geometry_dump
+    )
+    raw = RawData()
+    cur = raw.con.cursor()
+    for name, subdivide in [
+        ("whole geometry", 0),
+        (f"pieces of {args.max_vertices}", args.max_vertices),
+    ]:
+        table_plan = plan._replace(subdivide_vertices=subdivide)
+        table_queries, _ = compile_query_plan(table_plan, ogr_export=True)
+        query = f"{create_with_clause(table_plan)} {' UNION ALL '.join(table_queries)}"
+        execution_ms, rows = time_query(cur, query, args.runs)
+        print(f"{name:<18}: {execution_ms:.3f} ms , {rows} rows")
+    cur.close()
+    RawData.close_con(raw.con)
+
+
+if __name__ == "__main__":
+    main()
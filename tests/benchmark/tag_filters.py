@@ -0,0 +1,102 @@
+"""Compares plans and execution time of tag filters written with ->> against containment filters generated by builder on the configured RAW_DATA database loaded with pokhara fixture
+
+Create gin indexes on tags described in docs/src/installation/configurations.md before running it , both filters are run on same area and give same rows
+
+Run from the project root :
+    PYTHONPATH=. python tests/benchmark/tag_filters.py --runs 10 --tag amenity=hospital --tag amenity=school --tag shop
+"""
+
+import argparse
+from json import dumps
+
+from src.app import RawData
+from src.query_builder.builder import raw_currentdata_extraction_query
+from src.validation.models import RawDataCurrentParams
+
+GEOMETRY = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [83.96919250488281, 28.194446860487773],
+            [83.99751663208006, 28.194446860487773],
+            [83.99751663208006, 28.214869548073377],
+            [83.96919250488281, 28.214869548073377],
+            [83.96919250488281, 28.194446860487773],
+        ]
+    ],
+}
+
+
+def arrow_filter(key, values):
+    """tag filter as builder used to write it , gin index on tags can't serve it"""
+    if len(values) == 0:
+        return f"tags ? '{key}'"
+    if len(values) == 1:
+        return f"tags ->> '{key}' = '{values[0]}'"
+    values_join = " , ".join(f"'{value}'" for value in values)
+    return f"tags ->> '{key}' IN ({values_join})"
+
+
+def plan_nodes(plan):
+    """node types of plan with index used by them"""
+    nodes = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        name = node["Node Type"]
+        if node.get("Index Name"):
+            name += f" on {node['Index Name']}"
+        nodes.append(name)
+        stack.extend(reversed(node.get("Plans", [])))
+    return nodes
+
+
+def time_query(cur, query, runs):
+    """Runs EXPLAIN ANALYZE of query and returns average execution milliseconds , rows and plan node types of last run"""
+    execution = 0
+    for _ in range(runs):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+        plan = cur.fetchone()[0][0]
+        execution += plan["Execution Time"]
+    return execution / runs, plan["Plan"]["Actual Rows"], plan_nodes(plan["Plan"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="queries per filter")
+    parser.add_argument(
+        "--tag",
+        action="append",
+        help="key=value or key only , repeat to benchmark more filters",
+    )
+    args = parser.parse_args()
+
+    geometry_dump = dumps(GEOMETRY)
+    raw = RawData()
+    cur = raw.con.cursor()
+    for tag in args.tag or ["amenity=hospital"]:
+        key, _, value = tag.partition("=")
+        values = value.split(",") if value else []
+        params = RawDataCurrentParams(
+            geometry=GEOMETRY,
+            geometry_type=["point", "polygon"],
+            filters={"tags": {"all_geometry": {key: values}}},
+        )
+        containment_query = raw_currentdata_extraction_query(
+            params, None, None, geometry_dump
+        )
+        builder_filter = containment_query.split(" and (", 1)[1].split(")")[0]
+        arrow_query = containment_query.replace(
+            builder_filter, arrow_filter(key, values)
+        )
+        print(tag)
+        for name, query in [("->>", arrow_query), ("@>", containment_query)]:
+            execution_ms, rows, nodes = time_query(cur, query, args.runs)
+            print(f"  {name:<4}: {execution_ms:.3f} ms , {rows} rows")
+            print(f"        {' > '.join(nodes)}")
+    cur.close()
+    RawData.close_con(raw.con)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import json
 
-from locust import HttpUser, task
+from locust import HttpUser, events, task
+
+# task ids returned for identical campaign requests , fewer ids means fewer exports queued
+campaign_task_ids = set()
+campaign_requests = 0
 
 
 class Raw(HttpUser):
@@ -29,6 +33,31 @@ class Raw(HttpUser):
             "/raw-data/current-snapshot/", data=json.dumps(payload), headers=headers
         )
 
+    @task(1)
+    def raw_data_request_geojson_compact(self):
+        """same kathmandu payload with coordinates at centimetre precision and without version , changeset and timestamp , compare size and time with raw_data_request_geojson"""
+        payload = {
+            "fileName": "load_test_compact",
+            "precision": 7,
+            "compact": True,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [85.21270751953125, 27.646431146293423],
+                        [85.49629211425781, 27.646431146293423],
+                        [85.49629211425781, 27.762545086827302],
+                        [85.21270751953125, 27.762545086827302],
+                        [85.21270751953125, 27.646431146293423],
+                    ]
+                ],
+            },
+        }
+
+        headers = {"content-type": "application/json"}
+
+        self.client.post("/snapshot/", data=json.dumps(payload), headers=headers)
+
     @task(2)
     def raw_data_request_shapefile(self):
         """payload is of same area with shapefile option.Uses ogr2ogr , Produces 202MB of file and 25-30 Sec on single request"""
@@ -54,3 +83,47 @@ class Raw(HttpUser):
         self.client.post(
             "/raw-data/current-snapshot/", data=json.dumps(payload), headers=headers
         )
+
+
+class Campaign(HttpUser):
+    """Every user submits the same area and filters like a mapping campaign launch , run alone to see how many exports were queued ,
+    raise export_rate_limit since all users come from same ip :
+    locust -f tests/load/locustfile.py Campaign
+    """
+
+    @task
+    def snapshot_same_request(self):
+        global campaign_requests
+        payload = {
+            "fileName": "campaign",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [85.21270751953125, 27.646431146293423],
+                        [85.49629211425781, 27.646431146293423],
+                        [85.49629211425781, 27.762545086827302],
+                        [85.21270751953125, 27.762545086827302],
+                        [85.21270751953125, 27.646431146293423],
+                    ]
+                ],
+            },
+            "filters": {"tags": {"all_geometry": {"building": []}}},
+        }
+
+        headers = {"content-type": "application/json"}
+
+        response = self.client.post(
+            "/v1/snapshot/", data=json.dumps(payload), headers=headers
+        )
+        if response.status_code == 200:
+            campaign_requests += 1
+            campaign_task_ids.add(response.json()["task_id"])
+
+
+@events.test_stop.add_listener
+def report_campaign_exports(environment, **kwargs):
+    if campaign_requests:
+        print(
+            f"Campaign : {campaign_requests} requests queued {len(campaign_task_ids)} exports"
+        )
@@ -17,10 +17,39 @@
 # 1100 13th Street NW Suite 800 Washington, D.C. 20005
 # <info@hotosm.org>
 
+import json
+import math
+import os
+import sqlite3
+import struct
+import time
+import zipfile
+from io import BytesIO
 from json import dumps
 
-from src.query_builder.builder import raw_currentdata_extraction_query
+import pytest
+
+from src.app import (
+    GeojsonCopyStream,
+    RawData,
+    S3FileTransfer,
+    S3MultipartUploadStream,
+    StatusCache,
+    estimate_export,
+    extract_partition,
+    open_output,
+)
+from src.cache import FragmentCache
+from src.query_builder.builder import (
+    create_geometry_filter,
+    extract_geometry_type_query,
+    extraction_table_queries,
+    get_extraction_tables,
+    get_rectangle,
+    raw_currentdata_extraction_query,
+)
 from src.validation.models import RawDataCurrentParams
+from src.writers.flatgeobuf import MAGIC_BYTES
 
 
 def test_rawdata_current_snapshot_geometry_query():
@@ -50,22 +79,22 @@ def test_rawdata_current_snapshot_geometry_query():
                     from
                         nodes
                     where
-                        ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom) and (tags ->>  'amenity' IN ( 'shop'  ,  'toilet' ))) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
+                        geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (tags @> '{"amenity": "shop"}' OR tags @> '{"amenity": "toilet"}')) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 ways_line
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 ways_poly
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 relations
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t3"""
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t3"""
     query_result = raw_currentdata_extraction_query(
         validated_params,
         g_id=None,
@@ -97,22 +126,22 @@ def test_rawdata_current_snapshot_normal_query():
                     from
                         nodes
                     where
-                        ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
+                        geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326)) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 ways_line
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 ways_poly
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 relations
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[84.92431640625, 27.766190642387496], [85.31982421875, 27.766190642387496], [85.31982421875, 28.02592458049937], [84.92431640625, 28.02592458049937], [84.92431640625, 27.766190642387496]]], "type": "Polygon"}'), geom)) t3"""
+                geom && ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) and (geom @ ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326) or ST_intersects(ST_MakeEnvelope(84.92431640625, 27.766190642387496, 85.31982421875, 28.02592458049937, 4326), geom))) t3"""
     query_result = raw_currentdata_extraction_query(
         validated_params,
         g_id=None,
@@ -149,22 +178,22 @@ def test_attribute_filter_rawdata():
             from
                 ways_line
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[83.502574, 27.569073], [83.502574, 28.332758], [85.556417, 28.332758], [85.556417, 27.569073], [83.502574, 27.569073]]], "type": "Polygon"}'), geom) and (tags ->> 'building' = 'yes')) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
+                geom && ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) and (geom @ ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) or ST_intersects(ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326), geom)) and (tags @> '{"building": "yes"}')) t0 UNION ALL select ST_AsGeoJSON(t1.*) from (select
                 osm_id , tags ->> 'name' as name , geom
                 from
                     relations
                 where
-                    ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[83.502574, 27.569073], [83.502574, 28.332758], [85.556417, 28.332758], [85.556417, 27.569073], [83.502574, 27.569073]]], "type": "Polygon"}'), geom) and (tags ->> 'building' = 'yes') and (geometrytype(geom)='MULTILINESTRING')) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
+                    geom && ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) and (geom @ ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) or ST_intersects(ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326), geom)) and (tags @> '{"building": "yes"}') and (geometrytype(geom)='MULTILINESTRING')) t1 UNION ALL select ST_AsGeoJSON(t2.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 ways_poly
             where
-                (grid = 1187 OR grid = 1188) and (ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[83.502574, 27.569073], [83.502574, 28.332758], [85.556417, 28.332758], [85.556417, 27.569073], [83.502574, 27.569073]]], "type": "Polygon"}'), geom)) and (tags ->> 'building' = 'yes')) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
+                (grid = 1187 OR grid = 1188) and (geom && ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) and (geom @ ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) or ST_intersects(ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326), geom))) and (tags @> '{"building": "yes"}')) t2 UNION ALL select ST_AsGeoJSON(t3.*) from (select
             osm_id ,version,tags,changeset,timestamp,geom
             from
                 relations
             where
-                ST_intersects(ST_GEOMFROMGEOJSON('{"coordinates": [[[83.502574, 27.569073], [83.502574, 28.332758], [85.556417, 28.332758], [85.556417, 27.569073], [83.502574, 27.569073]]], "type": "Polygon"}'), geom) and (tags ->> 'building' = 'yes') and (geometrytype(geom)='POLYGON' or geometrytype(geom)='MULTIPOLYGON')) t3"""
+                geom && ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) and (geom @ ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326) or ST_intersects(ST_MakeEnvelope(83.502574, 27.569073, 85.556417, 28.332758, 4326), geom)) and (tags @> '{"building": "yes"}') and (geometrytype(geom)='POLYGON' or geometrytype(geom)='MULTIPOLYGON')) t3"""
     query_result = raw_currentdata_extraction_query(
         validated_params,
         g_id=[[1187], [1188]],
@@ -172,3 +201,801 @@ def test_attribute_filter_rawdata():
         geometry_dump=dumps(dict(validated_params.geometry)),
     )
     assert query_result.encode("utf-8") == expected_query.encode("utf-8")
+
+
+def test_geojson_copy_stream_joins_rows():
+    output = BytesIO()
+    copy_stream = GeojsonCopyStream(output)
+    # COPY may split rows at any point between chunks
+    for chunk in [b'{"a": 1}\n{"b"', b': "x\\\\n"}\n', b'{"c": 3}\n']:
+        copy_stream.write(chunk)
+    assert output.getvalue() == b'{"a": 1},{"b": "x\\\\n"},{"c": 3}'
+    assert copy_stream.row_count == 3
+
+
+def test_open_output_streams_into_zip():
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        with open_output("exports/Export_uid/Export.geojson", zf) as f:
+            copy_stream = GeojsonCopyStream(f)
+            copy_stream.write(b'{"a": 1}\n{"b": 2}\n')
+        assert [(info.filename, info.file_size) for info in zf.infolist()] == [
+            ("Export.geojson", 17)
+        ]
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.read("Export.geojson") == b'{"a": 1},{"b": 2}'
+
+
+class FakeS3:
+    """Keeps multipart uploads in memory like s3 does"""
+
+    def __init__(self, fail_part=None):
+        self.uploads, self.objects, self.etags, self.aborted = {}, {}, {}, []
+        self.fail_part = fail_part
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.uploads[Key] = {}
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise ConnectionError("part failed")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+        self.etags[Key] = f"etag-{len(parts)}"
+        return {"ETag": self.etags[Key]}
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key]), "ETag": self.etags[Key]}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+
+class FakeConnection:
+    """Answers every query with one point feature , rows follows columns of wkb query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, con):
+        self.con = con
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def execute(self, query):
+        self.con.queries.append(query)
+        self.query = query
+
+    def __iter__(self):
+        point = struct.pack("<BI2d", 1, 1, 85.0, 27.9)
+        envelope = [] if "ST_XMin" not in self.query else [85.0, 27.9, 85.0, 27.9]
+        columns = self.query.split(" , ", 1)[1].rsplit(" from (", 1)[0].split(" , ")
+        columns = [column for column in columns if not column.startswith("ST_")]
+        values = [
+            None if column.startswith("null") else "1" if "::text" in column else 1
+            for column in columns
+        ]
+        yield [point] + envelope + values
+
+    def close(self):
+        pass
+
+
+def test_s3_multipart_upload_stream_zip():
+    s_3 = FakeS3()
+    upload_stream = S3MultipartUploadStream(s_3, "bucket", "Export.zip", part_size=64)
+    with zipfile.ZipFile(upload_stream, "w", zipfile.ZIP_DEFLATED) as zf:
+        with open_output("Export.geojson", zf) as f:
+            f.write(b'{"type": "FeatureCollection","features": []}')
+    upload_stream.close()
+    assert upload_stream.part_number == len(upload_stream.part_stats) > 1
+    file_transfer_obj = S3FileTransfer.__new__(S3FileTransfer)
+    file_transfer_obj.s_3 = s_3
+    file_transfer_obj.verify_upload(
+        "Export.zip", upload_stream.size, upload_stream.etag
+    )
+    with pytest.raises(ValueError):
+        file_transfer_obj.verify_upload("Export.zip", upload_stream.size + 1)
+    assert len(s_3.objects["Export.zip"]) == upload_stream.size
+    with zipfile.ZipFile(BytesIO(s_3.objects["Export.zip"])) as zf:
+        assert zf.read("Export.geojson").startswith(b'{"type"')
+
+    s_3 = FakeS3(fail_part=2)
+    upload_stream = S3MultipartUploadStream(s_3, "bucket", "Export.zip", part_size=4)
+    upload_stream.write(b"0123456789")
+    with pytest.raises(ConnectionError):
+        upload_stream.close()
+    assert s_3.aborted == ["Export.zip"] and not s_3.objects
+
+
+def test_rawdata_current_snapshot_query_as_list():
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "geometryType": ["point", "polygon"],
+    }
+    query_result = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=None,
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+    )
+    query_list = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=None,
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+        as_list=True,
+    )
+    assert len(query_list) == 3
+    assert " UNION ALL ".join(query_list) == query_result
+
+
+def test_rawdata_current_snapshot_parameterized_query():
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "geometryType": ["point", "polygon"],
+        "filters": {
+            "tags": {"point": {"amenity": ["shop", "toilets"], "name": []}},
+            "attributes": {"point": ["name%"]},
+        },
+    }
+    geometry_dump = dumps(test_param["geometry"])
+    bind_params = {}
+    query_result = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=None,
+        c_id=None,
+        geometry_dump=geometry_dump,
+        bind_params=bind_params,
+    )
+    assert bind_params == {
+        "geometry": geometry_dump,
+        "p1": ['{"amenity": "shop"}', '{"amenity": "toilets"}'],
+        "p2": "name",
+    }
+    # geometry is sent once for all tables
+    assert query_result.count("%(geometry)s") == 1
+    assert geometry_dump not in query_result
+    assert query_result.startswith(
+        "with request_geometry as (select ST_GEOMFROMGEOJSON(%(geometry)s) as geom)"
+    )
+    assert "tags @> ANY(%(p1)s::jsonb[]) OR tags ? %(p2)s" in query_result
+    assert "tags ->> 'name%%' as name%%" in query_result
+    # values of same shape give same statement
+    other_param = dict(test_param)
+    other_param["filters"] = {
+        "tags": {"point": {"amenity": ["bank"], "name": []}},
+        "attributes": {"point": ["name%"]},
+    }
+    assert (
+        raw_currentdata_extraction_query(
+            RawDataCurrentParams(**other_param),
+            g_id=None,
+            c_id=None,
+            geometry_dump=geometry_dump,
+            bind_params={},
+        )
+        == query_result
+    )
+
+
+def test_rawdata_current_snapshot_since_query():
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "geometryType": ["point", "polygon"],
+        "since": "2022-06-27 19:59:24+05:45",
+    }
+    query_list = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=[[1187], [1188]],
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+        as_list=True,
+    )
+    assert len(query_list) == 3
+    for query in query_list:
+        # compared in utc
+        assert "and (timestamp > '2022-06-27 14:14:24')" in query
+
+
+def test_rawdata_current_snapshot_csv_query():
+    test_param = {
+        "outputType": "csv",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "geometryType": ["point"],
+    }
+    query_result = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=None,
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+        ogr_export=True,
+    )
+    select_condition = query_result.split("\n")[1].strip()
+    assert (
+        select_condition
+        == "osm_id ,version,tags,changeset,timestamp, ST_X(ST_Centroid(geom)) as longitude , ST_Y(ST_Centroid(geom)) as latitude , GeometryType(geom) as geom_type"
+    )
+
+
+def test_rawdata_current_snapshot_query_keeps_params():
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "outputType": "csv",
+        "filters": {
+            "tags": {
+                "line": {"highway": ["primary"]},
+                "polygon": {"highway": ["primary"]},
+            },
+            "attributes": {
+                "point": ["name", "amenity"],
+                "line": ["name"],
+                "polygon": ["amenity"],
+            },
+        },
+    }
+    params = RawDataCurrentParams(**test_param)
+    before = params.dict()
+    bind_params = {}
+    queries = [
+        raw_currentdata_extraction_query(
+            params,
+            g_id=None,
+            c_id=None,
+            geometry_dump=dumps(test_param["geometry"]),
+            bind_params=bind_params,
+        )
+        for _ in range(2)
+    ]
+    assert queries[0] == queries[1]
+    assert params.dict() == before
+    # line and polygon share tags and merged columns so relations are scanned once
+    assert queries[0].count("relations") == 1
+    assert "geometrytype(geom)" not in queries[0]
+    assert bind_params == {
+        "geometry": dumps(test_param["geometry"]),
+        "p1": ['{"highway": "primary"}'],
+    }
+    assert "osm_id , tags ->> 'amenity' as amenity , tags ->> 'name' as name" in (
+        queries[0]
+    )
+
+
+def test_rectangle_geometry_filter():
+    rectangle = [[[84.9, 27.7], [84.9, 28.0], [85.3, 28.0], [85.3, 27.7], [84.9, 27.7]]]
+    assert get_rectangle(dumps({"type": "Polygon", "coordinates": rectangle})) == (
+        84.9,
+        27.7,
+        85.3,
+        28.0,
+    )
+    assert get_rectangle(
+        dumps({"type": "MultiPolygon", "coordinates": [rectangle]})
+    ) == (84.9, 27.7, 85.3, 28.0)
+    triangle = [[[84.9, 27.7], [85.3, 28.0], [85.3, 27.7], [84.9, 27.7]]]
+    skewed = [[[84.9, 27.7], [85.0, 28.0], [85.3, 28.0], [85.3, 27.7], [84.9, 27.7]]]
+    for coordinates in [triangle, skewed, rectangle + rectangle]:
+        geometry_dump = dumps({"type": "Polygon", "coordinates": coordinates})
+        assert get_rectangle(geometry_dump) is None
+        assert (
+            create_geometry_filter(geometry_dump, "nodes")
+            == f"ST_intersects(ST_GEOMFROMGEOJSON('{geometry_dump}'), geom)"
+        )
+    geometry_dump = dumps({"type": "Polygon", "coordinates": rectangle})
+    envelope = "ST_MakeEnvelope(84.9, 27.7, 85.3, 28.0, 4326)"
+    assert create_geometry_filter(geometry_dump, "nodes") == f"geom && {envelope}"
+    assert (
+        create_geometry_filter(geometry_dump, "ways_line")
+        == f"geom && {envelope} and (geom @ {envelope} or ST_intersects({envelope}, geom))"
+    )
+
+
+def test_rawdata_current_snapshot_subdivided_query(monkeypatch):
+    # circle like polygon which is too complex to be tested as a whole
+    ring = [
+        [
+            round(83.98 + 0.02 * math.cos(math.radians(angle)), 6),
+            round(28.2 + 0.02 * math.sin(math.radians(angle)), 6),
+        ]
+        for angle in range(0, 360, 2)
+    ]
+    geometry = {"type": "Polygon", "coordinates": [ring + ring[:1]]}
+    params = RawDataCurrentParams(geometry=geometry, geometry_type=["point"])
+    monkeypatch.setattr("src.query_builder.builder.subdivide_vertices", 0)
+    assert "request_pieces" not in raw_currentdata_extraction_query(
+        params, g_id=None, c_id=None, geometry_dump=dumps(geometry)
+    )
+
+    monkeypatch.setattr("src.query_builder.builder.subdivide_vertices", 64)
+    query_result = raw_currentdata_extraction_query(
+        params, g_id=None, c_id=None, geometry_dump=dumps(geometry)
+    )
+    assert query_result.startswith(
+        f"with request_geometry as (select ST_GEOMFROMGEOJSON('{dumps(geometry)}') as geom) , request_pieces as (select ST_Subdivide(geom, 64) as geom from request_geometry) select"
+    )
+    assert (
+        "geom && (select geom from request_geometry) and exists (select 1 from request_pieces where ST_intersects(request_pieces.geom, nodes.geom))"
+        in query_result
+    )
+    bind_params = {}
+    parameterized_query = raw_currentdata_extraction_query(
+        params,
+        g_id=None,
+        c_id=None,
+        geometry_dump=dumps(geometry),
+        bind_params=bind_params,
+    )
+    assert parameterized_query.count("%(geometry)s") == 1
+    assert "request_pieces as" in parameterized_query
+    assert bind_params == {"geometry": dumps(geometry)}
+
+
+def test_rawdata_current_snapshot_grid_filter_on_all_tables(monkeypatch):
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [83.502574, 27.569073],
+                    [83.502574, 28.332758],
+                    [85.556417, 28.332758],
+                    [85.556417, 27.569073],
+                    [83.502574, 27.569073],
+                ]
+            ],
+        },
+        "geometryType": ["point", "line", "polygon"],
+        "filters": {"attributes": {"line": ["name"]}},
+    }
+    params = RawDataCurrentParams(**test_param)
+    monkeypatch.setattr(
+        "src.query_builder.builder.grid_index_tables",
+        ["nodes", "ways_line", "ways_poly", "relations"],
+    )
+    query_list = raw_currentdata_extraction_query(
+        params,
+        g_id=[[1187], [1188]],
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+        as_list=True,
+    )
+    tables = get_extraction_tables(params)
+    assert tables == ["nodes", "ways_line", "relations", "ways_poly", "relations"]
+    for table, query in zip(tables, query_list):
+        if table in ["nodes", "ways_poly"]:
+            assert "(grid = 1187 OR grid = 1188) and (" in query
+        else:
+            # lines and relations keep every grid cell they intersect
+            assert "(grid && ARRAY[1187 , 1188]) and (" in query
+
+
+def test_estimate_export_from_table_estimates():
+    table_estimates = [
+        ("nodes", 12000, 150),
+        ("ways_poly", 30000, 400),
+        ("relations", 50, 2000),
+        ("relations", 10, 2000),
+    ]
+    geojson = estimate_export(table_estimates, "geojson")
+    assert geojson["rows"] == 42060
+    assert geojson["tables"] == {"nodes": 12000, "ways_poly": 30000, "relations": 60}
+    assert geojson["bytes"] == int((12000 * 150 + 30000 * 400 + 60 * 2000) * 2.5)
+    # csv is smaller and faster than geojson of same rows , empty area costs nothing
+    csv = estimate_export(table_estimates, "csv")
+    assert csv["bytes"] < geojson["bytes"] and csv["seconds"] < geojson["seconds"]
+    assert estimate_export([("nodes", 0, 150)], "geojson")["seconds"] == 0
+
+
+def test_rawdata_current_snapshot_precision_and_compact_query():
+    test_param = {
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [84.92431640625, 27.766190642387496],
+                    [85.31982421875, 27.766190642387496],
+                    [85.31982421875, 28.02592458049937],
+                    [84.92431640625, 28.02592458049937],
+                    [84.92431640625, 27.766190642387496],
+                ]
+            ],
+        },
+        "geometryType": ["point", "line"],
+        "precision": 7,
+        "compact": True,
+        "filters": {"attributes": {"line": ["name"]}},
+    }
+    query_list = raw_currentdata_extraction_query(
+        RawDataCurrentParams(**test_param),
+        g_id=None,
+        c_id=None,
+        geometry_dump=dumps(test_param["geometry"]),
+        as_list=True,
+    )
+    assert query_list[0].startswith("select ST_AsGeoJSON(t0.*, 'geom', 7) from")
+    assert query_list[0].split("\n")[1].strip() == "osm_id ,tags,geom"
+    # attribute filter keeps its own columns
+    assert (
+        query_list[1].split("\n")[1].strip()
+        == "osm_id , tags ->> 'name' as name , geom"
+    )
+    with pytest.raises(ValueError, match="geojson output only"):
+        RawDataCurrentParams(**dict(test_param, outputType="shp"))
+
+
+def test_status_cache_refreshes_in_background():
+    class CountingStatusCache(StatusCache):
+        def refresh(self):
+            self.last_updated = f"refresh {self.refreshes}"
+            self.refreshes += 1
+            self.refreshed_at = time.time()
+
+    status_cache = CountingStatusCache(interval=0.01)
+    status_cache.refreshes = 0
+    status_cache.start()
+    time.sleep(0.1)
+    status_cache.stop()
+    assert status_cache.refreshes > 1
+    assert status_cache.last_updated.startswith("refresh")
+    assert status_cache.age < 1
+
+
+def test_partitioned_geojson_from_fragment_cache(tmp_path):
+    fragment_cache = FragmentCache(directory=str(tmp_path / "fragments"))
+    rows = {
+        "cell1_nodes": [(1, 0, {"id": 1}), (2, 1, {"id": 2})],
+        "cell1_poly": [(7, 1, {"id": 7})],
+        # node 2 and polygon 7 crosses both cells
+        "cell2_nodes": [(2, 1, {"id": 2}), (3, 0, {"id": 3})],
+        "cell2_poly": [(7, 1, {"id": 7})],
+    }
+    for key, features in rows.items():
+        with open(fragment_cache.path(key), "w") as f:
+            for osm_id, crossing, feature in features:
+                f.write(f"{osm_id}\t{crossing}\t{json.dumps(feature)}\n")
+    partitions = [
+        (["nodes query", "poly query"], ["cell1_nodes", "cell1_poly"]),
+        (["nodes query", "poly query"], ["cell2_nodes", "cell2_poly"]),
+    ]
+    file_path = tmp_path / "Export.geojson"
+    # every table is in cache so database is never touched
+    row_count = RawData.query2geojson_partitioned(
+        partitions, str(file_path), workers=1, fragment_cache=fragment_cache
+    )
+    assert row_count == 4
+    with open(file_path) as f:
+        features = json.load(f)["features"]
+    assert sorted(feature["id"] for feature in features) == [1, 2, 3, 7]
+    assert fragment_cache.stats() == {"hits": 4, "misses": 0}
+
+
+ALL_GEOMETRY_PARAMS = {
+    "geometry": {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [84.92431640625, 27.766190642387496],
+                [85.31982421875, 27.766190642387496],
+                [85.31982421875, 28.02592458049937],
+                [84.92431640625, 28.02592458049937],
+                [84.92431640625, 27.766190642387496],
+            ]
+        ],
+    },
+    "geometryType": ["all_geometry"],
+}
+
+
+def test_flatgeobuf_export_of_all_geometry(tmp_path):
+    params = RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="fgb"))
+    (
+        query_point,
+        query_line,
+        query_poly,
+        point_schema,
+        line_schema,
+        poly_schema,
+    ) = extract_geometry_type_query(params, ogr_export=True)
+    assert "from\n                        nodes" in query_point
+    assert "ways_line" in query_line and "'MULTILINESTRING'" in query_line
+    assert "ways_poly" in query_poly and "'MULTIPOLYGON'" in query_poly
+    for query, schema in [
+        (query_point, point_schema),
+        (query_line, line_schema),
+        (query_poly, poly_schema),
+    ]:
+        assert "osm_id ,version,tags,changeset,timestamp,geom" in query
+        assert list(schema) == ["osm_id", "version", "tags", "changeset", "timestamp"]
+    file_path = str(tmp_path / "Export.fgb")
+    con = FakeConnection()
+    count = RawData.query2flatgeobuf(
+        con,
+        [
+            (query_point, point_schema),
+            (query_line, line_schema),
+            (query_poly, poly_schema),
+        ],
+        file_path,
+    )
+    assert count == 3 and len(con.queries) == 3
+    with open(file_path, "rb") as fgb:
+        assert fgb.read(8) == MAGIC_BYTES
+        header_size = struct.unpack("<I", fgb.read(4))[0]
+        assert b"version" in fgb.read(header_size)
+
+
+def test_geopackage_and_shapefile_export_of_all_geometry(tmp_path, monkeypatch):
+    monkeypatch.setattr(RawData, "get_connection", lambda dbdict=None: FakeConnection())
+    geometry_dump = dumps(ALL_GEOMETRY_PARAMS["geometry"])
+    file_path = str(tmp_path / "Export.gpkg")
+    params = RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="gpkg"))
+    RawData(params).write_output(None, None, geometry_dump, str(tmp_path), file_path)
+    gpkg = sqlite3.connect(file_path)
+    for table in ["Export_point", "Export_line", "Export_poly"]:
+        assert gpkg.execute(f'SELECT osm_id, version FROM "{table}"').fetchall() == [
+            (1, 1)
+        ]
+    gpkg.close()
+
+    params = RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="shp"))
+    RawData(params).write_output(None, None, geometry_dump, str(tmp_path), None)
+    for suffix in ["point", "line", "poly"]:
+        assert os.path.exists(tmp_path / f"Export_{suffix}.shp")
+        with open(tmp_path / f"Export_{suffix}.dbf", "rb") as dbf:
+            assert b"VERSION" in dbf.read(256).upper()
+
+
+def test_shapefile_queries_of_subdivided_geometry(monkeypatch):
+    ring = [
+        [
+            round(83.98 + 0.02 * math.cos(math.radians(angle)), 6),
+            round(28.2 + 0.02 * math.sin(math.radians(angle)), 6),
+        ]
+        for angle in range(0, 360, 2)
+    ]
+    geometry = {"type": "Polygon", "coordinates": [ring + ring[:1]]}
+    params = RawDataCurrentParams(
+        geometry=geometry, geometry_type=["point", "polygon"], output_type="shp"
+    )
+    monkeypatch.setattr("src.query_builder.builder.subdivide_vertices", 64)
+    query_point, query_line, query_poly, *_ = extract_geometry_type_query(
+        params, ogr_export=True
+    )
+    assert query_line is None
+    for query, tables in [
+        (query_point, ["nodes"]),
+        (query_poly, ["ways_poly", "relations"]),
+    ]:
+        assert query.startswith("with request_geometry as (select ST_GEOMFROMGEOJSON(")
+        assert query.count("request_pieces as (select ST_Subdivide(geom, 64)") == 1
+        for table in tables:
+            assert (
+                f"exists (select 1 from request_pieces where ST_intersects(request_pieces.geom, {table}.geom))"
+                in query
+            )
+
+
+def test_failed_partition_removes_temporary_file(tmp_path, monkeypatch):
+    class FailingCursor(FakeCursor):
+        def __iter__(self):
+            yield 1, False, '{"id": 1}'
+            raise ConnectionError("connection lost")
+
+    class FailingConnection(FakeConnection):
+        def cursor(self, name=None, cursor_factory=None):
+            return FailingCursor(self)
+
+        def close(self):
+            pass
+
+    class FakeDatabase:
+        def __init__(self, db_params):
+            pass
+
+        def connect(self):
+            con = FailingConnection()
+            return con, con.cursor()
+
+    monkeypatch.setattr("src.app.Database", FakeDatabase)
+    monkeypatch.setattr("src.app.get_db_connection_params", lambda name: {})
+    path = str(tmp_path / "fragment")
+    with pytest.raises(ConnectionError):
+        extract_partition([("nodes query", path)])
+    assert os.listdir(tmp_path) == []
+
+
+def test_estimate_explains_queries_of_output_type(monkeypatch):
+    geometry_dump = dumps(ALL_GEOMETRY_PARAMS["geometry"])
+
+    def table_queries(output_type, bind_params):
+        params = RawDataCurrentParams(
+            **dict(ALL_GEOMETRY_PARAMS, outputType=output_type)
+        )
+        return extraction_table_queries(
+            params, None, None, geometry_dump, bind_params=bind_params
+        )
+
+    bind_params = {}
+    geojson = table_queries("geojson", bind_params)
+    assert [table for table, _ in geojson] == [
+        "nodes",
+        "ways_line",
+        "ways_poly",
+        "relations",
+    ]
+    assert all("ST_AsGeoJSON(t" in query for _, query in geojson)
+    assert bind_params == {"geometry": geometry_dump}
+    csv = table_queries("csv", {})
+    assert all("as longitude" in query for _, query in csv)
+    # layers of shapefile keeps line and polygon relations apart and they are not parameterized
+    bind_params = {}
+    shp = table_queries("shp", bind_params)
+    assert [table for table, _ in shp] == [
+        "nodes",
+        "ways_line",
+        "relations",
+        "ways_poly",
+        "relations",
+    ]
+    assert bind_params == {}
+    assert all("ST_AsGeoJSON" not in query and "version" in query for _, query in shp)
+
+    class ExplainCursor(FakeCursor):
+        def execute(self, query, params=None):
+            self.con.queries.append(query)
+
+        def fetchone(self):
+            return [[{"Plan": {"Plan Rows": 10, "Plan Width": 100}}]]
+
+    class ExplainConnection(FakeConnection):
+        def cursor(self, name=None, cursor_factory=None):
+            return ExplainCursor(self)
+
+    def no_lookup(*args):
+        raise AssertionError("geometry is already looked up")
+
+    monkeypatch.setattr(
+        RawData, "get_connection", lambda dbdict=None: ExplainConnection()
+    )
+    monkeypatch.setattr(RawData, "get_grid_id", no_lookup)
+    raw_data = RawData(
+        RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="shp"))
+    )
+    estimate = raw_data.estimate_current_data(([(1187,)], geometry_dump, 10.0, None))
+    assert estimate["rows"] == 50
+    assert all(
+        query.startswith("EXPLAIN (FORMAT JSON) select")
+        for query in raw_data.con.queries
+    )
+    # grid of lookup is used instead of looking up geometry again
+    assert any("1187" in query for query in raw_data.con.queries)
+
+
+class BrokenConnection(FakeConnection):
+    """Connection lost after first row of second query"""
+
+    def cursor(self, name=None, cursor_factory=None):
+        return BrokenCursor(self)
+
+
+class BrokenCursor(FakeCursor):
+    def __iter__(self):
+        yield from super().__iter__()
+        if len(self.con.queries) > 1:
+            raise ConnectionError("connection lost")
+
+
+def test_failed_flatgeobuf_export_leaves_no_file(tmp_path):
+    params = RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="fgb"))
+    (
+        query_point,
+        query_line,
+        _,
+        point_schema,
+        line_schema,
+        _,
+    ) = extract_geometry_type_query(params, ogr_export=True)
+    file_path = str(tmp_path / "Export.fgb")
+    with pytest.raises(ConnectionError):
+        RawData.query2flatgeobuf(
+            BrokenConnection(),
+            [(query_point, point_schema), (query_line, line_schema)],
+            file_path,
+        )
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_geopackage_export_leaves_no_file(tmp_path):
+    params = RawDataCurrentParams(**dict(ALL_GEOMETRY_PARAMS, outputType="gpkg"))
+    (
+        query_point,
+        query_line,
+        _,
+        point_schema,
+        line_schema,
+        _,
+    ) = extract_geometry_type_query(params, ogr_export=True)
+    file_path = str(tmp_path / "Export.gpkg")
+    with pytest.raises(ConnectionError):
+        RawData.query2geopackage(
+            BrokenConnection(),
+            [
+                ("Export_point", "POINT", query_point, point_schema),
+                ("Export_line", "GEOMETRY", query_line, line_schema),
+            ],
+            file_path,
+        )
+    assert os.listdir(tmp_path) == []
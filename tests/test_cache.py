@@ -0,0 +1,197 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import os
+import time
+
+from src.cache import (
+    ExportCache,
+    FragmentCache,
+    InFlightExports,
+    request_fingerprint,
+)
+from src.validation.models import RawDataCurrentParams
+
+GEOMETRY = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [83.96919250488281, 28.194446860487773],
+            [83.99751663208006, 28.194446860487773],
+            [83.99751663208006, 28.214869548073377],
+            [83.96919250488281, 28.214869548073377],
+            [83.96919250488281, 28.194446860487773],
+        ]
+    ],
+}
+
+
+class FakeRedis:
+    """Subset of redis commands used by export cache and in flight exports"""
+
+    def __init__(self):
+        self.values, self.hashes, self.sorted_sets = {}, {}, {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def zadd(self, key, mapping):
+        self.sorted_sets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.sorted_sets.get(key, {}).pop(member, None)
+
+    def zrange(self, key, start, end):
+        members = sorted(self.sorted_sets.get(key, {}).items(), key=lambda m: m[1])
+        return [member for member, _ in members][start : end + 1]
+
+
+def test_request_fingerprint_is_canonical():
+    params = RawDataCurrentParams(
+        geometry=GEOMETRY,
+        file_name="first",
+        geometry_type=["point", "polygon"],
+        filters={"tags": {"all_geometry": {"building": ["yes", "house"]}}},
+    )
+    same_params = RawDataCurrentParams(
+        geometry=GEOMETRY,
+        file_name="second",
+        geometry_type=["polygon", "point"],
+        filters={"tags": {"all_geometry": {"building": ["house", "yes"]}}},
+    )
+    other_format = RawDataCurrentParams(
+        geometry=GEOMETRY, output_type="shp", geometry_type=["point", "polygon"]
+    )
+    assert request_fingerprint(params) == request_fingerprint(same_params)
+    assert request_fingerprint(params) != request_fingerprint(other_format)
+
+
+def test_export_cache_eviction(tmp_path):
+    export_cache = ExportCache(redis_client=FakeRedis(), max_size=250, ttl=60)
+    artifacts = []
+    for i in range(3):
+        artifact = os.path.join(tmp_path, f"export{i}.zip")
+        with open(artifact, "wb") as f:
+            f.write(b"0" * 100)
+        artifacts.append(artifact)
+        export_cache.set(f"key{i}", f"task{i}", {}, artifact, size=100)
+        time.sleep(0.01)
+        if i == 1:
+            assert export_cache.get("key0")["task_id"] == "task0"
+    # key1 is least recently used since key0 was read after it was cached
+    assert export_cache.get("key1") is None
+    assert not os.path.exists(artifacts[1])
+    assert export_cache.get("key2")["artifact"] == artifacts[2]
+
+    # api only reads cache , expired entry is left to worker
+    api_cache = ExportCache(redis_client=export_cache.redis, ttl=0, read_only=True)
+    assert api_cache.get("key0") is None
+    assert os.path.exists(artifacts[0])
+    os.remove(artifacts[2])
+    # disk of worker is not checked from api host
+    api_cache.ttl = 60
+    assert api_cache.get("key2")["task_id"] == "task2"
+    export_cache.ttl = 0
+    assert export_cache.get("key0") is None
+    assert not os.path.exists(artifacts[0])
+    assert export_cache.stats() == {
+        "hits": 3,
+        "misses": 3,
+        "hit_rate": 0.5,
+        "entries": 1,
+        "size_bytes": 100,
+    }
+    # worker removes entry whose artifact is gone from its disk
+    export_cache.ttl = 60
+    export_cache.evict()
+    assert export_cache.stats()["entries"] == 0
+
+
+def test_in_flight_exports_coalesce_identical_requests():
+    in_flight_exports = InFlightExports(redis_client=FakeRedis(), ttl=60)
+    key = request_fingerprint(RawDataCurrentParams(geometry=GEOMETRY))
+    assert in_flight_exports.claim(key, "task1") == "task1"
+    # requests received while task1 is running attach to it
+    assert in_flight_exports.claim(key, "task2") == "task1"
+    assert in_flight_exports.claim(key, "task3") == "task1"
+    # only the task which claimed the key can release it
+    in_flight_exports.release(key, "task2")
+    assert in_flight_exports.claim(key, "task4") == "task1"
+    in_flight_exports.release(key, "task1")
+    assert in_flight_exports.claim(key, "task5") == "task5"
+    assert in_flight_exports.stats() == {"coalesced": 3}
+
+
+def test_fragment_cache_eviction(tmp_path):
+    fragment_cache = FragmentCache(directory=str(tmp_path / "fragments"), max_size=250)
+    for i in range(3):
+        with open(tmp_path / f"part{i}", "wb") as f:
+            f.write(b"0" * 100)
+        fragment_cache.put(f"key{i}", str(tmp_path / f"part{i}"))
+        os.remove(tmp_path / f"part{i}")
+        os.utime(fragment_cache.path(f"key{i}"), (i, i))
+    destination = str(tmp_path / "read0")
+    assert fragment_cache.get("key0", destination) == destination
+    fragment_cache.evict()
+    # key1 is least recently used since key0 was read
+    assert fragment_cache.get("key1", str(tmp_path / "read1")) is None
+    assert not os.path.exists(tmp_path / "read1")
+    assert fragment_cache.get("key2", str(tmp_path / "read2")) is not None
+    assert fragment_cache.stats() == {"hits": 2, "misses": 1}
+
+
+def test_fragment_cache_eviction_while_reading(tmp_path):
+    fragment_cache = FragmentCache(directory=str(tmp_path / "fragments"), max_size=0)
+    with open(tmp_path / "part", "w") as f:
+        f.write("1\t0\t{}\n")
+    fragment_cache.put("key", str(tmp_path / "part"))
+    destination = str(tmp_path / "read")
+    assert fragment_cache.get("key", destination) == destination
+    # other export evicts the fragment before it is read
+    fragment_cache.evict()
+    assert not os.path.exists(fragment_cache.path("key"))
+    with open(destination) as f:
+        assert f.read() == "1\t0\t{}\n"
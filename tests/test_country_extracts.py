@@ -0,0 +1,157 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import io
+import json
+
+from src.country_extracts import (
+    FEATURE_COLLECTION_FOOTER,
+    FEATURE_COLLECTION_HEADER,
+    FeatureFilter,
+)
+from src.validation.models import RawDataCurrentParams
+
+FEATURES = [
+    {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [85.3, 27.7]},
+        "properties": {
+            "osm_id": 1,
+            "version": 1,
+            "tags": {"amenity": "school", "name": "School"},
+            "changeset": 10,
+            "timestamp": "2022-06-27T10:00:00",
+        },
+    },
+    {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [85.4, 27.7]},
+        "properties": {
+            "osm_id": 2,
+            "version": 1,
+            "tags": {"amenity": "bank"},
+            "changeset": 10,
+            "timestamp": "2022-06-27T10:00:00",
+        },
+    },
+    {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[85.3, 27.7], [85.4, 27.7], [85.4, 27.8], [85.3, 27.7]]],
+        },
+        "properties": {
+            "osm_id": 3,
+            "version": 2,
+            "tags": {"building": "yes", "addr:street": "Main"},
+            "changeset": 11,
+            "timestamp": "2022-06-27T10:00:00",
+        },
+    },
+]
+
+
+# relation which is neither line nor polygon
+COLLECTION = {
+    "type": "Feature",
+    "geometry": {
+        "type": "GeometryCollection",
+        "geometries": [
+            {"type": "Point", "coordinates": [85.3, 27.7]},
+            {"type": "LineString", "coordinates": [[85.3, 27.7], [85.4, 27.8]]},
+        ],
+    },
+    "properties": {
+        "osm_id": 4,
+        "version": 1,
+        "tags": {"type": "site", "name": "Site"},
+        "changeset": 12,
+        "timestamp": "2022-06-27T10:00:00",
+    },
+}
+
+
+def write_extract(path, features=FEATURES):
+    """writes features one per line like build_country_extract does"""
+    with open(path, "wb") as f:
+        f.write(FEATURE_COLLECTION_HEADER + b"\n")
+        f.write(",\n".join(json.dumps(feature) for feature in features).encode())
+        f.write(b"\n" + FEATURE_COLLECTION_FOOTER)
+
+
+def filtered(path, **params):
+    params["country_export"] = True
+    f = io.BytesIO()
+    FeatureFilter(RawDataCurrentParams.construct(**params)).write(path, f)
+    return json.loads(f.getvalue())["features"]
+
+
+def test_feature_filter_country_extract(tmp_path):
+    path = tmp_path / "Export.geojson"
+    write_extract(path)
+    # without filters extract is delivered as it is
+    assert filtered(path) == FEATURES
+
+    features = filtered(
+        path,
+        filters={
+            "tags": {
+                "point": {"amenity": ["school", "hospital"]},
+                "polygon": {"building": []},
+            },
+            "attributes": {"polygon": ["addr:street"]},
+        },
+    )
+    assert [feature["properties"]["osm_id"] for feature in features] == [1, 3]
+    assert features[0]["properties"] == FEATURES[0]["properties"]
+    assert features[1]["properties"] == {"osm_id": 3, "addr_street": "Main"}
+
+    features = filtered(
+        path,
+        geometry_type=["point"],
+        join_filter_type="AND",
+        filters={"tags": {"all_geometry": {"amenity": [], "name": []}}},
+    )
+    assert [feature["properties"]["osm_id"] for feature in features] == [1]
+
+
+def test_feature_filter_keeps_relations_like_database(tmp_path):
+    path = tmp_path / "Export.geojson"
+    write_extract(path, FEATURES + [COLLECTION])
+    # line and polygon relations are scanned once with same tags , every geometry is kept
+    features = filtered(path, filters={"tags": {"all_geometry": {"name": []}}})
+    assert [feature["properties"]["osm_id"] for feature in features] == [1, 4]
+    features = filtered(
+        path,
+        geometry_type=["line", "polygon"],
+        filters={"attributes": {"all_geometry": ["name"]}},
+    )
+    assert [feature["properties"] for feature in features] == [
+        {"osm_id": 3, "name": None},
+        {"osm_id": 4, "name": "Site"},
+    ]
+    # relations are split into line and polygon by their geometry type
+    features = filtered(
+        path,
+        filters={
+            "tags": {"line": {"name": []}, "polygon": {"building": []}},
+        },
+    )
+    assert [feature["properties"]["osm_id"] for feature in features] == [1, 2, 3]
+    assert filtered(path, geometry_type=["polygon"]) == [FEATURES[2]]
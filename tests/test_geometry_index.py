@@ -0,0 +1,74 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import pytest
+
+from src.geometry_index import GeometryIndex
+
+shapely = pytest.importorskip("shapely")
+
+
+def box_wkb(min_x, min_y, max_x, max_y):
+    return shapely.to_wkb(shapely.box(min_x, min_y, max_x, max_y))
+
+
+class FakeCursor:
+    """Answers geometry index queries from lists of rows"""
+
+    def __init__(self, grid, countries, import_date="2022-10-01 00:00:00"):
+        self.tables = {"grid": grid, "countries_un": countries}
+        self.import_date = import_date
+        self.executed = []
+
+    def execute(self, query):
+        self.executed.append(query)
+
+    def fetchone(self):
+        return (self.import_date,)
+
+    def fetchall(self):
+        return self.tables[self.executed[-1].split(" from ")[-1]]
+
+
+def test_geometry_index_lookup():
+    cur = FakeCursor(
+        grid=[(i, box_wkb(i, 0, i + 1, 1)) for i in range(10)],
+        countries=[(1, box_wkb(0, 0, 2, 1)), (2, box_wkb(2, 0, 10, 1))],
+    )
+    geometry_index = GeometryIndex()
+    geometry_index.refresh(cur)
+    request = geometry_index.to_shape(
+        {
+            "type": "Polygon",
+            "coordinates": [
+                [[1.5, 0.2], [4.5, 0.2], [4.5, 0.8], [1.5, 0.8], [1.5, 0.2]]
+            ],
+        }
+    )
+    assert geometry_index.grid_ids(request) == [(1,), (2,), (3,), (4,)]
+    # country with bigger share of the request comes first
+    assert geometry_index.country_ids(request) == [(2,), (1,)]
+
+    # loaded again only when import date changes
+    geometry_index.refresh(cur)
+    assert len(cur.executed) == 3
+    geometry_index.checked_at = 0
+    cur.import_date = "2022-10-02 00:00:00"
+    geometry_index.refresh(cur)
+    assert len(cur.executed) == 6
@@ -0,0 +1,142 @@
+# Copyright (C) 2021 Humanitarian OpenStreetmap Team
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import os
+import sqlite3
+import struct
+
+from src.writers.flatgeobuf import (
+    MAGIC_BYTES,
+    NODE_ITEM_SIZE,
+    FlatGeobufWriter,
+    level_bounds,
+)
+from src.writers.geopackage import GeoPackageWriter
+from src.writers.shapefile import SHAPE_POLYGON, ShapefileWriter
+from src.writers.wkb import MULTIPOLYGON, POLYGON, parse_wkb
+
+
+def polygon_wkb(rings):
+    wkb = struct.pack("<BII", 1, POLYGON, len(rings))
+    for ring in rings:
+        wkb += struct.pack("<I", len(ring))
+        wkb += b"".join(struct.pack("<2d", *point) for point in ring)
+    return wkb
+
+
+SQUARE = [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0), (0.0, 0.0)]
+
+
+def test_parse_wkb():
+    assert parse_wkb(polygon_wkb([SQUARE])) == (POLYGON, [SQUARE])
+    # big endian multipolygon with ewkb srid flag
+    ewkb = struct.pack(">BII", 0, MULTIPOLYGON | 0x20000000, 4326)
+    ewkb += struct.pack(">I", 1) + struct.pack(">BII", 0, POLYGON, 1)
+    ewkb += struct.pack(">I", len(SQUARE))
+    ewkb += b"".join(struct.pack(">2d", *point) for point in SQUARE)
+    assert parse_wkb(ewkb) == (MULTIPOLYGON, [[SQUARE]])
+
+
+def test_shapefile_writer_splits_files(tmp_path):
+    schema = {"osm_id": "int64", "building_levels": "str", "building_level": "str"}
+    path = os.path.join(tmp_path, "export_poly")
+    writer = ShapefileWriter(path, SHAPE_POLYGON, schema, max_file_size=1300)
+    for osm_id in range(3):
+        writer.write(polygon_wkb([SQUARE]), [osm_id, "2", None])
+    writer.close()
+    assert writer.paths == [f"{path}.shp", f"{path}_1.shp"]
+    assert writer.total_count == 3
+
+    with open(f"{path}.shp", "rb") as shp:
+        header = shp.read(100)
+        assert struct.unpack(">i", header[:4])[0] == 9994
+        # file length is stored in 16 bit words
+        assert struct.unpack(">i", header[24:28])[0] * 2 == os.path.getsize(
+            f"{path}.shp"
+        )
+        assert struct.unpack("<i", header[32:36])[0] == SHAPE_POLYGON
+    with open(f"{path}.dbf", "rb") as dbf:
+        header = dbf.read(32 + 32 * len(schema))
+        record_count = struct.unpack("<I", header[4:8])[0]
+        field_names = [
+            header[32 + 32 * i : 32 + 32 * i + 11].rstrip(b"\0")
+            for i in range(len(schema))
+        ]
+    assert record_count == 2
+    assert field_names == [b"osm_id", b"building_l", b"building_1"]
+
+
+def test_flatgeobuf_writer_index(tmp_path):
+    path = os.path.join(tmp_path, "export.fgb")
+    writer = FlatGeobufWriter(path, {"osm_id": "int64", "name": "str"})
+    for osm_id in range(20):
+        offset = float(osm_id * 2)
+        square = [(x + offset, y) for x, y in SQUARE]
+        writer.write(polygon_wkb([square]), [osm_id, None if osm_id % 2 else "é"])
+    writer.write(None, [99, "no geometry"])
+    writer.close()
+    assert writer.feature_count == 20
+    assert not os.path.exists(f"{path}.features")
+
+    node_count, bounds = level_bounds(20, 16)
+    assert (node_count, bounds) == (23, [(3, 23), (1, 3), (0, 1)])
+    with open(path, "rb") as fgb:
+        assert fgb.read(8) == MAGIC_BYTES
+        header_size = struct.unpack("<I", fgb.read(4))[0]
+        fgb.seek(header_size, 1)
+        index = fgb.read(NODE_ITEM_SIZE * node_count)
+        features = fgb.read()
+    nodes = [
+        struct.unpack_from("<4dQ", index, NODE_ITEM_SIZE * i) for i in range(node_count)
+    ]
+    # root covers whole extent and points to its children
+    assert nodes[0] == (0.0, 0.0, 39.0, 1.0, 1)
+    assert nodes[1][4] == 3 and nodes[2][4] == 19
+    # leaves points to size prefixed features one after another
+    offset = 0
+    for node in nodes[3:]:
+        assert node[4] == offset
+        offset += 4 + struct.unpack_from("<I", features, offset)[0]
+    assert offset == len(features)
+
+
+def test_geopackage_writer(tmp_path):
+    path = os.path.join(tmp_path, "export.gpkg")
+    writer = GeoPackageWriter(path, batch_size=2)
+    writer.create_table("export_poly", "GEOMETRY", {"osm_id": "int64", "name": "str"})
+    for osm_id in range(5):
+        envelope = (0.0, 0.0, 1.0, 1.0) if osm_id % 2 else None
+        writer.write("export_poly", polygon_wkb([SQUARE]), [osm_id, "a"], envelope)
+    writer.close()
+
+    con = sqlite3.connect(path)
+    assert con.execute("PRAGMA application_id").fetchone()[0] == 0x47504B47
+    assert con.execute(
+        "SELECT min_x, min_y, max_x, max_y, srs_id FROM gpkg_contents"
+    ).fetchall() == [(0.0, 0.0, 1.0, 1.0, 4326)]
+    geom, osm_id, name = con.execute(
+        'SELECT geom, osm_id, name FROM "export_poly" WHERE fid = 5'
+    ).fetchone()
+    assert (osm_id, name) == (4, "a")
+    assert geom[:4] == b"GP\x00\x03"
+    assert geom[40:] == polygon_wkb([SQUARE])
+    assert con.execute('SELECT count(*) FROM "rtree_export_poly_geom"').fetchone() == (
+        5,
+    )
+    con.close()